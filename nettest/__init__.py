@@ -1,7 +1,14 @@
 from .generate_pipeline import parse_recipe
-from .ensure_data import run_data_update
+from .ensure_data import run_data_update, stage_data
 from .train import run_step
 from .test import run_test
 from .execute_recipe import execute
 
-__all__ = ["parse_recipe", "run_data_update", "run_step", "run_test", "execute"]
+__all__ = [
+    "parse_recipe",
+    "run_data_update",
+    "stage_data",
+    "run_step",
+    "run_test",
+    "execute",
+]
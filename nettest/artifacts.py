@@ -0,0 +1,99 @@
+"""
+Content-addressed store for nets, models and results
+
+Artifacts are stored once (see store.py) and published where they are needed
+by hardlink, or by reflink or copy across filesystems:
+
+   scratch / "store" / "objects" / sha[:2] / sha : the content of an artifact
+   scratch / "store" / "steps" / step_sha.yaml   : the artifacts of a training step
+
+Nets are named nn-<first 12 of sha256>.nnue, so they can be looked up by that
+short sha directly in the store.
+"""
+
+import os
+import shutil
+import subprocess
+import yaml
+from pathlib import Path
+from .store import add_file, object_path, replace_with_link
+from .utils import MyDumper
+
+
+def artifact_store_dir():
+    return Path.cwd() / "scratch" / "store"
+
+
+def publish(source, destination):
+    """
+    Make source available as destination, without duplicating its content if possible
+    """
+    destination = Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        replace_with_link(source, destination)
+        return
+    except OSError:
+        pass
+    # e.g. another filesystem, a reflink (copy on write) is still free where supported
+    partial = destination.with_name(f"{destination.name}.{os.getpid()}.part")
+    if shutil.which("cp"):
+        subprocess.run(["cp", "--reflink=auto", str(source), str(partial)], check=True)
+    else:
+        shutil.copyfile(source, partial)
+    os.replace(partial, destination)
+
+
+def add_artifact(path):
+    """
+    Add path to the artifact store, and return its sha256
+    """
+    return add_file(artifact_store_dir(), path)
+
+
+def step_record_path(step_sha):
+    return artifact_store_dir() / "steps" / f"{step_sha}.yaml"
+
+
+def record_step(step_sha, record):
+    path = step_record_path(step_sha)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "w") as f:
+        yaml.dump(record, f, Dumper=MyDumper, default_flow_style=False, width=300)
+    os.replace(temp, path)
+
+
+def find_artifact(short_sha):
+    """
+    The stored artifact whose sha256 starts with short_sha (e.g. of nn-<short_sha>.nnue), or None
+    """
+    short_sha = short_sha.removeprefix("nn-").removesuffix(".nnue")
+    assert len(short_sha) >= 2, f"sha prefix {short_sha} is too short"
+    matches = list(object_path(artifact_store_dir(), short_sha).parent.glob(f"{short_sha}*"))
+    assert len(matches) <= 1, f"sha prefix {short_sha} is ambiguous"
+    return matches[0] if matches else None
+
+
+def step_artifacts(step_sha):
+    """
+    The artifacts of a completed training step, with at least
+    short_nnue, std_nnue (the path of the net) and checkpoint.
+    Falls back to the final.yaml of steps completed before the artifact store existed.
+    """
+    path = step_record_path(step_sha)
+    if path.exists():
+        with open(path) as f:
+            record = yaml.safe_load(f)
+        if Path(record["std_nnue"]).exists():
+            return record
+        # the published net was removed, use the stored content
+        stored = find_artifact(record["short_nnue"])
+        if stored is not None:
+            record["std_nnue"] = str(stored)
+            return record
+
+    final_yaml_file = Path.cwd() / "scratch" / step_sha / "final.yaml"
+    assert final_yaml_file.exists(), f"{final_yaml_file} does not exist"
+    with open(final_yaml_file) as f:
+        return yaml.safe_load(f)
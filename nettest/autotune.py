@@ -0,0 +1,155 @@
+"""
+Tune the data loader settings of the trainer
+
+The throughput of the nnue-pytorch data loader depends on --num-workers and
+--threads, in a way that is hard to predict for a given node. With
+
+   train:
+     autotune: true   # or e.g. {seconds: 10, workers: [16, 32, 64], threads: [2, 4, 8]}
+
+the data loader is briefly run on the binpacks and options of the step for
+a grid of settings, and the fastest is used. Results are cached in
+scratch/packages/autotune, per host, trainer sha and set of options.
+"""
+
+import hashlib
+import json
+import os
+import re
+import socket
+import yaml
+from pathlib import Path
+from .utils import execute, options_dict
+
+
+def measure_loader_throughput(
+    nnue_pytorch_dir, binpacks, run, workers, threads, seconds=30
+):
+    """
+    Run the data loader of the trainer on the binpacks with the options of the run,
+    and return the measured positions per second.
+    """
+    options = options_dict(run["other_options"])
+    probe = Path(__file__).resolve().with_name("loader_probe.py")
+    cmd = ["python", "-u", str(probe)]
+    # without features, the probe uses the default of the trainer
+    if "features" in options:
+        cmd += [f"--features={options['features']}"]
+    cmd += [
+        f"--batch-size={options.get('batch-size', 16384)}",
+        f"--num-workers={workers}",
+        f"--threads={threads}",
+        f"--seconds={seconds}",
+        f"--options={json.dumps(options)}",
+    ]
+    cmd += [str(binpack) for binpack in binpacks]
+    output = execute(
+        f"Measure data loader throughput ({workers} workers, {threads} threads)",
+        cmd,
+        nnue_pytorch_dir,
+        True,
+    )
+
+    # a failing probe (e.g. out of memory) gives no result, reported as RuntimeError
+    for line in output:
+        match = re.search(r"positions/s:\s*([0-9.]+)", line)
+        if match:
+            return float(match.group(1))
+    raise RuntimeError("Data loader throughput measurement did not report a result")
+
+
+def default_grid():
+    cpu_count = os.cpu_count() or 16
+    workers = sorted({max(1, cpu_count * f // 4) for f in (1, 2, 4, 6)})
+    threads = [2, 4, 8]
+    return workers, threads
+
+
+def autotune_path(trainer_sha, run, binpacks):
+    """
+    Cache file of the tuned settings, per host, trainer sha and option set
+    """
+    key = {
+        "options": options_dict(run["other_options"]),
+        "binpacks": sorted(Path(b).name for b in binpacks),
+    }
+    digest = hashlib.sha256(
+        json.dumps(key, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+    return (
+        Path.cwd()
+        / "scratch"
+        / "packages"
+        / "autotune"
+        / socket.gethostname()
+        / trainer_sha
+        / f"{digest}.yaml"
+    )
+
+
+def tune_loader(nnue_pytorch_dir, trainer_sha, binpacks, run, config):
+    """
+    The fastest (workers, threads) of the grid in config, measured or cached.
+    None if no setting could be measured, e.g. as the probe does not work with
+    this trainer, so that training proceeds with the configured settings.
+    """
+    path = autotune_path(trainer_sha, run, binpacks)
+    if path.exists():
+        with open(path) as f:
+            tuned = yaml.safe_load(f)
+        print(
+            f"Using tuned data loader settings: {tuned['workers']} workers, {tuned['threads']} threads"
+        )
+        return tuned["workers"], tuned["threads"]
+
+    workers_grid, threads_grid = default_grid()
+    workers_grid = config.get("workers", workers_grid)
+    threads_grid = config.get("threads", threads_grid)
+    seconds = config.get("seconds", 10)
+
+    results = []
+    for workers in workers_grid:
+        for threads in threads_grid:
+            try:
+                rate = measure_loader_throughput(
+                    nnue_pytorch_dir, binpacks, run, workers, threads, seconds
+                )
+            except Exception as e:
+                print(f"⚠️  Skipping {workers} workers, {threads} threads: {e}")
+                continue
+            results.append({"workers": workers, "threads": threads, "rate": rate})
+
+    if not results:
+        print("⚠️  No data loader setting could be measured, not tuning")
+        return None
+
+    best = max(results, key=lambda r: r["rate"])
+    print(f"\nData loader throughput on {socket.gethostname()}:")
+    print(f"{'workers':>8} {'threads':>8} {'positions/s':>14}")
+    for r in results:
+        print(f"{r['workers']:8d} {r['threads']:8d} {r['rate']:14.0f}")
+    print(f"Best: {best['workers']} workers, {best['threads']} threads")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "w") as f:
+        yaml.dump(
+            {"workers": best["workers"], "threads": best["threads"], "results": results},
+            f,
+            default_flow_style=False,
+        )
+    os.replace(temp, path)
+
+    return best["workers"], best["threads"]
+
+
+def loader_settings(environment, nnue_pytorch_dir, trainer_sha, binpacks, run):
+    """
+    The tuned (workers, threads) if the environment asks for autotuning, else None
+    """
+    config = environment.get("train", {}).get("autotune")
+    if not config:
+        return None
+    if config is True:
+        config = {}
+    return tune_loader(nnue_pytorch_dir, trainer_sha, binpacks, run, config)
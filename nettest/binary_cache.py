@@ -0,0 +1,181 @@
+"""
+Stockfish binaries for the CPU feature level of the host
+
+Stockfish is built for an explicit ARCH (not native), the best the host supports,
+so that binaries can be shared by all nodes with at least that feature level:
+
+   scratch / "packages" / "stockfish" / f"{sha}-{target}-{arch}" / "Stockfish" / "src" / "stockfish"
+
+At test time, the best arch for which the binaries are already available is used,
+building only if there is no compatible binary. Binaries can be moved to other
+clusters as bundles:
+
+   python -m nettest.binary_cache export bundle.tar.gz [SHA ...]
+   python -m nettest.binary_cache import bundle.tar.gz
+"""
+
+import platform
+import re
+import shutil
+import tarfile
+import tempfile
+from pathlib import Path
+from .build_cache import publish_binary
+from .git_mirror import read_file
+
+# Stockfish ARCH values, best first, with the CPU flags (of /proc/cpuinfo) they need
+X86_ARCHS = [
+    (
+        "x86-64-avx512icl",
+        {"avx512f", "avx512bw", "avx512vl", "avx512_vnni", "avx512_vbmi", "avx512_vbmi2",
+         "avx512ifma", "avx512_bitalg", "avx512_vpopcntdq", "gfni", "vaes", "vpclmulqdq"},
+    ),
+    ("x86-64-vnni512", {"avx512f", "avx512bw", "avx512dq", "avx512vl", "avx512_vnni"}),
+    ("x86-64-avx512", {"avx512f", "avx512bw"}),
+    ("x86-64-avxvnni", {"avx_vnni", "avx2", "bmi2"}),
+    ("x86-64-bmi2", {"avx2", "bmi2"}),
+    ("x86-64-avx2", {"avx2"}),
+    ("x86-64-sse41-popcnt", {"sse4_1", "popcnt"}),
+    ("x86-64-modern", {"sse4_1", "popcnt"}),
+    ("x86-64-ssse3", {"ssse3"}),
+    ("x86-64-sse3-popcnt", {"pni", "popcnt"}),
+    ("x86-64", set()),
+]
+ARM_ARCHS = [
+    ("armv8-dotprod", {"asimddp"}),
+    ("armv8", set()),
+]
+
+# stockfish/<sha>-<target>-<arch>/stockfish, nothing that could leave stockfish_root
+BUNDLE_RE = re.compile(
+    r"^stockfish/([0-9a-f]{7,40}-[A-Za-z0-9_-]+-(?:%s))/stockfish$"
+    % "|".join(re.escape(arch) for arch, _ in X86_ARCHS + ARM_ARCHS)
+)
+
+
+def cpu_flags():
+    """
+    The CPU flags (x86) or features (arm) of the host
+    """
+    cpuinfo = Path("/proc/cpuinfo")
+    if not cpuinfo.exists():
+        return set()
+    for line in cpuinfo.read_text().splitlines():
+        if line.startswith(("flags", "Features")):
+            return set(line.split(":", 1)[1].split())
+    return set()
+
+
+def host_archs(flags, machine=None):
+    """
+    The Stockfish ARCH values the host can run, best first
+    """
+    machine = machine or platform.machine()
+    if machine in ("x86_64", "AMD64"):
+        archs = X86_ARCHS
+    elif machine in ("aarch64", "arm64"):
+        archs = ARM_ARCHS
+    else:
+        return ["native"]
+    return [arch for arch, needed in archs if needed <= flags]
+
+
+def makefile_archs(owner, sha):
+    """
+    The ARCH values known to the Makefile of Stockfish at sha
+    """
+    return set(re.findall(r"[\w.-]+", read_file(owner, "Stockfish", sha, "src/Makefile")))
+
+
+def stockfish_dir(sha, target_build, arch):
+    return Path.cwd() / "scratch" / "packages" / "stockfish" / f"{sha}-{target_build}-{arch}"
+
+
+def stockfish_binary(sha, target_build, arch):
+    return stockfish_dir(sha, target_build, arch) / "Stockfish" / "src" / "stockfish"
+
+
+def choose_arch(builds, flags=None, machine=None):
+    """
+    The arch to use for all builds ((owner, sha, target_build) tuples): the best the
+    host supports for which all binaries exist, otherwise the best the host and the
+    Makefiles support. The Makefiles (and so the sources) are only needed in the
+    latter case, existing binaries (e.g. imported) are used without network access.
+    """
+    if flags is None:
+        flags = cpu_flags()
+    candidates = host_archs(flags, machine)
+    for arch in candidates:
+        if all(stockfish_binary(sha, target, arch).exists() for _, sha, target in builds):
+            return arch
+
+    for owner, sha, _ in builds:
+        known = makefile_archs(owner, sha)
+        candidates = [arch for arch in candidates if arch in known]
+    assert candidates, f"No Stockfish ARCH for this host supported by {builds}"
+    return candidates[0]
+
+
+def export_bundle(bundle, shas=None):
+    """
+    Write the available binaries (of the given shas) to a tarball, returns their number
+    """
+    stockfish_root = Path.cwd() / "scratch" / "packages" / "stockfish"
+    count = 0
+    with tarfile.open(bundle, "w:gz") as tar:
+        for binary in sorted(stockfish_root.glob("*/Stockfish/src/stockfish")):
+            name = binary.parents[2].name
+            if not any(name.endswith(f"-{arch}") for arch, _ in X86_ARCHS + ARM_ARCHS):
+                continue  # e.g. built for ARCH=native
+            if shas and not any(name.startswith(f"{sha}-") for sha in shas):
+                continue
+            tar.add(binary, arcname=f"stockfish/{name}/stockfish")
+            count += 1
+    print(f"📦 Exported {count} Stockfish binaries to {bundle}")
+    return count
+
+
+def import_bundle(bundle):
+    """
+    Add the binaries of a tarball that are not yet available, returns their number
+    """
+    stockfish_root = Path.cwd() / "scratch" / "packages" / "stockfish"
+    stockfish_root.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with tarfile.open(bundle, "r:*") as tar, tempfile.TemporaryDirectory(
+        dir=stockfish_root.parent
+    ) as temp:
+        for member in tar.getmembers():
+            match = BUNDLE_RE.match(member.name)
+            if not member.isfile() or not match:
+                print(f"⚠️  Skipping {member.name}")
+                continue
+            destination = stockfish_root / match.group(1) / "Stockfish" / "src" / "stockfish"
+            if destination.exists():
+                continue
+            extracted = Path(temp) / match.group(1)
+            with tar.extractfile(member) as source, open(extracted, "wb") as f:
+                shutil.copyfileobj(source, f)
+            extracted.chmod(0o755)
+            publish_binary(extracted, destination)
+            count += 1
+    print(f"📦 Imported {count} Stockfish binaries from {bundle}")
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export or import Stockfish binaries.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write binaries to a tarball")
+    export_parser.add_argument("bundle", help="Tarball to write")
+    export_parser.add_argument("shas", nargs="*", help="Stockfish shas, default all")
+    import_parser = subparsers.add_parser("import", help="Add binaries from a tarball")
+    import_parser.add_argument("bundle", help="Tarball to read")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_bundle(args.bundle, args.shas)
+    else:
+        import_bundle(args.bundle)
@@ -0,0 +1,67 @@
+"""
+Bind a torchrun rank to the cores and memory local to its GPU
+
+Standalone script, executed by torchrun in place of the training script, e.g.
+
+   torchrun --nproc-per-node=4 bind_rank.py ddp_launcher.py train.py ...
+
+The placement of each local rank, and whether numactl can be used, is read from
+the NETTEST_PLACEMENT environment variable (see gpu_topology.py). The rank is
+replaced by the training script, bound with numactl if possible, or with a CPU
+affinity mask otherwise. The data loader workers inherit the binding.
+"""
+
+import json
+import os
+import sys
+
+
+def parse_cpulist(cpulist):
+    """
+    The set of cpus in a list such as "0-3,8,10-11"
+    """
+    cpus = set()
+    for part in cpulist.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def bound_cmd(place, cmd, use_numactl):
+    if place is None:
+        return cmd
+    if use_numactl:
+        # cores only, e.g. without those reserved for the monitor
+        if place.get("physcpubind") and place.get("cpus") is not None:
+            numactl = ["numactl", f"--physcpubind={place['cpus']}"]
+            if place.get("node") is not None:
+                numactl.append(f"--membind={place['node']}")
+            return numactl + cmd
+        if place.get("node") is not None:
+            node = place["node"]
+            return ["numactl", f"--cpunodebind={node}", f"--membind={node}"] + cmd
+        if place.get("cpus") is not None:
+            return ["numactl", f"--physcpubind={place['cpus']}"] + cmd
+    elif place.get("cpus") is not None:
+        os.sched_setaffinity(0, parse_cpulist(place["cpus"]))
+    return cmd
+
+
+def main():
+    config = json.loads(os.environ.get("NETTEST_PLACEMENT", "{}"))
+    placement = config.get("placement", [])
+    local_rank = int(os.environ.get("LOCAL_RANK", "0"))
+    place = placement[local_rank] if local_rank < len(placement) else None
+
+    cmd = bound_cmd(
+        place, [sys.executable, "-u"] + sys.argv[1:], config.get("numactl", False)
+    )
+    print(f"Rank {local_rank} placement {place}: {' '.join(cmd)}", flush=True)
+    os.execvp(cmd[0], cmd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+Bounded caches for binpacks
+
+Binpacks that are kept compressed at rest are decompressed for the trainer
+into a cache directory of bounded size, instead of next to the compressed file.
+Optionally, binpacks are staged to node-local storage (e.g. an SSD) before
+training, so the data loader does not read from a shared filesystem.
+Least recently used files are evicted to stay within the size limit, but never
+the files needed by the current request, nor those still in use by another
+process (e.g. a running trainer), see binpacks_in_use.
+"""
+
+import fcntl
+import gzip
+import hashlib
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+import zstandard as zstd
+from .utils import execute
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(value):
+    """
+    Size in bytes, from e.g. 123456, "500G" or "1.5T"
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip().upper().rstrip("B")
+    unit = value[-1] if value and value[-1] in SIZE_UNITS else ""
+    number = value[: len(value) - len(unit)]
+    return int(float(number) * SIZE_UNITS[unit])
+
+
+@contextmanager
+def cache_lock(cache_dir):
+    """
+    Serialize cache updates of processes on the same node
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with open(cache_dir / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def cached_name(source):
+    """
+    Name of the cached copy of source, changes if source changes
+    """
+    stat = source.stat()
+    key = f"{source.resolve()}:{stat.st_size}:{stat.st_mtime_ns}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    name = source.name
+    for suffix in (".zst", ".gz"):
+        name = name.removesuffix(suffix)
+    return f"{digest}-{name}"
+
+
+def cache_entries(cache_dir):
+    return [
+        p
+        for p in cache_dir.iterdir()
+        if p.is_file() and not p.name.startswith(".") and not p.name.endswith(".part")
+    ]
+
+
+def in_use_marker(entry):
+    return entry.with_name(f".{entry.name}.inuse")
+
+
+def mark_in_use(entry, in_use):
+    """
+    Take a shared lock on the in-use marker of entry, appending the open marker to
+    in_use. The entry is not evicted until the marker is closed (or the process ends).
+    """
+    marker = open(in_use_marker(entry), "a")
+    fcntl.flock(marker, fcntl.LOCK_SH)
+    in_use.append(marker)
+
+
+def is_in_use(entry):
+    """
+    Whether a process holds the in-use marker of entry
+    """
+    try:
+        marker = open(in_use_marker(entry), "r")
+    except FileNotFoundError:
+        return False
+    with marker:
+        try:
+            fcntl.flock(marker, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+    return False
+
+
+def evict(cache_dir, max_bytes, keep, needed_bytes):
+    """
+    Evict least recently used entries not in keep and not in use, until needed_bytes fit
+    """
+    entries = sorted(cache_entries(cache_dir), key=lambda p: p.stat().st_mtime)
+    used = sum(p.stat().st_size for p in entries)
+    for entry in entries:
+        if used + needed_bytes <= max_bytes:
+            break
+        if entry.name in keep or is_in_use(entry):
+            continue
+        size = entry.stat().st_size
+        print(f"Evicting {entry} ({size / 1e9:.1f} GB) from the binpack cache")
+        entry.unlink()
+        in_use_marker(entry).unlink(missing_ok=True)
+        used -= size
+    if used + needed_bytes > max_bytes:
+        print(
+            f"⚠️  Binpack cache {cache_dir} needs {(used + needed_bytes) / 1e9:.1f} GB,"
+            f" more than its limit of {max_bytes / 1e9:.1f} GB"
+        )
+
+
+def cache_files_locked(
+    cache_dir, max_bytes, sources, fill, expected_size, keep=(), in_use=None
+):
+    """
+    As cache_files, for a caller holding the cache lock.
+    Entries named in keep are not evicted either.
+    """
+    names = [cached_name(source) for source in sources]
+    missing = [
+        (source, name)
+        for source, name in zip(sources, names)
+        if not (cache_dir / name).exists()
+    ]
+
+    needed_bytes = sum(expected_size(source) for source, _ in missing)
+    evict(cache_dir, max_bytes, set(names) | set(keep), needed_bytes)
+
+    for source, name in missing:
+        destination = cache_dir / name
+        partial = destination.with_name(destination.name + ".part")
+        print(f"Caching {source} as {destination}", flush=True)
+        fill(source, partial)
+        os.replace(partial, destination)
+
+    # mark as recently used
+    paths = [cache_dir / name for name in names]
+    for path in paths:
+        os.utime(path)
+        # while the cache lock is held, so it can not be evicted in between
+        if in_use is not None:
+            mark_in_use(path, in_use)
+
+    return paths
+
+
+def cache_files(cache_dir, max_bytes, sources, fill, expected_size, in_use=None):
+    """
+    Make the sources available in cache_dir, and return the cached paths.
+    fill(source, destination) creates the cached copy,
+    expected_size(source) estimates its size before it is created.
+    If in_use is a list, the cached paths are marked in use (see mark_in_use).
+    """
+    cache_dir = Path(cache_dir)
+    with cache_lock(cache_dir):
+        return cache_files_locked(
+            cache_dir, max_bytes, sources, fill, expected_size, in_use=in_use
+        )
+
+
+def decompressed_size(source):
+    """
+    Size of source once decompressed, from the zstd frame header if available
+    """
+    if source.suffix == ".zst":
+        with open(source, "rb") as f:
+            size = zstd.frame_content_size(f.read(18))
+        if size >= 0:
+            return size
+    # unknown, binpacks typically compress about 3x
+    return 3 * source.stat().st_size
+
+
+def decompress_into(source, destination):
+    with open(destination, "wb") as decompressed:
+        if source.suffix == ".zst":
+            with open(source, "rb") as compressed:
+                zstd.ZstdDecompressor().copy_stream(compressed, decompressed)
+        else:
+            with gzip.open(source, "rb") as gzfile:
+                shutil.copyfileobj(gzfile, decompressed, 1 << 20)
+
+
+def copy_into(source, destination):
+    shutil.copyfile(source, destination)
+
+
+def file_size(source):
+    return source.stat().st_size
+
+
+def compressed_source(full_path):
+    for suffix in (".zst", ".gz"):
+        candidate = Path(str(full_path) + suffix)
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def binpack_cache_dir(cache_config):
+    return Path(cache_config.get("path", Path.cwd() / "data" / ".cache" / "binpacks"))
+
+
+def binpack_paths(environment, binpacks, in_use=None):
+    """
+    The paths from which the trainer reads the binpacks.
+
+    Binpacks that are compressed at rest are decompressed into the bounded cache
+    if the environment configures train: binpack_cache: {size: ..., path: ...},
+    and next to the compressed file otherwise.
+    With train: staging: {size: ..., path: ...} all binpacks are copied
+    (or directly decompressed) to that node-local path first.
+    If in_use is a list, the cached or staged paths are marked in use, see binpacks_in_use.
+    """
+    data_dir = Path.cwd() / "data"
+    train = (environment or {}).get("train", {})
+    cache_config = train.get("binpack_cache")
+    staging_config = train.get("staging")
+
+    paths = {}
+    compressed = {}
+    for binpack in binpacks:
+        full_path = data_dir / binpack
+        if full_path.exists():
+            paths[binpack] = full_path
+            continue
+        source = compressed_source(full_path)
+        assert source is not None, f"The following binpack could not be found: {binpack}"
+        if cache_config is None and staging_config is None:
+            if source.suffix == ".zst":
+                cmd = ["zstd", "-d", str(source), "-o", str(full_path)]
+                execute("Uncompress binpack.zst", cmd, data_dir, False)
+            else:
+                decompress_into(source, full_path)
+            paths[binpack] = full_path
+        else:
+            compressed[binpack] = source
+
+    if staging_config is not None:
+        # copy the uncompressed ones, and decompress the others straight to the staging area
+        staging_dir = Path(staging_config["path"])
+        staging_size = parse_size(staging_config["size"])
+        with cache_lock(staging_dir):
+            staged = cache_files_locked(
+                staging_dir,
+                staging_size,
+                list(paths.values()),
+                copy_into,
+                file_size,
+                keep=[cached_name(source) for source in compressed.values()],
+                in_use=in_use,
+            )
+            paths.update(zip(list(paths.keys()), staged))
+            staged = cache_files_locked(
+                staging_dir,
+                staging_size,
+                list(compressed.values()),
+                decompress_into,
+                decompressed_size,
+                keep=[path.name for path in paths.values()],
+                in_use=in_use,
+            )
+            paths.update(zip(compressed.keys(), staged))
+    elif compressed:
+        cached = cache_files(
+            binpack_cache_dir(cache_config),
+            parse_size(cache_config["size"]),
+            list(compressed.values()),
+            decompress_into,
+            decompressed_size,
+            in_use=in_use,
+        )
+        paths.update(zip(compressed.keys(), cached))
+
+    return [paths[binpack] for binpack in binpacks]
+
+
+@contextmanager
+def binpacks_in_use(environment, binpacks):
+    """
+    As binpack_paths, the cached or staged binpacks are not evicted by other
+    processes until the end of the with block
+    """
+    in_use = []
+    try:
+        yield binpack_paths(environment, binpacks, in_use)
+    finally:
+        for marker in in_use:
+            marker.close()
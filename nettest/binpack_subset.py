@@ -0,0 +1,128 @@
+"""
+Chunk-aligned subsets of binpacks
+
+A binpack is a sequence of chunks, each starting with the magic b"BINP" and the
+little-endian uint32 size of the chunk data. Any selection of whole chunks is a
+valid binpack, which allows cheap, deterministic subsets for quick experiments,
+selected in a training step as e.g.
+
+   run:
+     binpack_subset:
+       fraction: 0.01   # of the data, measured in bytes
+       mode: prefix     # or sample, a seeded random selection of chunks
+       seed: 42
+
+Subsets are cached in data/.subsets, keyed by the content of the source binpack.
+"""
+
+import hashlib
+import os
+import random
+import struct
+from pathlib import Path
+from .ensure_data import load_manifest
+from .utils import sha256sum
+
+CHUNK_HEADER = struct.Struct("<4sI")
+CHUNK_MAGIC = b"BINP"
+
+
+def read_chunk_index(path):
+    """
+    List of (offset, size) of the chunks in a binpack, size includes the header
+    """
+    index = []
+    offset = 0
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(CHUNK_HEADER.size)
+            if not header:
+                break
+            if len(header) < CHUNK_HEADER.size:
+                raise ValueError(f"Truncated chunk header at offset {offset} in {path}")
+            magic, size = CHUNK_HEADER.unpack(header)
+            if magic != CHUNK_MAGIC:
+                raise ValueError(f"Invalid chunk at offset {offset} in {path}")
+            index.append((offset, CHUNK_HEADER.size + size))
+            offset += CHUNK_HEADER.size + size
+            f.seek(offset)
+    return index
+
+
+def select_chunks(index, fraction, mode="prefix", seed=0):
+    """
+    Select about fraction of the chunks, at least one
+    """
+    assert 0 < fraction <= 1, f"binpack subset fraction must be in (0, 1], got {fraction}"
+    if mode == "prefix":
+        target = fraction * sum(size for _, size in index)
+        selected = []
+        total = 0
+        for chunk in index:
+            if selected and total >= target:
+                break
+            selected.append(chunk)
+            total += chunk[1]
+        return selected
+    elif mode == "sample":
+        count = max(1, round(fraction * len(index)))
+        chosen = random.Random(seed).sample(range(len(index)), count)
+        return [index[i] for i in sorted(chosen)]
+    else:
+        raise ValueError(f"Unknown binpack subset mode: {mode}")
+
+
+def write_chunks(source, destination, chunks):
+    with open(source, "rb") as fin, open(destination, "wb") as fout:
+        for offset, size in chunks:
+            fin.seek(offset)
+            fout.write(fin.read(size))
+
+
+def binpack_digest(binpack, path):
+    """
+    Content hash of a binpack, from the data manifest if it is recorded there
+    """
+    owner, repo, filename = binpack.split("/", 2)
+    manifest = load_manifest(owner, repo)
+    for name in (filename, f"{filename}.zst", f"{filename}.gz"):
+        if name in manifest:
+            return manifest[name]["sha256"]
+    return sha256sum(path)
+
+
+def subset_binpack(binpack, path, config):
+    """
+    Return the path of the subset of binpack (available at path) described by config
+    """
+    fraction = float(config["fraction"])
+    mode = config.get("mode", "prefix")
+    seed = int(config.get("seed", 0))
+
+    key = f"{binpack_digest(binpack, path)}:{mode}:{fraction}:{seed}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    subset_dir = Path.cwd() / "data" / ".subsets"
+    subset = subset_dir / f"{digest}-{Path(binpack).name}"
+    if subset.exists():
+        return subset
+
+    subset_dir.mkdir(parents=True, exist_ok=True)
+    index = read_chunk_index(path)
+    chunks = select_chunks(index, fraction, mode, seed)
+    partial = subset.with_name(f"{subset.name}.{os.getpid()}.part")
+    write_chunks(path, partial, chunks)
+    os.replace(partial, subset)
+    print(
+        f"Binpack subset {subset}: {len(chunks)} of {len(index)} chunks of {binpack} ({mode})",
+        flush=True,
+    )
+    return subset
+
+
+def subset_binpacks(binpacks, paths, config):
+    """
+    Subsets of all binpacks of a step, if the step asks for it
+    """
+    if not config:
+        return paths
+    return [subset_binpack(b, p, config) for b, p in zip(binpacks, paths)]
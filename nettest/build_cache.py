@@ -0,0 +1,200 @@
+"""
+Faster builds of the external tools
+
+- compilation goes through ccache (if installed), with the cache in
+  scratch / "packages" / "ccache" unless CCACHE_DIR is set. It hardly helps a
+  Stockfish profile-build, built in a fresh directory with new profile data each time.
+- binaries are reused for shas with the same sources (git tree), target, arch and
+  compiler, as their (PGO) build would give the same result:
+  scratch / "packages" / "reuse" / package / key / binary
+- the duration of each build is appended to scratch / "packages" / "build_times.yaml"
+- concurrent processes (possibly on other nodes) do not build the same target,
+  the first takes a lock file next to it, the others wait and use its result
+"""
+
+import hashlib
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import uuid
+import yaml
+from contextlib import contextmanager
+from pathlib import Path
+from .artifacts import publish
+from .git_mirror import source_tree
+
+
+def packages_dir():
+    return Path.cwd() / "scratch" / "packages"
+
+
+def use_ccache():
+    return shutil.which("ccache") is not None
+
+
+def build_env():
+    """
+    Environment for builds, with ccache as compiler launcher for cmake, if available
+    """
+    env = os.environ.copy()
+    if use_ccache():
+        env.setdefault("CCACHE_DIR", str(packages_dir() / "ccache"))
+        env.setdefault("CMAKE_C_COMPILER_LAUNCHER", "ccache")
+        env.setdefault("CMAKE_CXX_COMPILER_LAUNCHER", "ccache")
+    return env
+
+
+def compiler_args(variable, compiler="g++"):
+    """
+    make arguments setting the compiler variable to go through ccache, if available
+    """
+    return [f"{variable}=ccache {compiler}"] if use_ccache() else []
+
+
+def compiler_signature(compiler="g++"):
+    """
+    What, besides the sources and the options (e.g. ARCH), determines a build
+    """
+    content = platform.machine()
+    try:
+        version = subprocess.run(
+            [compiler, "--version"], capture_output=True, text=True, check=True
+        )
+        content += version.stdout
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def reuse_key(owner, repo, sha, path, *parts):
+    """
+    Key of the build of path (e.g. src) of owner/repo at sha, with the other parts (e.g. target)
+    """
+    content = "\n".join([source_tree(owner, repo, sha, path), *map(str, parts)])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def reuse_path(package, key, name):
+    return packages_dir() / "reuse" / package / key / name
+
+
+def publish_binary(source, destination):
+    publish(source, destination)
+    shutil.copymode(source, destination)
+
+
+def record_build(package, sha, seconds, how):
+    """
+    Append the duration of an ensure_* call that did work, how: built or reused
+    """
+    path = packages_dir() / "build_times.yaml"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    record = {
+        "package": package,
+        "sha": sha,
+        "seconds": round(seconds, 1),
+        "how": how,
+        "ccache": use_ccache(),
+        "date": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+    }
+    # a list item with a flow mapping on one line, appending keeps the file a valid list
+    line = yaml.dump([record], default_flow_style=None, sort_keys=False, width=1 << 16)
+    # a single short append, so concurrent builds do not garble the file
+    with open(path, "a") as f:
+        f.write(line)
+
+
+def stale_lock(lock_file, stale_after):
+    """
+    The inode of the lock if it is stale: its process is gone (known on the same host)
+    or its heartbeat stopped. None otherwise.
+    """
+    try:
+        with open(lock_file) as f:
+            stat = os.fstat(f.fileno())
+            owner = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return None
+    if owner.get("host") == socket.gethostname():
+        try:
+            os.kill(owner["pid"], 0)
+        except ProcessLookupError:
+            return stat.st_ino
+        except (KeyError, PermissionError):
+            pass
+    if time.time() - stat.st_mtime > stale_after:
+        return stat.st_ino
+    return None
+
+
+def remove_lock(lock_file, inode):
+    """
+    Remove the lock file if it is still the one with inode, returns True if removed.
+    It is first renamed, atomically, so that it can not be confused with a newer lock.
+    """
+    removed = lock_file.with_name(f"{lock_file.name}.{uuid.uuid4()}.removed")
+    try:
+        os.rename(lock_file, removed)
+    except FileNotFoundError:
+        return False
+    if removed.stat().st_ino == inode:
+        removed.unlink()
+        return True
+    # a newer lock of another process, put it back
+    try:
+        os.link(removed, lock_file)
+    except FileExistsError:
+        pass
+    removed.unlink()
+    return False
+
+
+@contextmanager
+def build_lock(target_dir, poll=5, heartbeat=60, stale_after=600):
+    """
+    Hold the lock for building target_dir, waiting while another process holds it
+    """
+    lock_file = target_dir.with_name(f"{target_dir.name}.lock")
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    content = yaml.dump({"host": socket.gethostname(), "pid": os.getpid()})
+    waiting = False
+    while True:
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            pass
+        inode = stale_lock(lock_file, stale_after)
+        if inode is not None:
+            if remove_lock(lock_file, inode):
+                print(f"⚠️  Removed stale lock {lock_file}")
+            continue
+        if not waiting:
+            print(f"⏳ Waiting for the build of {target_dir.name} by another process")
+            waiting = True
+        time.sleep(poll)
+
+    os.write(fd, content.encode("utf-8"))
+    inode = os.fstat(fd).st_ino
+
+    # refresh the mtime (of this lock only), so others can tell a long build from a
+    # dead one on another node
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(heartbeat):
+            os.utime(fd)
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        remove_lock(lock_file, inode)
+        os.close(fd)
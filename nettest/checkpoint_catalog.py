@@ -0,0 +1,135 @@
+"""
+Catalog of the checkpoints of a training run
+
+   scratch / sha / "run" / "catalog.yaml" : path, epoch and mtime of each checkpoint
+
+Status queries (most recent checkpoint, epochs trained) read the catalog instead
+of scanning the run directory and loading multi-GB checkpoints. The catalog is
+refreshed after training. As a run may be killed before that, the catalog is
+marked stale before training starts, and rescanned if it is stale, missing or
+out of date. A rescan only loads new or modified checkpoints.
+"""
+
+import os
+import re
+from fnmatch import fnmatch
+import torch
+import yaml
+from pathlib import Path
+
+CATALOG = "catalog.yaml"
+
+
+def checkpoint_epoch(path):
+    """
+    The epoch stored in a checkpoint, from its name if possible
+    """
+    match = re.search(r"epoch=(\d+)", path.name)
+    if match:
+        return int(match.group(1))
+    try:
+        # memory map, only the epoch is needed, not the weights
+        ckpt = torch.load(path, map_location="cpu", mmap=True)
+    except (RuntimeError, TypeError):
+        ckpt = torch.load(path, map_location="cpu")
+    return int(ckpt["epoch"])
+
+
+def load_catalog(run_dir):
+    """
+    The checkpoints in the catalog, None if there is no usable catalog
+    """
+    path = Path(run_dir) / CATALOG
+    if not path.exists():
+        return None
+    with open(path) as f:
+        catalog = yaml.safe_load(f) or {}
+    if catalog.get("stale", True):
+        return None
+    return catalog.get("checkpoints", {})
+
+
+def read_checkpoints(run_dir):
+    """
+    The checkpoints in the catalog, also if it is stale
+    """
+    path = Path(run_dir) / CATALOG
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        catalog = yaml.safe_load(f) or {}
+    return catalog.get("checkpoints", {})
+
+
+def save_catalog(run_dir, checkpoints, stale=False):
+    path = Path(run_dir) / CATALOG
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "w") as f:
+        yaml.dump(
+            {"stale": stale, "checkpoints": checkpoints}, f, default_flow_style=False
+        )
+    os.replace(temp, path)
+
+
+def mark_stale(run_dir):
+    """
+    Checkpoints are about to be written, the catalog must be refreshed before use
+    """
+    run_dir = Path(run_dir)
+    run_dir.mkdir(parents=True, exist_ok=True)
+    save_catalog(run_dir, read_checkpoints(run_dir), stale=True)
+
+
+def refresh_catalog(run_dir):
+    """
+    Scan the run directory, and record new or modified checkpoints in the catalog
+    """
+    run_dir = Path(run_dir)
+    if not run_dir.exists():
+        return {}
+
+    catalog = read_checkpoints(run_dir)
+    refreshed = {}
+    for path in run_dir.rglob("*.ckpt"):
+        mtime = path.stat().st_mtime_ns
+        entry = catalog.get(str(path))
+        if entry is None or entry["mtime"] != mtime:
+            entry = {"epoch": checkpoint_epoch(path), "mtime": mtime}
+        refreshed[str(path)] = entry
+
+    save_catalog(run_dir, refreshed)
+    return refreshed
+
+
+def is_current(path, entry):
+    try:
+        return path.stat().st_mtime_ns == entry["mtime"]
+    except OSError:
+        return False
+
+
+def latest_checkpoint(run_dir, names=("last.ckpt",)):
+    """
+    The most recent checkpoint matching one of the names (glob patterns),
+    and its epoch, or (None, None)
+    """
+    catalog = load_catalog(run_dir)
+    for attempt in range(2):
+        if catalog is None:
+            catalog = refresh_catalog(run_dir)
+
+        candidates = [
+            (Path(path), entry)
+            for path, entry in catalog.items()
+            if any(fnmatch(Path(path).name, name) for name in names)
+        ]
+        if all(is_current(path, entry) for path, entry in candidates):
+            break
+        # the catalog is out of date, rebuild it
+        catalog = None
+
+    if not candidates:
+        return None, None
+
+    path, entry = max(candidates, key=lambda c: c[1]["mtime"])
+    return path, entry["epoch"]
@@ -0,0 +1,167 @@
+"""
+Early abort of training steps that diverge from earlier runs of the same lineage
+
+Steps of the same lineage have the same configuration, except for the values of
+the trainer options tuned by the optimizer (e.g. --lr). Their validation loss
+curves are collected in an envelope
+
+   scratch / "envelopes" / lineage.yaml
+
+and, with an environment section
+
+   train:
+     early_abort:
+       tolerance: 0.05   # relative margin above the worst earlier run
+       patience: 3       # consecutive epochs outside the envelope before aborting
+       min_runs: 2       # earlier runs needed at an epoch to judge it
+       tuned: [lr, ...]  # options whose values may differ, default TUNED_OPTIONS
+
+a run whose validation loss stays above the envelope is stopped, and the step is
+marked as failed (scratch / sha / "failed.yaml") instead of final.
+"""
+
+import hashlib
+import json
+import math
+import os
+import yaml
+from pathlib import Path
+from .train_metrics import parse_progress
+from .utils import options_dict
+
+
+# trainer options tuned by the optimizer (see optimize/optimize.py), values of
+# other options (e.g. --features or --batch-size) make losses incomparable
+TUNED_OPTIONS = ["lr", "gamma", "start-lambda", "end-lambda", "pc-y1", "pc-y2", "pc-y3"]
+
+
+def lineage_key(step, tuned=TUNED_OPTIONS):
+    """
+    Key of the step configuration without the values of the tuned trainer options
+    """
+    run = dict(step["run"])
+    options = options_dict(run.get("other_options", []))
+    run["other_options"] = sorted(
+        (name, None if name in tuned else value) for name, value in options.items()
+    )
+    run.pop("repetitions", None)
+    config = {"trainer": step["trainer"], "run": run}
+    content = json.dumps(config, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def envelope_path(key):
+    return Path.cwd() / "scratch" / "envelopes" / f"{key}.yaml"
+
+
+def load_envelope(key):
+    path = envelope_path(key)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+def val_loss_curve(metrics):
+    """
+    Validation loss per epoch, from the records of train_metrics: the last one
+    reported during the epoch, i.e. that of its own validation
+    """
+    curve = {}
+    for record in metrics:
+        val_loss = float(record["val_loss"])
+        if not math.isnan(val_loss):
+            curve[int(record["epoch"])] = val_loss
+    return curve
+
+
+def record_run(key, step_sha, curve):
+    """
+    Add the curve of a completed step to the envelope of its lineage
+    """
+    if not curve:
+        return
+    path = envelope_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    envelope = load_envelope(key)
+    envelope[step_sha] = curve
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "w") as f:
+        yaml.dump(envelope, f, default_flow_style=False)
+    os.replace(temp, path)
+
+
+def upper_bound(envelope, epoch, tolerance, min_runs):
+    """
+    Highest acceptable validation loss at an epoch, None if there are too few earlier runs
+    """
+    values = [curve[epoch] for curve in envelope.values() if epoch in curve]
+    if len(values) < min_runs:
+        return None
+    return max(values) * (1 + tolerance)
+
+
+class EarlyAbort:
+    """
+    Callback for execute(..., on_line=...), returns True to stop the trainer
+    once the validation loss is outside the envelope for patience epochs.
+    An epoch is judged by its last validation loss, once the next epoch starts.
+    """
+
+    def __init__(self, envelope, config, step_sha):
+        self.envelope = {
+            sha: curve for sha, curve in envelope.items() if sha != step_sha
+        }
+        self.tolerance = float(config.get("tolerance", 0.05))
+        self.patience = int(config.get("patience", 3))
+        self.min_runs = int(config.get("min_runs", 2))
+        self.epoch = None
+        self.val_loss = None
+        self.outside = 0
+        self.reason = None
+
+    def __call__(self, line):
+        progress = parse_progress(line)
+        if progress is None or "val_loss=" not in line:
+            return False
+        epoch, _, _, val_loss = progress
+        previous_epoch, previous_val_loss = self.epoch, self.val_loss
+        self.epoch, self.val_loss = epoch, val_loss
+
+        if not math.isfinite(val_loss):
+            # no need to wait for the end of the epoch
+            self.outside = self.patience
+            return self.stop(epoch, val_loss, None)
+        if previous_epoch is None or epoch == previous_epoch:
+            return False
+
+        # the previous epoch is complete
+        epoch, val_loss = previous_epoch, previous_val_loss
+        bound = upper_bound(self.envelope, epoch, self.tolerance, self.min_runs)
+        if bound is None:
+            return False
+        elif val_loss > bound:
+            self.outside += 1
+        else:
+            self.outside = 0
+        return self.stop(epoch, val_loss, bound)
+
+    def stop(self, epoch, val_loss, bound):
+        if self.outside >= self.patience:
+            self.reason = {
+                "epoch": epoch,
+                "val_loss": val_loss,
+                "bound": bound,
+                "reason": f"validation loss outside the envelope for {self.outside} epochs",
+            }
+            return True
+        return False
+
+def failed_file(step_sha):
+    return Path.cwd() / "scratch" / step_sha / "failed.yaml"
+
+
+def mark_failed(step_sha, reason):
+    with open(failed_file(step_sha), "w") as f:
+        yaml.dump(reason, f, default_flow_style=False)
+    print(f"❌ Step {step_sha} marked as failed: {reason['reason']}")
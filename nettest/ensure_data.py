@@ -1,121 +1,585 @@
-from .utils import execute
+from .store import add_file, is_stored
+from .binpack_cache import cache_lock
 from pathlib import Path
-from time import sleep
-from huggingface_hub import snapshot_download
-import threading
+from time import sleep, monotonic
+from huggingface_hub import HfApi, hf_hub_download, hf_hub_url
+from huggingface_hub.utils import build_hf_headers
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+import urllib.request
+import urllib.error
 import zstandard as zstd
 import gzip
+import hashlib
+import multiprocessing
+import random
+import threading
 import shutil
+import yaml
 import os
+from typing import Optional
+
+
+class HubLimiter:
+    """
+    Limits the requests to the hub made by all threads of this process:
+    a token bucket for the request rate, and a budget of concurrent transfers.
+    When the hub signals rate limiting, all requests are paused.
+    """
+
+    def __init__(self, requests_per_second=2.0, burst=10, transfers=8):
+        self.lock = threading.Lock()
+        self.configure(requests_per_second, burst, transfers)
+
+    def configure(self, requests_per_second, burst, transfers):
+        with self.lock:
+            self.rate = float(requests_per_second)
+            self.burst = float(burst)
+            self.tokens = self.burst
+            self.last = monotonic()
+            self.paused_until = 0.0
+            self.transfers = threading.BoundedSemaphore(transfers)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+    def request(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    @contextmanager
+    def transfer(self):
+        with self.transfers:
+            self.request()
+            yield
+
+
+hub_limiter = HubLimiter()
+
+
+def retry_delay(error, attempt):
+    """
+    Time to wait before the next attempt: honour the Retry-After of a rate
+    limited request (and pause all other requests as well), otherwise back off
+    exponentially with jitter.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(error, "headers", None) or getattr(response, "headers", None)
+    status = getattr(error, "code", None) or getattr(response, "status_code", None)
+
+    delay = min(300.0, 10.0 * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+    if status == 429:
+        try:
+            delay = max(delay, float(headers.get("Retry-After")))
+        except (AttributeError, TypeError, ValueError):
+            pass
+        hub_limiter.pause(delay)
+    return delay
+
+
+def data_store_dir():
+    return Path.cwd() / "data" / ".store"
+
+
+def manifest_path(owner, repo):
+    return data_store_dir() / "manifests" / owner / f"{repo}.yaml"
+
+
+def load_manifest(owner, repo):
+    """
+    The manifest maps the files of a hub repo to their content hash,
+    and records size, mtime and hub revision of each completed file.
+    """
+    path = manifest_path(owner, repo)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+def save_manifest(owner, repo, manifest):
+    path = manifest_path(owner, repo)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "w") as f:
+        yaml.dump(manifest, f, default_flow_style=False)
+    os.replace(temp, path)
+
+
+def is_complete(path, entry):
+    """
+    A file recorded in the manifest is complete if size and mtime still match
+    """
+    if not entry:
+        return False
+    try:
+        stat = path.stat()
+    except OSError:
+        return False
+    return stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime"]
+
+
+def manifest_disk_usage(manifest):
+    return sum(entry["size"] for entry in manifest.values())
+
+
+def store_files(owner, repo, filenames, repo_dir, digests=None, revisions=None):
+    """
+    Move the files into the content-addressed store, and record them in the manifest.
+    Files already recorded and linked to their stored content are not rehashed.
+    """
+    digests = digests or {}
+    revisions = revisions or {}
+    manifest = load_manifest(owner, repo)
+    store_dir = data_store_dir()
+
+    entries = {}
+    for filename in filenames:
+        path = repo_dir / filename
+        entry = manifest.get(filename)
+        if entry and is_stored(store_dir, path, entry["sha256"]):
+            digest = entry["sha256"]
+        else:
+            print(f"Storing: {path}", flush=True)
+            digest = add_file(store_dir, path, digests.get(filename))
+        stat = path.stat()
+        entries[filename] = {
+            "sha256": digest,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "revision": revisions.get(filename, (entry or {}).get("revision")),
+        }
+
+    # other processes may have updated the manifest of the repo in the meantime
+    with cache_lock(manifest_path(owner, repo).parent):
+        manifest = load_manifest(owner, repo)
+        manifest.update(entries)
+        save_manifest(owner, repo, manifest)
+    return manifest
+
+
+class HashingWriter:
+    """
+    File-like writer that computes the sha256 of the data written through it
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.f.write(data)
 
 
 def decompress_file_zstd(file_path):
     output_path = file_path[:-4]  # Remove .zst extension
     try:
-        print(f"Decompressing: {file_path}")
+        print(f"Decompressing: {file_path}", flush=True)
         with open(file_path, "rb") as compressed, open(
             output_path, "wb"
         ) as decompressed:
             dctx = zstd.ZstdDecompressor()
             dctx.copy_stream(compressed, decompressed)
         os.remove(file_path)
-        print(f"Decompressed and removed: {file_path}")
+        print(f"Decompressed and removed: {file_path}", flush=True)
     except Exception as e:
         raise RuntimeError(f"Error decompressing {file_path} : {e}") from e
+    return os.path.getsize(output_path)
 
 
 def decompress_file_gz(file_path):
     output_path = file_path[:-3]  # Remove .gz extension
     try:
-        print(f"Decompressing: {file_path}")
+        print(f"Decompressing: {file_path}", flush=True)
         with open(output_path, "wb") as decompressed:
             with gzip.open(file_path, "rb") as gzfile:
-                shutil.copyfileobj(gzfile, decompressed)
+                shutil.copyfileobj(gzfile, decompressed, 1 << 20)
         os.remove(file_path)
-        print(f"Decompressed and removed: {file_path}")
+        print(f"Decompressed and removed: {file_path}", flush=True)
     except Exception as e:
         raise RuntimeError(f"Error decompressing {file_path} : {e}") from e
+    return os.path.getsize(output_path)
+
 
+def default_decompress_workers():
+    # decompression is CPU bound, but many concurrent streams thrash shared filesystems
+    cpu_count = os.cpu_count() or 1
+    return max(1, min(8, cpu_count // 2))
 
-def decompress_files_in_threads(file_list, decompress_file):
-    threads = []
-    for file_path in file_list:
-        t = threading.Thread(target=decompress_file, args=(file_path,))
-        t.start()
-        threads.append(t)
-    for t in threads:
-        t.join()
+
+def timed_decompress(decompress_file, file_path):
+    start = monotonic()
+    size_in = os.path.getsize(file_path)
+    size_out = decompress_file(file_path)
+    return size_in, size_out, monotonic() - start
+
+
+def decompress_pool(max_workers=None):
+    """
+    Bounded process pool for decompression. Its workers are started by a fork server,
+    as the pool may be shared by the threads updating several repos.
+    """
+    if max_workers is None:
+        max_workers = default_decompress_workers()
+    return ProcessPoolExecutor(
+        max_workers=max(1, max_workers),
+        mp_context=multiprocessing.get_context("forkserver"),
+    )
+
+
+def decompress_files(file_list, decompress_file, max_workers=None, pool=None):
+    """
+    Decompress files in a bounded process pool, largest files first, so the
+    longest jobs do not end up at the tail. Reports the throughput of each file.
+    With pool, the files are decompressed there, e.g. in the pool shared by stage_data.
+    """
+    if not file_list:
+        return
+
+    if pool is None:
+        if max_workers is None:
+            max_workers = default_decompress_workers()
+        with decompress_pool(min(max_workers, len(file_list))) as pool:
+            decompress_files(file_list, decompress_file, pool=pool)
+        return
+
+    file_list = sorted(file_list, key=os.path.getsize, reverse=True)
+    futures = {
+        pool.submit(timed_decompress, decompress_file, file_path): file_path
+        for file_path in file_list
+    }
+    for future in as_completed(futures):
+        size_in, size_out, seconds = future.result()
+        seconds = max(seconds, 1e-6)
+        print(
+            f"Decompressed {futures[future]}: {size_in / 1e6:.1f} MB -> {size_out / 1e6:.1f} MB"
+            f" in {seconds:.1f}s ({size_out / 1e6 / seconds:.1f} MB/s)",
+            flush=True,
+        )
+
+
+def stream_file(url, headers, destination):
+    """
+    Download url and decompress it on the fly into destination.
+    The decompressor is chosen from the url suffix (.zst, .gz or none), and the
+    data is written to a .part file that is renamed once complete.
+    Returns the sha256 of the decompressed data.
+    """
+    request = urllib.request.Request(url)
+    for key, value in headers.items():
+        # don't forward credentials to the storage backend we get redirected to
+        if key.lower() == "authorization":
+            request.add_unredirected_header(key, value)
+        else:
+            request.add_header(key, value)
+
+    partial = destination.with_name(destination.name + ".part")
+    with urllib.request.urlopen(request, timeout=600) as response:
+        with open(partial, "wb") as f:
+            decompressed = HashingWriter(f)
+            if url.endswith(".zst"):
+                dctx = zstd.ZstdDecompressor()
+                dctx.copy_stream(response, decompressed)
+            elif url.endswith(".gz"):
+                with gzip.GzipFile(fileobj=response, mode="rb") as gzfile:
+                    shutil.copyfileobj(gzfile, decompressed, 1 << 20)
+            else:
+                shutil.copyfileobj(response, decompressed, 1 << 20)
+    os.replace(partial, destination)
+    return decompressed.sha256.hexdigest()
 
 
-def run_data_update(owner: str, repo: str, filenames: list[str]) -> None:
+def resolve_revision(owner, repo, endpoint=None):
+    """
+    The commit sha of the current head of a dataset repo
+    """
+    api = HfApi(endpoint=endpoint)
+    hub_limiter.request()
+    return api.dataset_info(f"{owner}/{repo}").sha
+
+
+def stream_repo_file(owner, repo, filename, repo_dir, revision=None, endpoint=None):
+    """
+    Stream a single file of a dataset repo, preferring the compressed variants
+    """
+    destination = repo_dir / filename
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    headers = build_hf_headers()
+
+    for candidate in [f"{filename}.zst", f"{filename}.gz", filename]:
+        url = hf_hub_url(
+            f"{owner}/{repo}",
+            candidate,
+            repo_type="dataset",
+            revision=revision,
+            endpoint=endpoint,
+        )
+        try:
+            with hub_limiter.transfer():
+                print(f"Streaming: {url}", flush=True)
+                digest = stream_file(url, headers, destination)
+            print(f"Streamed and decompressed: {destination}", flush=True)
+            return digest
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                raise
+    raise FileNotFoundError(f"File {filename} not found in repository {owner}/{repo}")
+
+
+def stream_files(
+    owner, repo, filenames, repo_dir, revision=None, max_workers=4, endpoint=None
+):
+    """
+    Stream the files of a dataset repo, decompressing while downloading.
+    Network and decompression overlap, and no compressed copy is kept on disk.
+    Returns the sha256 of each of the files.
+    """
+    digests = {}
+    if not filenames:
+        return digests
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            filename: pool.submit(
+                stream_repo_file, owner, repo, filename, repo_dir, revision, endpoint
+            )
+            for filename in filenames
+        }
+        for filename, future in futures.items():
+            digests[filename] = future.result()
+    return digests
+
+
+def download_files(
+    owner, repo, candidates, repo_dir, revision=None, max_workers=4, endpoint=None
+):
+    """
+    Download those of the candidate files that the dataset repo has, and that are not
+    yet in repo_dir. Each file is a transfer of its own through hub_limiter, so that,
+    unlike with a snapshot_download, all hub requests are limited.
+    """
+    api = HfApi(endpoint=endpoint)
+    hub_limiter.request()
+    available = set(
+        api.list_repo_files(f"{owner}/{repo}", repo_type="dataset", revision=revision)
+    )
+    wanted = [c for c in candidates if c in available and not (repo_dir / c).exists()]
+
+    def download(filename):
+        with hub_limiter.transfer():
+            print(f"Downloading: {owner}/{repo}/{filename}", flush=True)
+            hf_hub_download(
+                repo_id=f"{owner}/{repo}",
+                filename=filename,
+                repo_type="dataset",
+                revision=revision,
+                cache_dir=repo_dir,
+                local_dir=repo_dir,
+                etag_timeout=600,
+                endpoint=endpoint,
+            )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for future in [pool.submit(download, filename) for filename in wanted]:
+            future.result()
+
+
+def stored_variants(filename, keep_compressed):
+    """
+    The names under which a file can be stored, compressed at rest or not
+    """
+    if keep_compressed:
+        return [filename, f"{filename}.zst", f"{filename}.gz"]
+    return [filename]
+
+
+def stored_name(repo_dir, filename, keep_compressed):
+    for name in stored_variants(filename, keep_compressed):
+        if (repo_dir / name).exists():
+            return name
+    return None
+
+
+def run_data_update(
+    owner: str,
+    repo: str,
+    filenames: list[str],
+    stream: bool = False,
+    endpoint: Optional[str] = None,
+    decompress_workers: Optional[int] = None,
+    keep_compressed: bool = False,
+    decompressor: Optional[ProcessPoolExecutor] = None,
+) -> None:
     owner_dir = Path().cwd() / "data" / owner
     repo_dir = owner_dir / repo
 
+    # fast path, the manifest shows all files are present, no need to contact the hub
+    manifest = load_manifest(owner, repo)
+    if all(
+        any(
+            is_complete(repo_dir / name, manifest.get(name))
+            for name in stored_variants(filename, keep_compressed)
+        )
+        for filename in filenames
+    ):
+        print(
+            f"Data for {owner}/{repo} complete according to manifest, "
+            f"{manifest_disk_usage(manifest) / 1e9:.1f} GB in {len(manifest)} files",
+            flush=True,
+        )
+        return
+
     print(f"Ensuring data for {owner}/{repo} in {repo_dir} : " + " ".join(filenames))
 
     # download the filename or e.g. compressed files like *.zst
+    missing_filenames = []
     pattern_filenames = []
     for filename in filenames:
-        stored_file = repo_dir / filename
-        if stored_file.exists():
+        if stored_name(repo_dir, filename, keep_compressed):
             continue
+        missing_filenames.append(filename)
         pattern_filenames.append(filename)
         pattern_filenames.append(f"{filename}.zst")
         pattern_filenames.append(f"{filename}.gz")
 
     # try a couple of times, since we might be overloading hf
-    n_repeats = 3
-    while True:
+    digests = {}
+    revision = None
+    max_attempts = 5
+    attempt = 0
+    while missing_filenames:
+        attempt += 1
         try:
-            snapshot_download(
-                repo_id=f"{owner}/{repo}",
-                repo_type="dataset",
-                allow_patterns=pattern_filenames,
-                cache_dir=repo_dir,
-                local_dir=repo_dir,
-                etag_timeout=600,
-            )
+            # pin the revision, so all files are consistent and it can be recorded
+            if revision is None:
+                revision = resolve_revision(owner, repo, endpoint)
+            # streaming pays off by overlapping decompression, which is not needed if compressed at rest
+            if stream and not keep_compressed:
+                # only files that are still missing, previous attempts might have completed some
+                digests.update(
+                    stream_files(
+                        owner,
+                        repo,
+                        [f for f in missing_filenames if not (repo_dir / f).exists()],
+                        repo_dir,
+                        revision=revision,
+                        endpoint=endpoint,
+                    )
+                )
+            else:
+                download_files(
+                    owner,
+                    repo,
+                    pattern_filenames,
+                    repo_dir,
+                    revision=revision,
+                    endpoint=endpoint,
+                )
             print("", flush=True)
-            execute("Repo disk usage: ", ["du", "-sh", "."], repo_dir, True)
             break
         except Exception as e:
             print(f"Error during repository update: {e}")
-            n_repeats -= 1
-            if n_repeats > 0:
-                print(f"Retrying in 30 seconds... ({n_repeats} attempts left)")
-                sleep(30)
+            if attempt < max_attempts:
+                delay = retry_delay(e, attempt)
+                print(
+                    f"Retrying {owner}/{repo} in {delay:.0f} seconds... ({max_attempts - attempt} attempts left)"
+                )
+                sleep(delay)
             else:
                 raise RuntimeError(
                     f"Failed to update repository {owner}/{repo} after multiple attempts."
                 ) from e
 
-    # collect the .zst files that need decompression
-    zst_files = []
-    for filename in filenames:
-        zst_file = repo_dir / f"{filename}.zst"
-        std_file = repo_dir / filename
-        if zst_file.exists() and not std_file.exists():
-            zst_files.append(str(zst_file))
-    decompress_files_in_threads(zst_files, decompress_file_zstd)
-
-    # collect the .gz files that need decompression
-    gz_files = []
-    for filename in filenames:
-        gz_file = repo_dir / f"{filename}.gz"
-        std_file = repo_dir / filename
-        if gz_file.exists() and not std_file.exists():
-            gz_files.append(str(gz_file))
-    decompress_files_in_threads(gz_files, decompress_file_gz)
+    if not keep_compressed:
+        # collect the .zst files that need decompression
+        zst_files = []
+        for filename in filenames:
+            zst_file = repo_dir / f"{filename}.zst"
+            std_file = repo_dir / filename
+            if zst_file.exists() and not std_file.exists():
+                zst_files.append(str(zst_file))
+        decompress_files(
+            zst_files, decompress_file_zstd, decompress_workers, decompressor
+        )
 
-    execute("Repo disk usage: ", ["du", "-sh", "."], repo_dir, True)
+        # collect the .gz files that need decompression
+        gz_files = []
+        for filename in filenames:
+            gz_file = repo_dir / f"{filename}.gz"
+            std_file = repo_dir / filename
+            if gz_file.exists() and not std_file.exists():
+                gz_files.append(str(gz_file))
+        decompress_files(
+            gz_files, decompress_file_gz, decompress_workers, decompressor
+        )
 
     # final check
+    stored_names = {}
     for filename in filenames:
-        stored_file = repo_dir / filename
-        if not stored_file.exists():
+        name = stored_name(repo_dir, filename, keep_compressed)
+        if name is None:
             raise FileNotFoundError(
                 f"File {filename} not found in repository {owner}/{repo} after update."
             )
+        stored_names[filename] = name
+
+    # deduplicate against files of other repos, and record the content
+    revisions = {stored_names[filename]: revision for filename in missing_filenames}
+    manifest = store_files(
+        owner, repo, list(stored_names.values()), repo_dir, digests, revisions
+    )
+    print(
+        f"Repo disk usage: {manifest_disk_usage(manifest) / 1e9:.1f} GB in {len(manifest)} files",
+        flush=True,
+    )
+
+
+def stage_data(items, environment=None):
+    """
+    Update the data of several repos concurrently, sharing the hub limits and
+    one decompression pool, so that decompress_workers bounds all decompressions.
+    The items are the keyword arguments of run_data_update for each repo,
+    the optional data section of the environment configures concurrency and rates.
+    """
+    config = (environment or {}).get("data", {})
+    hub_limiter.configure(
+        config.get("requests_per_second", 2.0),
+        config.get("burst", 10),
+        config.get("transfers", 8),
+    )
+    options = {
+        "stream": config.get("stream", False),
+        "keep_compressed": config.get("keep_compressed", False),
+    }
+
+    errors = []
+    with decompress_pool(config.get("decompress_workers", None)) as decompressor:
+        options["decompressor"] = decompressor
+        with ThreadPoolExecutor(max_workers=config.get("parallel", 4)) as pool:
+            futures = {
+                pool.submit(run_data_update, **{**options, **item}): item for item in items
+            }
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"❌ Data update for {item['owner']}/{item['repo']} failed: {e}")
+                    errors.append(e)
+
+    if errors:
+        raise RuntimeError(f"Data update failed for {len(errors)} repositories") from errors[0]
 
 
 if __name__ == "__main__":
@@ -131,6 +595,29 @@ if __name__ == "__main__":
         nargs="+",
         help="Optional list of filenames (at least one required)",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Decompress files while downloading, without keeping a compressed copy",
+    )
+    parser.add_argument(
+        "--decompress-workers",
+        type=int,
+        default=None,
+        help="Maximum number of files decompressed concurrently",
+    )
+    parser.add_argument(
+        "--keep-compressed",
+        action="store_true",
+        help="Keep .zst/.gz files compressed at rest, they are decompressed when training",
+    )
     args = parser.parse_args()
 
-    run_data_update(args.owner, args.repo, args.filenames)
+    run_data_update(
+        args.owner,
+        args.repo,
+        args.filenames,
+        stream=args.stream,
+        decompress_workers=args.decompress_workers,
+        keep_compressed=args.keep_compressed,
+    )
@@ -1,34 +1,105 @@
 import yaml
-from concurrent.futures import ProcessPoolExecutor, wait, ALL_COMPLETED
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, ALL_COMPLETED
 from firecrest_executor import FirecrestExecutor
 
-from .generate_pipeline import parse_recipe
-from .ensure_data import run_data_update
-from .train import run_step
+from .generate_pipeline import parse_recipe, group_binpacks
+from .ensure_data import stage_data
+from .train import run_chain, run_step
 from .test import run_test
 from .default_environment import get_default_environment
 
 
-# useful to batch a number of calls,
-# needs to pass the function so it can be found remotely
-# to avoid (attempted relative import with no known parent package)
-def batch_function(f, items):
-    for kwargs in items:
-        f(**kwargs)
+def stage_in_order(data_executor, items, environment):
+    return data_executor.submit(stage_data, items, environment).result()
 
 
-def execute(executor, recipe, environment):
+def submit_data(stager, data_executor, environment, binpacks, data_futures):
+    """
+    Submit the staging of the binpacks that are not yet being staged,
+    and return the futures for all of the binpacks.
+    The stager (a single thread) runs one staging job at a time, in the order
+    submitted, so the hub limits of stage_data hold for all of the data.
+    """
+    new_binpacks = sorted(set(binpacks) - set(data_futures))
+    if new_binpacks:
+        future = stager.submit(
+            stage_in_order, data_executor, group_binpacks(new_binpacks), environment
+        )
+        for binpack in new_binpacks:
+            data_futures[binpack] = future
+
+    return {data_futures[binpack] for binpack in binpacks}
+
+
+def run_chained(executor, environment, entries, step_data):
+    """
+    Run the training entries in chains, each chain in a single task (allocation),
+    including the following entries whose data is already staged.
+    """
+    pending = list(entries)
+    while pending:
+        for future in step_data[pending[0]["current_sha"]]:
+            future.result()
+        chain = [pending[0]]
+        for kwargs in pending[1:]:
+            futures = step_data[kwargs["current_sha"]]
+            if not all(f.done() and f.exception() is None for f in futures):
+                break
+            chain.append(kwargs)
+
+        print(
+            f"submitting a chain of {len(chain)} training entries, {len(pending)} pending",
+            flush=True,
+        )
+        remaining = executor.submit(run_chain, environment, chain).result()
+        pending = remaining + pending[len(chain) :]
+
+
+def execute(executor, recipe, environment, data_executor=None):
     _, schedule, _ = executor.submit(parse_recipe, recipe, None).result()
 
-    print("submitting data update", flush=True)
-    executor.submit(batch_function, run_data_update, schedule["data"]).result()
+    if data_executor is None:
+        data_executor = executor
 
-    itrain = 0
-    ntrain = len(schedule["train"])
+    # stage the data in the background, in the order the training steps need it,
+    # so that each step can start as soon as its own binpacks are available
+    print("submitting data update", flush=True)
+    stager = ThreadPoolExecutor(max_workers=1)
+    data_futures = {}
+    step_data = {}
     for kwargs in schedule["train"]:
-        itrain += 1
-        print(f"submitting training step {itrain} / {ntrain}", flush=True)
-        executor.submit(run_step, environment, **kwargs).result()
+        sha = kwargs["current_sha"]
+        if sha not in step_data:
+            binpacks = schedule["inputs"].get(sha, [])
+            step_data[sha] = submit_data(
+                stager, data_executor, environment, binpacks, data_futures
+            )
+
+    # anything else, e.g. binpacks of steps that are already final
+    all_binpacks = [
+        f"{item['owner']}/{item['repo']}/{filename}"
+        for item in schedule["data"]
+        for filename in item["filenames"]
+    ]
+    all_data = submit_data(
+        stager, data_executor, environment, all_binpacks, data_futures
+    )
+
+    if environment.get("train", {}).get("chain"):
+        run_chained(executor, environment, schedule["train"], step_data)
+    else:
+        itrain = 0
+        ntrain = len(schedule["train"])
+        for kwargs in schedule["train"]:
+            itrain += 1
+            for future in step_data[kwargs["current_sha"]]:
+                future.result()
+            print(f"submitting training step {itrain} / {ntrain}", flush=True)
+            executor.submit(run_step, environment, **kwargs).result()
+
+    for future in all_data:
+        future.result()
+    stager.shutdown()
 
     # do parallel tests, if the executor supports it
     futures = []
@@ -46,6 +117,8 @@ def execute(executor, recipe, environment):
     bestNet = None
     for future in done:
         net, result = future.result()
+        if result is None:
+            continue
         if nElo is None or result > nElo:
             nElo = result
             bestNet = net
@@ -82,8 +155,11 @@ if __name__ == "__main__":
     else:
         environment = get_default_environment()
 
+    # locally, data is staged in its own process, so it can proceed during training
+    data_executor = None
     if args.executor == "local":
         executor = ProcessPoolExecutor(max_workers=1)
+        data_executor = ProcessPoolExecutor(max_workers=1)
     else:
         executor = FirecrestExecutor(
             working_dir="/users/vjoost/fish/workspace/",
@@ -98,7 +174,9 @@ if __name__ == "__main__":
             max_workers=64,
         )
 
-    bestNet, nElo = execute(executor, recipe, environment)
+    bestNet, nElo = execute(executor, recipe, environment, data_executor)
     print(f"Execution of the recipe led to a net {bestNet} of {nElo} nElo.")
 
     executor.shutdown(wait=True, cancel_futures=False)
+    if data_executor is not None:
+        data_executor.shutdown(wait=True, cancel_futures=False)
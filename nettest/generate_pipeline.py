@@ -156,25 +156,47 @@ def generate_job_base():
     return job
 
 
+def step_binpacks(step):
+    """
+    The binpacks needed by a training step, for training and conversion
+    """
+    binpacks = set()
+    if "convert" in step and "binpack" in step["convert"]:
+        binpacks.add(step["convert"]["binpack"])
+    if "run" in step and "binpacks" in step["run"]:
+        for binpack in step["run"]["binpacks"]:
+            binpacks.add(binpack)
+    return binpacks
+
+
+def group_binpacks(binpacks):
+    """
+    Group binpacks by huggingface repo, as arguments for run_data_update
+    """
+    repos = defaultdict(list)
+    for binpack in sorted(binpacks):
+        owner, repo, filename = binpack.split("/", 2)
+        repos[(owner, repo)].append(filename)
+
+    return [
+        {"owner": owner, "repo": repo, "filenames": filenames}
+        for (owner, repo), filenames in repos.items()
+    ]
+
+
 def generate_ensure_data(recipe, ci_yaml_out, schedule):
     """
     Extract all datasets from the training steps
     """
 
-    # collect all binpacks that are needed
+    # collect all binpacks that are needed, and those needed by each step
     binpacks = set()
     if "training" in recipe:
         for step in recipe["training"]["steps"]:
-            if "convert" in step and "binpack" in step["convert"]:
-                binpacks.add(step["convert"]["binpack"])
-            if "run" in step and "binpacks" in step["run"]:
-                for binpack in step["run"]["binpacks"]:
-                    binpacks.add(binpack)
-
-    repos = defaultdict(list)
-    for binpack in binpacks:
-        owner, repo, filename = binpack.split("/", 2)
-        repos[(owner, repo)].append(filename)
+            needed = step_binpacks(step)
+            binpacks |= needed
+            if step["status"] != "Final":
+                schedule["inputs"][step["sha"]] = sorted(needed)
 
     # actual job script steps..
     job = generate_job_base()
@@ -182,11 +204,12 @@ def generate_ensure_data(recipe, ci_yaml_out, schedule):
     job["stage"] = "ensureData"
 
     job["script"] = ["cd /workspace", "ln -s $CI_PROJECT_DIR ./cidir"]
-    for (owner, repo), filenames in repos.items():
+    for item in group_binpacks(binpacks):
         job["script"].append(
-            f"python -u -m nettest.ensure_data {owner} {repo} " + " ".join(filenames)
+            f"python -u -m nettest.ensure_data {item['owner']} {item['repo']} "
+            + " ".join(item["filenames"])
         )
-        schedule["data"].append({"owner": owner, "repo": repo, "filenames": filenames})
+        schedule["data"].append(item)
 
     ci_yaml_out["ensureDataJob"] = job
     return
@@ -207,6 +230,10 @@ def generate_training_stages(recipe, environment, ci_yaml_out, schedule):
     envarg = f"--environment {environment}" if environment else ""
     step_number = 0
 
+    # the test config, used to evaluate intermediate nets during training
+    test_config_sha = recipe.get("testing", {}).get("sha")
+    testarg = f"--test-config {test_config_sha} " if test_config_sha else ""
+
     for step in recipe["training"]["steps"]:
         step_number += 1
         current_sha = step["sha"]
@@ -238,13 +265,14 @@ def generate_training_stages(recipe, environment, ci_yaml_out, schedule):
             job["script"] = [
                 "cd /workspace/",
                 "ln -s $CI_PROJECT_DIR ./cidir",
-                f"python -u -m nettest.train {envarg} {current_sha} {previous_sha}",
+                f"python -u -m nettest.train {envarg} {testarg}{current_sha} {previous_sha}",
             ]
 
             schedule["train"].append(
                 {
                     "current_sha": current_sha,
                     "previous_sha": previous_sha,
+                    "test_config_sha": test_config_sha,
                 }
             )
 
@@ -366,7 +394,7 @@ def parse_recipe(recipe, environment):
 
     # ci yaml header
     ci_yaml_out = start_ci_yaml()
-    schedule = {"data": [], "train": [], "test": []}
+    schedule = {"data": [], "inputs": {}, "train": [], "test": []}
 
     # expand the meta recipe, i.e. handle the <repeat_last> directives and apply the overrides in the training steps sequentially.
     recipe = expand_meta_recipe(recipe)
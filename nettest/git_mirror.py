@@ -0,0 +1,116 @@
+"""
+Local mirrors of the upstream git repositories
+
+Each upstream repository is mirrored once, as a bare repository
+
+   scratch / "packages" / "mirrors" / owner / repo.git
+
+into which the requested shas are fetched incrementally (kept as refs/nettest/<sha>).
+Checkouts for builds share the objects of the mirror, so only shas not yet in the
+mirror need the network.
+"""
+
+import shutil
+import subprocess
+import uuid
+from pathlib import Path
+from .utils import execute, github_repo_url
+
+
+def mirror_dir(owner, repo):
+    return Path.cwd() / "scratch" / "packages" / "mirrors" / owner / f"{repo}.git"
+
+
+def has_commit(mirror, sha):
+    result = subprocess.run(
+        ["git", "cat-file", "-e", f"{sha}^{{commit}}"],
+        cwd=mirror,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return result.returncode == 0
+
+
+def ensure_mirror(mirror):
+    """
+    Create the bare mirror repository, if it does not yet exist
+    """
+    if mirror.exists():
+        return
+    temp_mirror = mirror.with_name(f"{mirror.name}_init_{uuid.uuid4()}")
+    execute("init mirror", ["git", "init", "--bare", "--quiet"], temp_mirror, False)
+    try:
+        temp_mirror.rename(mirror)
+    except OSError:
+        # another process was faster
+        shutil.rmtree(temp_mirror, ignore_errors=True)
+
+
+def fetch_to_mirror(owner, repo, sha, url=None):
+    """
+    Make sure the mirror of owner/repo contains sha, and return the mirror
+    """
+    mirror = mirror_dir(owner, repo)
+    ensure_mirror(mirror)
+    if not has_commit(mirror, sha):
+        if url is None:
+            url = github_repo_url(owner, repo)
+        execute(
+            f"fetch sha {sha} into mirror",
+            ["git", "fetch", "--quiet", url, f"{sha}:refs/nettest/{sha}"],
+            mirror,
+            False,
+        )
+    assert has_commit(mirror, sha), f"{sha} not found in {url}"
+    return mirror
+
+
+def checkout_sha(owner, repo, sha, destination, url=None):
+    """
+    Check out sha of owner/repo (from github, or url) in destination, via the mirror
+    """
+    mirror = fetch_to_mirror(owner, repo, sha, url)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    # --shared: the checkout uses the objects of the mirror, nothing is copied
+    execute(
+        f"clone {owner}/{repo} from mirror",
+        ["git", "clone", "--quiet", "--shared", "--no-checkout", f"{mirror}", f"{destination}"],
+        destination.parent,
+        False,
+    )
+    execute(
+        f"checkout sha {sha}",
+        ["git", "checkout", "--quiet", "--detach", sha],
+        destination,
+        False,
+    )
+
+
+def source_tree(owner, repo, sha, path, url=None):
+    """
+    git tree hash of path (e.g. src) at sha, equal for shas with the same sources
+    """
+    mirror = fetch_to_mirror(owner, repo, sha, url)
+    result = subprocess.run(
+        ["git", "rev-parse", f"{sha}:{path}"],
+        cwd=mirror,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip()
+
+
+def read_file(owner, repo, sha, path, url=None):
+    """
+    Content of the file path at sha, without a checkout
+    """
+    mirror = fetch_to_mirror(owner, repo, sha, url)
+    result = subprocess.run(
+        ["git", "show", f"{sha}:{path}"],
+        cwd=mirror,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout
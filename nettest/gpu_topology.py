@@ -0,0 +1,156 @@
+"""
+Placement of training processes close to their GPU
+
+The NUMA node and CPU cores local to each GPU are read from the machine
+(nvidia-smi for the PCI bus id, sysfs for its locality), so that a training
+process and its data loader workers run on the cores, and allocate memory on
+the node, next to the GPU they feed.
+"""
+
+import json
+import shutil
+import subprocess
+from pathlib import Path
+from .bind_rank import parse_cpulist
+
+PCI_DEVICES = Path("/sys/bus/pci/devices")
+NUMA_NODES = Path("/sys/devices/system/node")
+
+
+def normalize_bus_id(bus_id):
+    """
+    nvidia-smi reports e.g. 00000009:01:00.0, sysfs names it 0009:01:00.0
+    """
+    domain, rest = bus_id.strip().split(":", 1)
+    return f"{int(domain, 16):04x}:{rest}".lower()
+
+
+def gpu_bus_ids():
+    """
+    The PCI bus id of each GPU, by nvidia-smi index, empty if unavailable
+    """
+    if not shutil.which("nvidia-smi"):
+        return {}
+    try:
+        result = subprocess.run(
+            ["nvidia-smi", "--query-gpu=index,pci.bus_id", "--format=csv,noheader"],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    except Exception:
+        return {}
+    if result.returncode != 0:
+        return {}
+
+    bus_ids = {}
+    for line in result.stdout.splitlines():
+        if "," not in line:
+            continue
+        index, bus_id = line.split(",", 1)
+        bus_ids[int(index)] = normalize_bus_id(bus_id)
+    return bus_ids
+
+
+def gpu_locality(bus_id, pci_devices=PCI_DEVICES):
+    """
+    The NUMA node and local CPU list of a PCI device, None for unknown parts
+    """
+    device = pci_devices / bus_id
+    node = None
+    cpus = None
+    try:
+        node = int((device / "numa_node").read_text().strip())
+        if node < 0:
+            node = None
+    except (OSError, ValueError):
+        pass
+    try:
+        cpus = (device / "local_cpulist").read_text().strip() or None
+    except OSError:
+        pass
+    return {"node": node, "cpus": cpus}
+
+
+def gpu_placement(devices, pci_devices=PCI_DEVICES):
+    """
+    The locality of each of the devices (e.g. "2,3,"), in local rank order,
+    or None if the topology can not be determined
+    """
+    indices = [int(d) for d in devices.split(",") if d.strip()]
+    bus_ids = gpu_bus_ids()
+    if not indices or not all(i in bus_ids for i in indices):
+        return None
+
+    placement = [gpu_locality(bus_ids[i], pci_devices) for i in indices]
+    if all(p["node"] is None and p["cpus"] is None for p in placement):
+        return None
+    return placement
+
+
+def format_cpulist(cpus):
+    """
+    The inverse of parse_cpulist, e.g. "0-3,8,10-11"
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(f"{a}" if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def node_cpus(nodes, numa_nodes=NUMA_NODES):
+    """
+    The cpus of the NUMA nodes in a list such as "0,1"
+    """
+    cpus = set()
+    for node in parse_cpulist(str(nodes)):
+        cpus |= parse_cpulist((numa_nodes / f"node{node}" / "cpulist").read_text())
+    return cpus
+
+
+def exclude_cpus(placement, reserved, available, numa_nodes=NUMA_NODES):
+    """
+    The placement restricted to available cpus without the reserved ones (e.g. of the
+    monitor), binding to cores rather than to whole nodes
+    """
+    restricted = []
+    for place in placement:
+        if place["cpus"] is not None:
+            cpus = parse_cpulist(place["cpus"])
+        elif place["node"] is not None:
+            cpus = node_cpus(place["node"], numa_nodes)
+        else:
+            cpus = set(available)
+        cpus = (cpus & set(available)) - set(reserved)
+        assert cpus, f"No cpus left for training next to {place} without {reserved}"
+        restricted.append(
+            {"node": place["node"], "cpus": format_cpulist(cpus), "physcpubind": True}
+        )
+    return restricted
+
+
+def numactl_args(place):
+    """
+    numactl options binding to the node (or cores) of place
+    """
+    if place.get("physcpubind") and place["cpus"] is not None:
+        args = [f"--physcpubind={place['cpus']}"]
+        if place["node"] is not None:
+            args.append(f"--membind={place['node']}")
+        return args
+    if place["node"] is not None:
+        return [f"--cpunodebind={place['node']}", f"--membind={place['node']}"]
+    if place["cpus"] is not None:
+        return [f"--physcpubind={place['cpus']}"]
+    return []
+
+
+def placement_env(placement, use_numactl):
+    """
+    The environment passing the placement to the torchrun ranks, see bind_rank.py
+    """
+    config = {"placement": placement, "numactl": use_numactl}
+    return {"NETTEST_PLACEMENT": json.dumps(config)}
@@ -0,0 +1,130 @@
+import tempfile
+import yaml
+from contextlib import contextmanager
+from pathlib import Path
+from time import monotonic
+from .default_environment import get_default_environment
+from .binpack_cache import (
+    binpack_cache_dir,
+    cache_files,
+    cached_name,
+    compressed_source,
+    decompress_into,
+    decompressed_size,
+    parse_size,
+)
+from .train import ensure_trainer
+from .autotune import measure_loader_throughput
+
+
+def compressed_sources(binpacks):
+    data_dir = Path.cwd() / "data"
+    sources = []
+    for binpack in binpacks:
+        source = compressed_source(data_dir / binpack)
+        assert source is not None, f"{binpack} is not compressed at rest, nothing to compare"
+        sources.append(source)
+    return sources
+
+
+@contextmanager
+def uncompressed_binpacks(sources):
+    """
+    The sources decompressed into a temporary directory of the data directory,
+    removed afterwards, so no full copy is left next to the compressed files
+    """
+    data_dir = Path.cwd() / "data"
+    with tempfile.TemporaryDirectory(dir=data_dir, prefix=".loader_bench_") as temp:
+        paths = []
+        for source in sources:
+            path = Path(temp) / cached_name(source)
+            decompress_into(source, path)
+            paths.append(path)
+        yield paths
+
+
+@contextmanager
+def cached_binpacks(environment, sources, cache_size):
+    """
+    The sources decompressed into the bounded cache, even if an uncompressed copy
+    exists in the data directory
+    """
+    train = environment.get("train", {})
+    cache_config = train.get("binpack_cache", {"size": cache_size})
+    in_use = []
+    try:
+        yield cache_files(
+            binpack_cache_dir(cache_config),
+            parse_size(cache_config["size"]),
+            sources,
+            decompress_into,
+            decompressed_size,
+            in_use,
+        )
+    finally:
+        for marker in in_use:
+            marker.close()
+
+
+def benchmark_binpack_modes(environment, current_sha, cache_size, seconds):
+    """
+    Compare binpacks read uncompressed from the data directory with binpacks kept
+    compressed at rest and decompressed into the bounded cache.
+    """
+    with open(Path.cwd() / "scratch" / current_sha / "step.yaml") as f:
+        step = yaml.safe_load(f)
+    run = step["run"]
+    nnue_pytorch_dir = ensure_trainer(step["trainer"])
+
+    train = environment.get("train", {})
+    workers = train.get("workers", 16)
+    threads = train.get("threads", 4)
+
+    sources = compressed_sources(run["binpacks"])
+    modes = [
+        ("uncompressed", uncompressed_binpacks(sources)),
+        ("cached", cached_binpacks(environment, sources, cache_size)),
+    ]
+
+    results = []
+    for mode, available in modes:
+        start = monotonic()
+        with available as binpacks:
+            setup = monotonic() - start
+            rate = measure_loader_throughput(
+                nnue_pytorch_dir, binpacks, run, workers, threads, seconds
+            )
+        results.append((mode, setup, rate))
+
+    print(f"\nData loader throughput for step {current_sha}:")
+    print(f"{'mode':>14} {'setup [s]':>12} {'positions/s':>14}")
+    for mode, setup, rate in results:
+        print(f"{mode:>14} {setup:12.1f} {rate:14.0f}")
+
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the data loader with uncompressed and cached binpacks."
+    )
+    parser.add_argument(
+        "--environment", required=False, help="Definition of the environment file"
+    )
+    parser.add_argument(
+        "--cache-size", default="1T", help="Size of the binpack cache, if not configured"
+    )
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("current_sha", help="Step SHA providing binpacks and options")
+    args = parser.parse_args()
+
+    if args.environment:
+        print("Using environment file: ", args.environment)
+        with open(args.environment) as f:
+            environment = yaml.safe_load(f)
+    else:
+        environment = get_default_environment()
+
+    benchmark_binpack_modes(environment, args.current_sha, args.cache_size, args.seconds)
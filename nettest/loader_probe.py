@@ -0,0 +1,112 @@
+"""
+Measure the throughput of the nnue-pytorch data loader
+
+Standalone script, executed from within an nnue-pytorch checkout, e.g.
+
+   python -u loader_probe.py --features=HalfKAv2_hm^ --num-workers=8 --threads=4 x.binpack
+
+Prints a line 'positions/s: <value>' after running the loader for --seconds.
+"""
+
+import argparse
+import importlib
+import inspect
+import json
+import os
+import sys
+import time
+
+
+def feature_set_name(features):
+    # the name the data loader expects, module layout differs between trainer versions
+    for module_name in ("features", "model.features", "model"):
+        try:
+            module = importlib.import_module(module_name)
+            return module.get_feature_set_from_name(features).name
+        except (ImportError, AttributeError):
+            continue
+    return features
+
+
+def default_features():
+    # the default of the trainer, as added to its argument parser by the features module
+    for module_name in ("features", "model.features", "model"):
+        try:
+            module = importlib.import_module(module_name)
+            parser = argparse.ArgumentParser()
+            module.add_argparse_args(parser)
+            return parser.parse_args([]).features
+        except (ImportError, AttributeError):
+            continue
+    raise SystemExit("No --features given, and no default found in the trainer")
+
+
+def accepted_options(callable_, options):
+    parameters = inspect.signature(callable_).parameters
+    accepted = {}
+    for key, value in options.items():
+        name = key.replace("-", "_")
+        if name in parameters:
+            accepted[name] = value
+    return accepted
+
+
+def make_dataset(data_loader, features, binpacks, batch_size, num_workers, options):
+    dataset_class = data_loader.SparseBatchDataset
+    parameters = inspect.signature(dataset_class).parameters
+    kwargs = {"num_workers": num_workers}
+    config_class = getattr(data_loader, "DataloaderSkipConfig", None)
+    if config_class is not None and "config" in parameters:
+        kwargs["config"] = config_class(**accepted_options(config_class, options))
+    else:
+        kwargs.update(accepted_options(dataset_class, options))
+    return dataset_class(feature_set_name(features), binpacks, batch_size, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure data loader throughput")
+    parser.add_argument("--features", help="default: the default of the trainer")
+    parser.add_argument("--batch-size", type=int, default=16384)
+    parser.add_argument("--num-workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--options", default="{}", help="fen skipping options as json")
+    parser.add_argument("binpacks", nargs="+")
+    args = parser.parse_args()
+
+    # the trainer modules are found relative to the working directory
+    sys.path.insert(0, os.getcwd())
+    import torch
+    import data_loader
+
+    torch.set_num_threads(args.threads)
+    if args.features is None:
+        args.features = default_features()
+
+    dataset = make_dataset(
+        data_loader,
+        args.features,
+        args.binpacks,
+        args.batch_size,
+        args.num_workers,
+        json.loads(args.options),
+    )
+
+    # the first batch includes opening the files and starting the workers
+    iterator = iter(dataset)
+    start = time.monotonic()
+    next(iterator)
+    print(f"first batch after: {time.monotonic() - start:.2f}s", flush=True)
+
+    batches = 0
+    start = time.monotonic()
+    while time.monotonic() - start < args.seconds:
+        next(iterator)
+        batches += 1
+    elapsed = time.monotonic() - start
+
+    print(f"positions/s: {batches * args.batch_size / elapsed:.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
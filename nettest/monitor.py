@@ -0,0 +1,242 @@
+"""
+Evaluation of intermediate nets while training runs
+
+With an environment section such as
+
+   monitor:
+     cores: 64-71     # reserved for the monitor, training is bound to the other cores
+     concurrency: 4   # games at a time, default half the cores (two engines per game)
+     nodes: 20000     # per move
+     rounds: 100
+     hash: 16
+     interval: 600    # seconds between looks for new checkpoints
+
+a side process converts the checkpoints saved periodically during training
+(on the CPU), and plays a short fixed-node match of each against the reference
+engine of the test configuration, recording Elo against epoch in
+
+   scratch / sha / "monitor" / "elo.yaml"
+"""
+
+import multiprocessing
+import os
+import random
+import re
+import signal
+import time
+import yaml
+from pathlib import Path
+from .bind_rank import parse_cpulist
+from .checkpoint_catalog import checkpoint_epoch
+from .test import ensure_engines
+from .utils import execute, flatten_cmd
+
+ELO_RE = re.compile(r"\bElo\s*:\s*(-?\d+(?:\.\d+)?)")
+NELO_RE = re.compile(r"nElo\s*:\s*(-?\d+(?:\.\d+)?)")
+
+
+def load_results(path):
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return yaml.safe_load(f) or []
+
+
+def save_results(path, results):
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "w") as f:
+        yaml.dump(results, f, default_flow_style=False)
+    os.replace(temp, path)
+
+
+def new_checkpoints(run_dir, done_epochs, min_age=60):
+    """
+    The periodically saved checkpoints (epoch=N-step=M.ckpt) not yet evaluated, by epoch.
+    Checkpoints modified in the last min_age seconds might still be written, and are skipped.
+    """
+    found = {}
+    for path in run_dir.rglob("epoch=*.ckpt"):
+        epoch = checkpoint_epoch(path)
+        if epoch in done_epochs:
+            continue
+        try:
+            if time.time() - path.stat().st_mtime < min_age:
+                continue
+        except FileNotFoundError:
+            continue  # removed by the trainer in the meantime (--save_top_k)
+        found[epoch] = path
+    return sorted(found.items())
+
+
+def convert_on_cpu(nnue_pytorch_dir, checkpoint, destination, convert):
+    env = os.environ.copy()
+    env["CUDA_VISIBLE_DEVICES"] = ""
+    cmd = ["python", "-u", "serialize.py", f"{checkpoint}", f"{destination}"]
+    cmd += flatten_cmd(convert["checkpoint2nnue"])
+    execute(
+        "Monitor: convert checkpoint",
+        cmd,
+        nnue_pytorch_dir,
+        False,
+        env=env,
+        prefix="monitor",
+    )
+
+
+def play_match(engines, nnue, test, config, match_dir):
+    """
+    Short fixed-node match of nnue against the reference, returns (Elo, nElo)
+    """
+    fastchess, stockfish_reference, stockfish_testing, book = engines
+    cores = str(config["cores"])
+    concurrency = config.get("concurrency", max(1, len(parse_cpulist(cores)) // 2))
+    cmd = [f"{fastchess}"]
+    cmd += ["-concurrency", f"{concurrency}", "-use-affinity", cores]
+    cmd += ["-rounds", f"{config.get('rounds', 100)}", "-games", "2", "-repeat"]
+    cmd += ["-srand", f"{random.randint(0, 10000)}"]
+    cmd += ["-openings", f"file={book}", "format=epd", "order=random"]
+    cmd += ["-report", "penta=true"]
+
+    cmd += ["-engine", f"name={nnue.stem}", f"cmd={stockfish_testing}"]
+    cmd += [f"option.EvalFile={nnue}"]
+    for option in test["testing"].get("options", []):
+        cmd += [f"option.{option}"]
+    cmd += ["-engine", "name=reference", f"cmd={stockfish_reference}"]
+    for option in test["reference"].get("options", []):
+        cmd += [f"option.{option}"]
+    cmd += ["-each", "proto=uci", "option.Threads=1"]
+    cmd += [f"option.Hash={config.get('hash', 16)}", f"nodes={config.get('nodes', 20000)}"]
+
+    output = execute(
+        f"Monitor: match {nnue.stem}",
+        cmd,
+        match_dir,
+        False,
+        r"Finished game|Started game",
+        prefix="monitor",
+    )
+
+    elo = nelo = None
+    for line in output:
+        match = ELO_RE.search(line)
+        if match:
+            elo = float(match.group(1))
+        match = NELO_RE.search(line)
+        if match:
+            nelo = float(match.group(1))
+    return elo, nelo
+
+
+def evaluate_checkpoint(
+    epoch, checkpoint, nnue_pytorch_dir, engines, step, test, config, monitor_dir
+):
+    """
+    The result of the match of the net of a checkpoint. A failure, e.g. of a
+    checkpoint removed by the trainer meanwhile, is recorded rather than raised,
+    so the monitor carries on with later checkpoints.
+    """
+    nnue = monitor_dir / f"epoch_{epoch}.nnue"
+    result = {"epoch": epoch, "checkpoint": f"{checkpoint}", "Elo": None, "nElo": None}
+    try:
+        convert_on_cpu(nnue_pytorch_dir, checkpoint, nnue, step["convert"])
+        elo, nelo = play_match(engines, nnue, test, config, monitor_dir)
+        result.update({"Elo": elo, "nElo": nelo})
+        print(f"📈 Monitor: epoch {epoch}: Elo {elo} nElo {nelo}", flush=True)
+    except Exception as e:
+        result["error"] = f"{e}"
+        print(f"⚠️  Monitor: evaluation of epoch {epoch} failed: {e}", flush=True)
+    finally:
+        nnue.unlink(missing_ok=True)
+    return result
+
+
+def monitor_training(
+    environment, current_sha, test_config_sha, nnue_pytorch_dir, stop
+):
+    """
+    Evaluate new checkpoints of the step until stop is set
+    """
+    config = environment["monitor"]
+    # own process group, so stop_monitor can also stop running matches
+    os.setpgrp()
+    os.sched_setaffinity(0, parse_cpulist(str(config["cores"])))
+
+    scratch = Path.cwd() / "scratch"
+    with open(scratch / current_sha / "step.yaml") as f:
+        step = yaml.safe_load(f)
+    with open(scratch / test_config_sha / "testing.yaml") as f:
+        test = yaml.safe_load(f)
+
+    engines = ensure_engines(environment, test)
+
+    run_dir = scratch / current_sha / "run"
+    monitor_dir = scratch / current_sha / "monitor"
+    monitor_dir.mkdir(parents=True, exist_ok=True)
+    results_file = monitor_dir / "elo.yaml"
+
+    while not stop.is_set():
+        results = load_results(results_file)
+        done_epochs = {r["epoch"] for r in results}
+        for epoch, checkpoint in new_checkpoints(run_dir, done_epochs):
+            if stop.is_set():
+                break
+            results.append(
+                evaluate_checkpoint(
+                    epoch,
+                    checkpoint,
+                    nnue_pytorch_dir,
+                    engines,
+                    step,
+                    test,
+                    config,
+                    monitor_dir,
+                )
+            )
+            results.sort(key=lambda r: r["epoch"])
+            save_results(results_file, results)
+        stop.wait(config.get("interval", 600))
+
+
+def start_monitor(environment, current_sha, test_config_sha, nnue_pytorch_dir):
+    """
+    Start the monitor in a side process, if the environment asks for it
+    """
+    if "monitor" not in environment or test_config_sha is None:
+        return None
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=monitor_training,
+        args=(environment, current_sha, test_config_sha, nnue_pytorch_dir, stop),
+        daemon=True,
+    )
+    process.start()
+    return process, stop
+
+
+def stop_monitor(monitor, timeout=60):
+    """
+    Stop the monitor, allowing a running match to finish within timeout
+    """
+    if monitor is None:
+        return
+    process, stop = monitor
+    stop.set()
+    process.join(timeout)
+    if process.is_alive():
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        process.join()
+
+
+def print_monitor_results(current_sha):
+    results = load_results(Path.cwd() / "scratch" / current_sha / "monitor" / "elo.yaml")
+    if not results:
+        return
+    print(f"\nIntermediate nets of step {current_sha}:")
+    print(f"{'epoch':>6} {'Elo':>8} {'nElo':>8}")
+    for r in results:
+        elo = "-" if r["Elo"] is None else f"{r['Elo']:.1f}"
+        nelo = "-" if r["nElo"] is None else f"{r['nElo']:.1f}"
+        print(f"{r['epoch']:6d} {elo:>8} {nelo:>8}")
@@ -0,0 +1,125 @@
+"""
+Retention policy for the run directories of completed training steps
+
+Once a step is final, later steps only need its final checkpoint, the .pt model
+and the nets. With
+
+   train:
+     retention:
+       keep_every: 100   # also keep the periodic checkpoints of every 100th epoch
+       keep_logs: false  # keep the lightning logs (e.g. tensorboard events)
+
+all other checkpoints (and logs) in scratch / sha / "run" are removed after the
+conversion of a step. Already completed steps can be pruned with
+
+   python -m nettest.prune --environment ENV [--dry-run] [STEP_SHA ...]
+"""
+
+import yaml
+from pathlib import Path
+from .checkpoint_catalog import checkpoint_epoch, refresh_catalog
+from .default_environment import get_default_environment
+
+
+def retention_policy(environment):
+    """
+    The retention policy of the environment, None if there is none
+    """
+    policy = environment.get("train", {}).get("retention")
+    if not policy:
+        return None
+    if policy is True:
+        policy = {}
+    return {
+        "keep_every": int(policy.get("keep_every", 0)),
+        "keep_logs": bool(policy.get("keep_logs", False)),
+    }
+
+
+def prunable_files(run_dir, final_checkpoint, policy):
+    """
+    The files of a completed run that the policy does not keep
+    """
+    keep_every = policy["keep_every"]
+    prunable = []
+    for path in run_dir.rglob("*"):
+        if not path.is_file() or path == final_checkpoint:
+            continue
+        if path.suffix == ".ckpt":
+            if keep_every > 0 and path.name.startswith("epoch="):
+                if (checkpoint_epoch(path) + 1) % keep_every == 0:
+                    continue
+            prunable.append(path)
+        elif "tfevents" in path.name and not policy["keep_logs"]:
+            prunable.append(path)
+    return prunable
+
+
+def prune_step(step_sha, policy, dry_run=False):
+    """
+    Remove the files of a completed step the policy does not keep, returns the bytes freed
+    """
+    step_dir = Path.cwd() / "scratch" / step_sha
+    final_yaml_file = step_dir / "final.yaml"
+    if not final_yaml_file.exists():
+        print(f"⚠️  Step {step_sha} is not final, not pruning")
+        return 0
+
+    with open(final_yaml_file) as f:
+        final = yaml.safe_load(f)
+    final_checkpoint = Path(final["checkpoint"])
+    assert final_checkpoint.exists(), f"{final_checkpoint} does not exist"
+
+    run_dir = step_dir / "run"
+    freed = 0
+    for path in prunable_files(run_dir, final_checkpoint, policy):
+        freed += path.stat().st_size
+        if not dry_run:
+            path.unlink()
+
+    if not dry_run:
+        refresh_catalog(run_dir)
+    action = "Would free" if dry_run else "Freed"
+    print(f"{action} {freed / 1e9:.1f} GB in step {step_sha}")
+    return freed
+
+
+def final_steps():
+    scratch = Path.cwd() / "scratch"
+    return sorted(p.parent.name for p in scratch.glob("*/final.yaml"))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Prune the run directories of completed training steps."
+    )
+    parser.add_argument(
+        "--environment", required=False, help="Definition of the environment file"
+    )
+    parser.add_argument(
+        "--keep-every",
+        type=int,
+        required=False,
+        help="Keep the checkpoints of every Nth epoch, overrides the environment",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Only report")
+    parser.add_argument("step_shas", nargs="*", help="Steps to prune, default all final steps")
+    args = parser.parse_args()
+
+    if args.environment:
+        print("Using environment file: ", args.environment)
+        with open(args.environment) as f:
+            environment = yaml.safe_load(f)
+    else:
+        environment = get_default_environment()
+
+    policy = retention_policy(environment) or retention_policy({"train": {"retention": True}})
+    if args.keep_every is not None:
+        policy["keep_every"] = args.keep_every
+
+    total = 0
+    for step_sha in args.step_shas or final_steps():
+        total += prune_step(step_sha, policy, args.dry_run)
+    print(f"{'Would free' if args.dry_run else 'Freed'} {total / 1e9:.1f} GB in total")
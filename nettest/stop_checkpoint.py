@@ -0,0 +1,88 @@
+"""
+Write a final checkpoint when the trainer is asked to stop
+
+Standalone script, executed in place of the training script (after bind_rank.py,
+if used), e.g.
+
+   python stop_checkpoint.py train.py ...
+   torchrun --nproc-per-node=4 bind_rank.py stop_checkpoint.py ddp_launcher.py train.py ...
+
+Every Lightning Trainer created by the script gets a callback that, on SIGTERM or
+SIGUSR1, stops training after the current batch and saves last.ckpt into the
+checkpoint directory, from which the next run resumes. These handlers replace
+those of Lightning while training, in particular its SLURM requeue on SIGUSR1.
+The script is run in this process, so it must not start the trainer in another.
+"""
+
+import importlib
+import os
+import runpy
+import signal
+import sys
+
+STOP_SIGNALS = (signal.SIGTERM, signal.SIGUSR1)
+
+
+def stop_callback_class(callback_base):
+    class StopCheckpoint(callback_base):
+        def __init__(self):
+            super().__init__()
+            self.requested = False
+
+        def request(self, signum, frame):
+            print(f"{signal.Signals(signum).name}: checkpoint and stop", flush=True)
+            self.requested = True
+
+        def on_train_start(self, trainer, pl_module):
+            # after Lightning has registered its own handlers
+            for signum in STOP_SIGNALS:
+                signal.signal(signum, self.request)
+
+        def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+            # saving is collective, all ranks stop at the same batch
+            if not trainer.strategy.reduce_boolean_decision(self.requested, all=False):
+                return
+            callback = trainer.checkpoint_callback
+            if callback is not None and callback.dirpath:
+                dirpath = callback.dirpath
+            else:
+                dirpath = os.path.join(trainer.default_root_dir, "checkpoints")
+            trainer.save_checkpoint(os.path.join(dirpath, "last.ckpt"))
+            trainer.should_stop = True
+
+    return StopCheckpoint
+
+
+def patch_trainer(module):
+    """
+    Add the stop callback to the Trainers of module (lightning.pytorch or pytorch_lightning)
+    """
+    callback_class = stop_callback_class(module.Callback)
+    original_init = module.Trainer.__init__
+
+    def __init__(self, *args, callbacks=None, **kwargs):
+        if callbacks is None:
+            callbacks = []
+        elif not isinstance(callbacks, list):
+            callbacks = [callbacks]
+        original_init(self, *args, callbacks=callbacks + [callback_class()], **kwargs)
+
+    module.Trainer.__init__ = __init__
+
+
+def main():
+    for name in ("lightning.pytorch", "pytorch_lightning"):
+        try:
+            patch_trainer(importlib.import_module(name))
+        except ImportError:
+            pass
+
+    script = sys.argv[1]
+    sys.argv = sys.argv[1:]
+    # imports relative to the script, not to nettest (which has a train.py too)
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
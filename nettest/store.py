@@ -0,0 +1,73 @@
+"""
+Content-addressed file store
+
+Files are stored once under their sha256, and made available at their usual
+location through hardlinks:
+
+   store_dir / "objects" / sha[:2] / sha : the content of a file with that sha256
+
+Adding a file that is already present in the store replaces it by a link to
+the stored copy, so identical files only use storage once.
+"""
+
+import os
+import uuid
+from pathlib import Path
+from .utils import sha256sum
+
+
+def object_path(store_dir, digest):
+    return Path(store_dir) / "objects" / digest[:2] / digest
+
+
+def replace_with_link(source, destination):
+    """
+    Atomically replace destination by a hardlink to source
+    """
+    destination = Path(destination)
+    temp = destination.with_name(f"{destination.name}.link_{uuid.uuid4()}")
+    os.link(source, temp)
+    try:
+        os.replace(temp, destination)
+    except Exception:
+        temp.unlink(missing_ok=True)
+        raise
+
+
+def add_file(store_dir, path, digest=None):
+    """
+    Add path to the store, and return its sha256.
+    If the digest is known (e.g. computed while downloading), it is not recomputed.
+    """
+    if digest is None:
+        digest = sha256sum(path)
+
+    stored = object_path(store_dir, digest)
+    stored.parent.mkdir(parents=True, exist_ok=True)
+
+    try:
+        if not stored.exists():
+            try:
+                os.link(path, stored)
+                return digest
+            except FileExistsError:
+                pass  # somebody else stored the same content concurrently
+        if not os.path.samefile(stored, path):
+            replace_with_link(stored, path)
+    except OSError as e:
+        # e.g. a filesystem without hardlinks, the file is still usable as is
+        print(f"⚠️  Could not deduplicate {path} in {store_dir}: {e}")
+
+    return digest
+
+
+def is_stored(store_dir, path, digest):
+    """
+    Check that path holds the content recorded for digest, without rehashing.
+    Valid because stored files are hardlinks of the content-addressed object.
+    """
+    stored = object_path(store_dir, digest)
+    try:
+        return os.path.samefile(stored, path)
+    except OSError:
+        return False
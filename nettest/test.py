@@ -1,19 +1,40 @@
 import yaml
 import re
 from pathlib import Path
-from .utils import execute, flatten_cmd, github_repo_url
+from .utils import execute, flatten_cmd
 from .default_environment import get_default_environment
 from .train import ensure_trainer
+from .binpack_cache import binpacks_in_use
+from .artifacts import add_artifact, publish, step_artifacts
+from .early_abort import failed_file
+from .git_mirror import checkout_sha
+from .binary_cache import choose_arch, stockfish_binary
+from .build_cache import (
+    build_env,
+    build_lock,
+    compiler_args,
+    compiler_signature,
+    publish_binary,
+    record_build,
+    reuse_key,
+    reuse_path,
+)
 import shutil
 import uuid
 import time
 import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 
-def ensure_fastchess(fastchess):
+def fastchess_path(fastchess):
+    sha = fastchess["code"]["sha"]
+    return Path.cwd() / f"scratch/packages/fastchess/{sha}" / "fastchess" / "fastchess"
+
+
+def ensure_fastchess(fastchess, jobs=None, prefix=None):
     """
-    Install the specified fastchess version
+    Install the specified fastchess version, building with jobs make jobs (default unlimited)
     """
 
     max_retries = 3
@@ -21,80 +42,73 @@ def ensure_fastchess(fastchess):
 
     sha = fastchess["code"]["sha"]
     owner = fastchess["code"]["owner"]
-    repo = github_repo_url(owner, "fastchess")
 
-    base_dir = Path.cwd() / f"scratch/packages/fastchess/{sha}"
-    fastchess_binary = base_dir / "fastchess" / "fastchess"
+    fastchess_binary = fastchess_path(fastchess)
+    base_dir = fastchess_binary.parents[1]
 
     if fastchess_binary.exists():
         return fastchess_binary
 
-    for attempt in range(1, max_retries + 1):
-        unique_suffix = str(uuid.uuid4())
-        temp_build_dir = base_dir.parent / f"{base_dir.name}_build_{unique_suffix}"
-        temp_fastchess_dir = temp_build_dir / "fastchess"
-
-        try:
-            temp_build_dir.mkdir(parents=True, exist_ok=True)
-
-            execute(
-                f"[attempt {attempt}] init repo",
-                ["git", "init"],
-                temp_fastchess_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] add remote",
-                ["git", "remote", "add", "origin", repo],
-                temp_fastchess_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] fetch sha {sha}",
-                ["git", "fetch", "--depth", "1", "origin", sha],
-                temp_fastchess_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] checkout sha {sha}",
-                ["git", "checkout", "--detach", sha],
-                temp_fastchess_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] build fastchess",
-                ["make", "-j"],
-                temp_fastchess_dir,
-                False,
-            )
-
-            # Try to atomically move the build to the target location
+    with build_lock(base_dir):
+        # built by another process while waiting
+        if fastchess_binary.exists():
+            return fastchess_binary
+
+        start = time.monotonic()
+        for attempt in range(1, max_retries + 1):
+            unique_suffix = str(uuid.uuid4())
+            temp_build_dir = base_dir.parent / f"{base_dir.name}_build_{unique_suffix}"
+            temp_fastchess_dir = temp_build_dir / "fastchess"
+
             try:
-                temp_build_dir.rename(base_dir)
-            except Exception:
+                temp_build_dir.mkdir(parents=True, exist_ok=True)
+
+                checkout_sha(owner, "fastchess", sha, temp_fastchess_dir)
+
+                execute(
+                    f"[attempt {attempt}] build fastchess",
+                    ["make", f"-j{jobs or ''}"] + compiler_args("CXX"),
+                    temp_fastchess_dir,
+                    False,
+                    env=build_env(),
+                    prefix=prefix,
+                )
+
+                # Try to atomically move the build to the target location
+                try:
+                    temp_build_dir.rename(base_dir)
+                except Exception:
+                    shutil.rmtree(temp_build_dir, ignore_errors=True)
+
+                assert fastchess_binary.exists(), "The binary should, but does not, exist."
+                record_build("fastchess", sha, time.monotonic() - start, "built")
+                return fastchess_binary
+
+            except Exception as e:
+                print(f"⚠️ Attempt {attempt} failed: {e}")
                 shutil.rmtree(temp_build_dir, ignore_errors=True)
+                if attempt < max_retries:
+                    print(f"🔁 Retrying after {retry_delay} seconds...")
+                    time.sleep(retry_delay)
+                else:
+                    print("❌ All attempts to build fastchess failed.")
+                    raise
 
-            assert fastchess_binary.exists(), "The binary should, but does not, exist."
-            return fastchess_binary
 
-        except Exception as e:
-            print(f"⚠️ Attempt {attempt} failed: {e}")
-            shutil.rmtree(temp_build_dir, ignore_errors=True)
-            if attempt < max_retries:
-                print(f"🔁 Retrying after {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                print("❌ All attempts to build fastchess failed.")
-                raise
+def stockfish_build(target, test):
+    code = test[target]["code"]
+    return code["owner"], code["sha"], code.get("target", "profile-build")
+
 
+def stockfish_path(target, test, arch):
+    _, sha, target_build = stockfish_build(target, test)
+    return stockfish_binary(sha, target_build, arch)
 
-def ensure_stockfish(target, test):
+
+def ensure_stockfish(target, test, jobs=None, prefix=None, arch=None):
     """
-    Install the specified Stockfish version
+    Install the specified Stockfish version, building with jobs make jobs (default unlimited)
+    for arch (default: the best available or supported by the host, see binary_cache.py)
     """
 
     max_retries = 3
@@ -104,78 +118,128 @@ def ensure_stockfish(target, test):
     sha = target_config["code"]["sha"]
     owner = target_config["code"]["owner"]
     target_build = target_config["code"].get("target", "profile-build")
-    repo = github_repo_url(owner, "Stockfish")
-
-    target_dir = Path.cwd() / f"scratch/packages/stockfish/{sha}-{target_build}"
-    stockfish_binary = target_dir / "Stockfish" / "src" / "stockfish"
-
-    if stockfish_binary.exists():
-        return stockfish_binary
-
-    for attempt in range(1, max_retries + 1):
-        unique_suffix = str(uuid.uuid4())
-        temp_build_dir = target_dir.parent / f"{target_dir.name}_build_{unique_suffix}"
-        temp_stockfish_dir = temp_build_dir / "Stockfish"
-        temp_stockfish_src_dir = temp_build_dir / "Stockfish" / "src"
-
-        try:
-            temp_build_dir.mkdir(parents=True, exist_ok=True)
-
-            execute(
-                f"[attempt {attempt}] init Stockfish {target}",
-                ["git", "init"],
-                temp_stockfish_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] add remote",
-                ["git", "remote", "add", "origin", repo],
-                temp_stockfish_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] fetch sha {sha}",
-                ["git", "fetch", "--depth", "1", "origin", sha],
-                temp_stockfish_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] checkout sha {sha}",
-                ["git", "checkout", "--detach", sha],
-                temp_stockfish_dir,
-                False,
-            )
-
-            # explicitly define ARCH, as the variable exists in the CI environment
-            execute(
-                f"[attempt {attempt}] build Stockfish",
-                ["make", "-j", f"{target_build}", "ARCH=native"],
-                temp_stockfish_src_dir,
-                False,
-            )
-
-            # Try to atomically move the build to the target location
+
+    if arch is None:
+        arch = choose_arch([stockfish_build(target, test)])
+    binary = stockfish_path(target, test, arch)
+    target_dir = binary.parents[2]
+
+    if binary.exists():
+        return binary
+
+    with build_lock(target_dir):
+        # built by another process while waiting
+        if binary.exists():
+            return binary
+
+        start = time.monotonic()
+        for attempt in range(1, max_retries + 1):
+            unique_suffix = str(uuid.uuid4())
+            temp_build_dir = target_dir.parent / f"{target_dir.name}_build_{unique_suffix}"
+            temp_stockfish_dir = temp_build_dir / "Stockfish"
+            temp_stockfish_src_dir = temp_build_dir / "Stockfish" / "src"
+
             try:
-                temp_build_dir.rename(target_dir)
-            except Exception:
-                # If rename fails clean up (maybe another process was faster), cleanup
+                # shas with unchanged sources give the same binary, also the same PGO profile
+                key = reuse_key(
+                    owner, "Stockfish", sha, "src", target_build, arch, compiler_signature()
+                )
+                reusable = reuse_path("stockfish", key, "stockfish")
+                if reusable.exists():
+                    shutil.rmtree(temp_build_dir, ignore_errors=True)
+                    publish_binary(reusable, binary)
+                    record_build("stockfish", sha, time.monotonic() - start, "reused")
+                    return binary
+
+                temp_build_dir.mkdir(parents=True, exist_ok=True)
+
+                checkout_sha(owner, "Stockfish", sha, temp_stockfish_dir)
+
+                # explicitly define ARCH, as the variable exists in the CI environment
+                execute(
+                    f"[attempt {attempt}] build Stockfish",
+                    ["make", f"-j{jobs or ''}", f"{target_build}", f"ARCH={arch}"]
+                    + compiler_args("COMPCXX"),
+                    temp_stockfish_src_dir,
+                    False,
+                    env=build_env(),
+                    prefix=prefix,
+                )
+
+                # Try to atomically move the build to the target location
+                try:
+                    temp_build_dir.rename(target_dir)
+                except Exception:
+                    # If rename fails clean up (maybe another process was faster), cleanup
+                    shutil.rmtree(temp_build_dir, ignore_errors=True)
+
+                assert binary.exists(), "The binary should, but does not, exist."
+                publish_binary(binary, reusable)
+                record_build("stockfish", sha, time.monotonic() - start, "built")
+                return binary
+
+            except Exception as e:
+                print(f"⚠️ Attempt {attempt} failed: {e}")
                 shutil.rmtree(temp_build_dir, ignore_errors=True)
+                if attempt < max_retries:
+                    print(f"🔁 Retrying after {retry_delay} seconds...")
+                    time.sleep(retry_delay)
+                else:
+                    print("❌ All attempts to build Stockfish failed.")
+                    raise
+
+
+def ensure_book():
+    """
+    Download the opening book for testing as needed
+    """
+    book_dir = Path.cwd() / "data"
+    book = book_dir / "UHO_Lichess_4852_v1.epd"
+    if not book.exists():
+        execute(
+            "download book",
+            [
+                "wget",
+                "https://github.com/official-stockfish/books/raw/refs/heads/master/UHO_Lichess_4852_v1.epd.zip",
+            ],
+            book_dir,
+            False,
+        )
+        execute("unzip book", ["unzip", "UHO_Lichess_4852_v1.epd.zip"], book_dir, False)
+
+    assert book.exists(), f"{book} does not exist"
+    return book
 
-            assert stockfish_binary.exists(), "The binary should, but does not, exist."
-            return stockfish_binary
 
-        except Exception as e:
-            print(f"⚠️ Attempt {attempt} failed: {e}")
-            shutil.rmtree(temp_build_dir, ignore_errors=True)
-            if attempt < max_retries:
-                print(f"🔁 Retrying after {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                print("❌ All attempts to build Stockfish failed.")
-                raise
+def ensure_engines(environment, test):
+    """
+    Provide fastchess, the reference and testing Stockfish and the book, building
+    concurrently, sharing test: build_jobs (default: the available cores) among the builds
+    """
+    budget = environment.get("test", {}).get("build_jobs")
+    if budget is None:
+        budget = len(os.sched_getaffinity(0))
+    # the same arch for both, so neither engine has a speed advantage
+    arch = choose_arch([stockfish_build("reference", test), stockfish_build("testing", test)])
+    missing = {
+        path
+        for path in (
+            fastchess_path(test["fastchess"]),
+            stockfish_path("reference", test, arch),
+            stockfish_path("testing", test, arch),
+        )
+        if not path.exists()
+    }
+    jobs = max(1, budget // max(1, len(missing)))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        fastchess = pool.submit(ensure_fastchess, test["fastchess"], jobs, "fastchess")
+        reference = pool.submit(
+            ensure_stockfish, "reference", test, jobs, "reference", arch
+        )
+        testing = pool.submit(ensure_stockfish, "testing", test, jobs, "testing", arch)
+        book = pool.submit(ensure_book)
+        return fastchess.result(), reference.result(), testing.result(), book.result()
 
 
 def run_fastchess(
@@ -199,10 +263,7 @@ def run_fastchess(
     match_dir.mkdir(parents=True, exist_ok=True)
 
     # net to be tested
-    final_yaml_file = Path.cwd() / "scratch" / testing_sha / "final.yaml"
-    assert final_yaml_file.exists(), f"{final_yaml_file} does not exist"
-    with open(final_yaml_file) as f:
-        final_config = yaml.safe_load(f)
+    final_config = step_artifacts(testing_sha)
     short_nnue = final_config["short_nnue"]
     std_nnue = final_config["std_nnue"]
     assert Path(std_nnue).exists(), f"{std_nnue} does not exist"
@@ -242,22 +303,7 @@ def run_fastchess(
         stdin_lines=[f"setoption name EvalFile value {std_nnue}", "bench", "quit"],
     )
 
-    # download book for testing as needed
-    book_dir = Path.cwd() / "data"
-    book = book_dir / "UHO_Lichess_4852_v1.epd"
-    if not book.exists():
-        execute(
-            "download book",
-            [
-                "wget",
-                "https://github.com/official-stockfish/books/raw/refs/heads/master/UHO_Lichess_4852_v1.epd.zip",
-            ],
-            book_dir,
-            False,
-        )
-        execute("unzip book", ["unzip", "UHO_Lichess_4852_v1.epd.zip"], book_dir, False)
-
-    assert book.exists(), f"{book} does not exist"
+    book = ensure_book()
 
     # collect specific options
     option_hash = test["fastchess"]["options"]["hash"]
@@ -407,46 +453,41 @@ def run_cross_check_eval(environment, test, testing_sha, stockfish_testing):
     assert stockfish_testing.exists()
 
     # add net to be tested
-    final_yaml_file = Path.cwd() / "scratch" / testing_sha / "final.yaml"
-    assert final_yaml_file.exists(), f"{final_yaml_file} does not exist"
-    with open(final_yaml_file) as f:
-        final_config = yaml.safe_load(f)
+    final_config = step_artifacts(testing_sha)
     std_nnue = final_config["std_nnue"]
     assert Path(std_nnue).exists(), f"{std_nnue} does not exist"
     checkpoint = final_config["checkpoint"]
     assert Path(checkpoint).exists(), f"{checkpoint} does not exist"
 
-    # test positions
-    assert "binpack" in test["crosscheck"], "crosscheck config must include binpack"
-    binpack = Path.cwd() / "data" / test["crosscheck"]["binpack"]
-    assert binpack.exists(), f"Binpack {binpack} does not exist"
-
     # TODO the trainer could be inserted automatically based on the step being tested.
     assert "trainer" in test["crosscheck"], "crosscheck config must include trainer"
     nnue_pytorch_dir = ensure_trainer(test["crosscheck"]["trainer"])
 
-    # configure and run cross_check_eval
-    # TODO: make device respect 'device'
-    cmd = [
-        "python",
-        "-u",
-        "cross_check_eval.py",
-        "--engine",
-        f"{stockfish_testing}",
-        "--data",
-        f"{binpack}",
-        "--device=cuda",
-    ]
+    # test positions, not evicted from the binpack cache while in use
+    assert "binpack" in test["crosscheck"], "crosscheck config must include binpack"
+    with binpacks_in_use(environment, [test["crosscheck"]["binpack"]]) as (binpack,):
+        # configure and run cross_check_eval
+        # TODO: make device respect 'device'
+        cmd = [
+            "python",
+            "-u",
+            "cross_check_eval.py",
+            "--engine",
+            f"{stockfish_testing}",
+            "--data",
+            f"{binpack}",
+            "--device=cuda",
+        ]
 
-    # add options to specify count and features
-    if "other_options" in test["crosscheck"]:
-        cmd += flatten_cmd(test["crosscheck"]["other_options"])
+        # add options to specify count and features
+        if "other_options" in test["crosscheck"]:
+            cmd += flatten_cmd(test["crosscheck"]["other_options"])
 
-    cmd_nnue = cmd + ["--net", f"{std_nnue}"]
-    execute("Run cross check eval from .nnue ", cmd_nnue, nnue_pytorch_dir, False)
+        cmd_nnue = cmd + ["--net", f"{std_nnue}"]
+        execute("Run cross check eval from .nnue ", cmd_nnue, nnue_pytorch_dir, False)
 
-    cmd_ckpt = cmd_nnue + ["--checkpoint", f"{checkpoint}"]
-    execute("Run cross check eval from .ckpt ", cmd_ckpt, nnue_pytorch_dir, False)
+        cmd_ckpt = cmd_nnue + ["--checkpoint", f"{checkpoint}"]
+        execute("Run cross check eval from .ckpt ", cmd_ckpt, nnue_pytorch_dir, False)
 
 
 def run_test(environment, test_config_sha, testing_sha):
@@ -456,12 +497,16 @@ def run_test(environment, test_config_sha, testing_sha):
 
     print(f"Testing config {test_config_sha} for sha {testing_sha}", flush=True)
 
+    if failed_file(testing_sha).exists():
+        print(f"⚠️  Step {testing_sha} has failed, nothing to test")
+        return None, None
+
     with open(Path.cwd() / "scratch" / test_config_sha / "testing.yaml") as f:
         test = yaml.safe_load(f)
 
-    fastchess = ensure_fastchess(test["fastchess"])
-    stockfish_reference = ensure_stockfish("reference", test)
-    stockfish_testing = ensure_stockfish("testing", test)
+    fastchess, stockfish_reference, stockfish_testing, _ = ensure_engines(
+        environment, test
+    )
 
     run_cross_check_eval(environment, test, testing_sha, stockfish_testing)
 
@@ -476,12 +521,17 @@ def run_test(environment, test_config_sha, testing_sha):
     )
 
     # store as an artifact for this run
-    artifact_dir = Path.cwd() / "cidir" / f"test_{test_config_sha}_result"
-    artifact_dir.mkdir(parents=True, exist_ok=True)
-    artifact_txt = artifact_dir / f"{testing_sha}_result.txt"
-    with open(artifact_txt, "w") as f:
+    result_txt = (
+        Path.cwd() / "scratch" / test_config_sha / "match" / testing_sha / "result.txt"
+    )
+    result_txt.parent.mkdir(parents=True, exist_ok=True)
+    result_txt.unlink(missing_ok=True)
+    with open(result_txt, "w") as f:
         f.write(f"Winning net: {winning_net}\n")
         f.write(f"Elo: {nElo}\n")
+    add_artifact(result_txt)
+    artifact_dir = Path.cwd() / "cidir" / f"test_{test_config_sha}_result"
+    publish(result_txt, artifact_dir / f"{testing_sha}_result.txt")
 
     return winning_net, nElo
 
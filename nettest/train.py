@@ -1,10 +1,39 @@
 import os
 from pathlib import Path
 import shutil
-import torch
+import signal
 import time
-from .utils import execute, MyDumper, sha256sum, find_most_recent, supports_numactl, flatten_cmd, github_repo_url
+from concurrent.futures import ThreadPoolExecutor
+from .utils import execute, MyDumper, supports_numactl, options_dict, flatten_cmd
 from .default_environment import get_default_environment
+from .binpack_cache import binpacks_in_use
+from .binpack_subset import subset_binpacks
+from .autotune import loader_settings
+from .gpu_topology import (
+    exclude_cpus,
+    format_cpulist,
+    gpu_placement,
+    node_cpus,
+    numactl_args,
+    placement_env,
+)
+from .bind_rank import parse_cpulist
+from .train_metrics import MetricsRecorder, load_metrics, summarize_metrics
+from .early_abort import (
+    EarlyAbort,
+    TUNED_OPTIONS,
+    failed_file,
+    lineage_key,
+    load_envelope,
+    mark_failed,
+    record_run,
+    val_loss_curve,
+)
+from .artifacts import add_artifact, publish, record_step
+from .checkpoint_catalog import latest_checkpoint, mark_stale, refresh_catalog
+from .git_mirror import checkout_sha
+from .build_cache import build_env, build_lock, record_build
+from .prune import prune_step, retention_policy
 import uuid
 import yaml
 
@@ -19,7 +48,6 @@ def ensure_trainer(trainer):
 
     sha = trainer["sha"]
     owner = trainer["owner"]
-    repo = github_repo_url(owner, "nnue-pytorch")
 
     trainer_dir = Path.cwd() / f"scratch/packages/trainer/{sha}"
     nnue_pytorch_dir = trainer_dir / "nnue-pytorch"
@@ -28,84 +56,113 @@ def ensure_trainer(trainer):
     if artifact and artifact.exists():
         return nnue_pytorch_dir
 
-    for attempt in range(1, max_retries + 1):
-        unique_suffix = str(uuid.uuid4())
-        temp_trainer_dir = (
-            trainer_dir.parent / f"{trainer_dir.name}_build_{unique_suffix}"
-        )
-        temp_nnue_pytorch_dir = temp_trainer_dir / "nnue-pytorch"
-
-        try:
-            temp_trainer_dir.mkdir(parents=True, exist_ok=True)
-
-            execute(
-                f"[attempt {attempt}] init trainer repo",
-                ["git", "init"],
-                temp_nnue_pytorch_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] add remote",
-                ["git", "remote", "add", "origin", repo],
-                temp_nnue_pytorch_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] fetch sha {sha}",
-                ["git", "fetch", "--depth", "1", "origin", sha],
-                temp_nnue_pytorch_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] checkout sha",
-                ["git", "checkout", "--detach", sha],
-                temp_nnue_pytorch_dir,
-                False,
-            )
-
-            execute(
-                f"[attempt {attempt}] build data loader",
-                ["bash", "setup_script.sh"],
-                temp_nnue_pytorch_dir,
-                False,
+    with build_lock(trainer_dir):
+        # built by another process while waiting
+        artifact = next(nnue_pytorch_dir.rglob("*data_loader*.so"), None)
+        if artifact and artifact.exists():
+            return nnue_pytorch_dir
+
+        start = time.monotonic()
+        for attempt in range(1, max_retries + 1):
+            unique_suffix = str(uuid.uuid4())
+            temp_trainer_dir = (
+                trainer_dir.parent / f"{trainer_dir.name}_build_{unique_suffix}"
             )
+            temp_nnue_pytorch_dir = temp_trainer_dir / "nnue-pytorch"
 
             try:
-                temp_trainer_dir.rename(trainer_dir)
-            except Exception:
+                temp_trainer_dir.mkdir(parents=True, exist_ok=True)
+
+                checkout_sha(owner, "nnue-pytorch", sha, temp_nnue_pytorch_dir)
+
+                execute(
+                    f"[attempt {attempt}] build data loader",
+                    ["bash", "setup_script.sh"],
+                    temp_nnue_pytorch_dir,
+                    False,
+                    env=build_env(),
+                )
+
+                try:
+                    temp_trainer_dir.rename(trainer_dir)
+                except Exception:
+                    shutil.rmtree(temp_trainer_dir, ignore_errors=True)
+
+                artifact = next(nnue_pytorch_dir.rglob("*data_loader*.so"), None)
+                if artifact and artifact.exists():
+                    record_build("trainer", sha, time.monotonic() - start, "built")
+                    return nnue_pytorch_dir
+                raise Exception("Trainer build failed, artifact not found")
+
+            except Exception as e:
+                print(f"⚠️ Attempt {attempt} failed: {e}")
                 shutil.rmtree(temp_trainer_dir, ignore_errors=True)
 
-            artifact = next(nnue_pytorch_dir.rglob("*data_loader*.so"), None)
-            if artifact and artifact.exists():
-                return nnue_pytorch_dir
-            raise Exception("Trainer build failed, artifact not found")
-
-        except Exception as e:
-            print(f"⚠️ Attempt {attempt} failed: {e}")
-            shutil.rmtree(temp_trainer_dir, ignore_errors=True)
-
-            if attempt < max_retries:
-                print(f"🔁 Retrying after {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                print("❌ All attempts failed.")
-                raise
+                if attempt < max_retries:
+                    print(f"🔁 Retrying after {retry_delay} seconds...")
+                    time.sleep(retry_delay)
+                else:
+                    print("❌ All attempts failed.")
+                    raise
 
 
-def ckpt_reached_end(ckpt_path, max_epochs):
+def ckpt_reached_end(ckpt_path, epoch, max_epochs):
     reached_end = False
     if ckpt_path is not None:
-        ckpt = torch.load(ckpt_path, map_location="cpu")
-        epoch = ckpt["epoch"]
         print(f"The {ckpt_path} was trained for {epoch + 1} epochs")
         reached_end = epoch + 1 >= max_epochs
 
     return reached_end
 
 
+# checkpoints to resume from, including those Lightning writes when signaled on SLURM
+RESUME_CHECKPOINTS = ("last.ckpt", "hpc_ckpt_*.ckpt")
+
+
+def timings_file():
+    return Path.cwd() / "scratch" / "packages" / "timings.yaml"
+
+
+def record_timing(kind, seconds, keep=5):
+    """
+    Remember the duration of the last few operations of a kind, e.g. conversion
+    """
+    path = timings_file()
+    timings = {}
+    if path.exists():
+        with open(path) as f:
+            timings = yaml.safe_load(f) or {}
+    timings[kind] = (timings.get(kind, []) + [round(seconds, 1)])[-keep:]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "w") as f:
+        yaml.dump(timings, f, default_flow_style=False)
+    os.replace(temp, path)
+
+
+def expected_timing(kind):
+    path = timings_file()
+    if not path.exists():
+        return None
+    with open(path) as f:
+        timings = yaml.safe_load(f) or {}
+    return max(timings[kind]) if timings.get(kind) else None
+
+
+def time_margin(environment):
+    """
+    Seconds to reserve at the end of a job, for the trainer to stop and save,
+    and for the net conversion. Based on measurements, 30min until there are some.
+    """
+    if "time_margin" in environment.get("train", {}):
+        return int(environment["train"]["time_margin"])
+    shutdown = expected_timing("shutdown")
+    conversion = expected_timing("conversion")
+    if shutdown is None or conversion is None:
+        return 30 * 60
+    return int(min(30 * 60, max(5 * 60, 1.5 * (shutdown + conversion))))
+
+
 def parse_slurm_timelimit(value: str) -> int:
     hh, mm, ss = value.split(":")
     return int(hh) * 3600 + int(mm) * 60 + int(ss)
@@ -119,24 +176,35 @@ def seconds_to_ddhhmmss(total: int) -> str:
     return f"{dd:02d}:{hh:02d}:{mm:02d}:{ss:02d}"
 
 
-def run_trainer(environment, current_sha, previous_sha, run, nnue_pytorch_dir):
+def run_trainer(
+    environment, current_sha, previous_sha, run, nnue_pytorch_dir, early_abort=None
+):
     """
-    Run the training recipe for this step
+    Run the training recipe for this step.
+    early_abort, if given, may stop training (see early_abort.py).
     """
 
-    data_dir = Path.cwd() / "data"
-
-    # first check all binpacks are available in non-compressed form
-    for binpack in run["binpacks"]:
-        full_path = data_dir / binpack
-        # check if it is available in compressed form, and uncompress as needed
-        if not full_path.exists():
-            full_path_zst = Path(str(full_path) + ".zst")
-            if full_path_zst.exists():
-                cmd = ["zstd", "-d", str(full_path_zst), "-o", str(full_path)]
-                execute("Uncompress binpack.zst", cmd, nnue_pytorch_dir, False)
-            else:
-                assert False, f"The following binpack could not be found: {binpack}"
+    # first make all binpacks available in non-compressed form, and keep them
+    # from being evicted from the cache while training
+    with binpacks_in_use(environment, run["binpacks"]) as binpacks:
+        return train_on_binpacks(
+            environment,
+            current_sha,
+            previous_sha,
+            run,
+            nnue_pytorch_dir,
+            binpacks,
+            early_abort,
+        )
+
+
+def train_on_binpacks(
+    environment, current_sha, previous_sha, run, nnue_pytorch_dir, binpacks, early_abort
+):
+    """
+    The body of run_trainer, with binpacks the available non-compressed files
+    """
+    binpacks = subset_binpacks(run["binpacks"], binpacks, run.get("binpack_subset"))
 
     # some architecture specific options
     run_env = os.environ.copy()
@@ -149,20 +217,64 @@ def run_trainer(environment, current_sha, previous_sha, run, nnue_pytorch_dir):
     num_gpus = len([d for d in devices.split(",") if d.strip()])
     local_devices = "".join([f"{i}," for i in range(num_gpus)])
     nproc = max(1, num_gpus)
+
+    # bind to the cores and memory local to each GPU, as found on the machine.
+    # nvidia-smi numbers GPUs in PCI bus order, make CUDA use the same order.
+    placement = gpu_placement(devices)
+    if placement is not None:
+        run_env["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
+    train_environment = environment.get("train", {})
+    static_binding = "cpunodebind" in train_environment or "membind" in train_environment
+
+    # keep training off the cores reserved for the monitor (see monitor.py)
+    reserved = set()
+    if "monitor" in environment:
+        reserved = parse_cpulist(str(environment["monitor"]["cores"]))
+    training_cpus = os.sched_getaffinity(0) - reserved
+    if reserved:
+        if placement is None:
+            placement = [{"node": None, "cpus": None}] * nproc
+        placement = exclude_cpus(placement, reserved, training_cpus)
+
+    bind_rank = str(Path(__file__).resolve().with_name("bind_rank.py"))
+    # the trainer checkpoints when asked to stop, see stop_checkpoint.py
+    stop_checkpoint = str(Path(__file__).resolve().with_name("stop_checkpoint.py"))
     if nproc > 1:
-        cmd = ["torchrun", f"--nproc-per-node={nproc}", "ddp_launcher.py", "train.py"]
+        cmd = ["torchrun", f"--nproc-per-node={nproc}"]
+        if placement is not None:
+            run_env.update(placement_env(placement, supports_numactl()))
+            cmd.append(bind_rank)
+        cmd += [stop_checkpoint, "ddp_launcher.py", "train.py"]
+    elif supports_numactl() and (placement is None or static_binding):
+        cpunodebind = train_environment.get("cpunodebind", "0")
+        membind = train_environment.get("membind", "0")
+        if reserved:
+            cpus = node_cpus(cpunodebind) & training_cpus
+            cmd = ["numactl", f"--physcpubind={format_cpulist(cpus)}"]
+        else:
+            cmd = ["numactl", f"--cpunodebind={cpunodebind}"]
+        cmd += [f"--membind={membind}", "python", "-u", stop_checkpoint, "train.py"]
     elif supports_numactl():
-        cpunodebind = environment["train"].get("cpunodebind", "0")
-        membind = environment["train"].get("membind", "0")
-        cmd = ["numactl", f"--cpunodebind={cpunodebind}", f"--membind={membind}"]
-        cmd += ["python", "-u", "train.py"]
+        cmd = ["numactl"] + numactl_args(placement[0])
+        cmd += ["python", "-u", stop_checkpoint, "train.py"]
+    elif reserved:
+        # without numactl, the affinity is set by bind_rank.py
+        run_env.update(placement_env(placement, False))
+        cmd = ["python", "-u", bind_rank, stop_checkpoint, "train.py"]
     else:
-        cmd = ["python", "-u", "train.py"]
+        cmd = ["python", "-u", stop_checkpoint, "train.py"]
+
+    for binpack in binpacks:
+        cmd.append(str(binpack))
 
-    for binpack in run["binpacks"]:
-        cmd.append(str(data_dir / binpack))
+    # the trainer is installed per sha, see ensure_trainer
+    tuned = loader_settings(
+        environment, nnue_pytorch_dir, nnue_pytorch_dir.parent.name, binpacks, run
+    )
 
-    if "train" in environment and "threads" in environment["train"]:
+    if tuned is not None:
+        num_threads = tuned[1]
+    elif "train" in environment and "threads" in environment["train"]:
         num_threads = environment["train"]["threads"]
     else:
         # seems always a reasonable default
@@ -171,23 +283,27 @@ def run_trainer(environment, current_sha, previous_sha, run, nnue_pytorch_dir):
     cmd.append(f"--gpus={local_devices}")
 
     # large net needs at least 16 threads, smaller nets might need more
-    if "train" in environment and "workers" in environment["train"]:
+    if tuned is not None:
+        workers = tuned[0]
+    elif "train" in environment and "workers" in environment["train"]:
         workers = environment["train"]["workers"]
     else:
-        cpu_count = os.cpu_count()
+        cpu_count = len(training_cpus) if reserved else os.cpu_count()
         workers = cpu_count * 3 // 2 if cpu_count is not None else 16
     cmd.append(f"--num-workers={workers}")
 
     # append all options
     cmd = cmd + flatten_cmd(run["other_options"])
 
-    # for now use 30min less than total allowed time to allow for eventual net conversion.
+    # use the remaining time of the job, except for a margin to save and convert the net.
     end = os.environ.get("SLURM_JOB_END_TIME")
     start = os.environ.get("SLURM_JOB_START_TIME")
+    max_time_seconds = None
     if end is not None and start is not None:
-        total_seconds = int(end) - int(start) - 30 * 60
-        max_time = seconds_to_ddhhmmss(max(total_seconds, 0))
-        cmd.append(f"--max_time={max_time}")
+        margin = time_margin(environment)
+        max_time_seconds = max(int(end) - int(time.time()) - margin, 0)
+        print(f"Reserving {margin}s at the end of the job for saving and conversion")
+        cmd.append(f"--max_time={seconds_to_ddhhmmss(max_time_seconds)}")
 
     max_epochs = int(run["max_epochs"])
     cmd.append(f"--max_epochs={max_epochs}")
@@ -202,8 +318,10 @@ def run_trainer(environment, current_sha, previous_sha, run, nnue_pytorch_dir):
     # if the root_dir exists, assume we try to restart from the latest found checkpoint
     resume_this_ckpt = None
     if root_dir.exists():
-        resume_this_ckpt = find_most_recent(root_dir, "last.ckpt")
-        reached_end = ckpt_reached_end(resume_this_ckpt, max_epochs)
+        last_ckpt, epoch = latest_checkpoint(root_dir)
+        reached_end = ckpt_reached_end(last_ckpt, epoch, max_epochs)
+        # a checkpoint written on preemption may be more recent than last.ckpt
+        resume_this_ckpt, _ = latest_checkpoint(root_dir, RESUME_CHECKPOINTS)
     else:
         reached_end = False
 
@@ -236,10 +354,43 @@ def run_trainer(environment, current_sha, previous_sha, run, nnue_pytorch_dir):
             assert False
 
     if not reached_end:
-        execute("Train network", cmd, nnue_pytorch_dir, False, env=run_env)
-        # now verify if we have reached max_epoch or not
-        final_ckpt = find_most_recent(root_dir, "last.ckpt")
-        reached_end = ckpt_reached_end(final_ckpt, max_epochs)
+        # let the trainer write last.ckpt and stop if the job is preempted or cancelled.
+        # torchrun only passes SIGTERM on to the ranks, so SIGUSR1 is sent as SIGTERM.
+        forward_signals = {signal.SIGTERM: signal.SIGTERM, signal.SIGUSR1: signal.SIGTERM}
+        mark_stale(root_dir)
+        options = options_dict(run["other_options"])
+        batch_size = options.get("batch-size", options.get("batch_size", 16384))
+        recorder = MetricsRecorder(root_dir / "metrics", int(batch_size), devices)
+
+        def on_line(line):
+            recorder(line)
+            return early_abort is not None and early_abort(line)
+
+        launch = time.monotonic()
+        try:
+            execute(
+                "Train network",
+                cmd,
+                nnue_pytorch_dir,
+                False,
+                env=run_env,
+                forward_signals=forward_signals,
+                on_line=on_line,
+            )
+        finally:
+            recorder.close()
+        elapsed = time.monotonic() - launch
+        if early_abort is not None and early_abort.reason is not None:
+            refresh_catalog(root_dir)
+            mark_failed(current_sha, early_abort.reason)
+            return False
+        # record the new checkpoints, and verify if we have reached max_epoch or not
+        refresh_catalog(root_dir)
+        final_ckpt, epoch = latest_checkpoint(root_dir)
+        reached_end = ckpt_reached_end(final_ckpt, epoch, max_epochs)
+        if max_time_seconds is not None and not reached_end and elapsed >= max_time_seconds:
+            # the trainer stopped at max_time, measure how long it took beyond that
+            record_timing("shutdown", elapsed - max_time_seconds)
 
     if reached_end:
         print("🎉 Success: training reached max_epochs")
@@ -251,27 +402,15 @@ def run_trainer(environment, current_sha, previous_sha, run, nnue_pytorch_dir):
         return False
 
 
-def run_conversion(environment, current_sha, convert, nnue_pytorch_dir):
-    """
-    Convert the final checkpoint into a .nnue and a .pt
-    """
-
-    root_dir = Path.cwd() / "scratch" / current_sha / "run"
+def serialize(name, source, destination, options, nnue_pytorch_dir):
+    cmd = ["python", "-u", "serialize.py", f"{source}", f"{destination}"] + options
+    execute(name, cmd, nnue_pytorch_dir, False, prefix=destination.name)
 
-    checkpoint = find_most_recent(root_dir, "last.ckpt")
-    assert checkpoint is not None, "No checkpoint found in the run directory"
 
-    # run the conversion to model
-    model = checkpoint.with_suffix(".pt")
-    cmd = [
-        "python",
-        "-u",
-        "serialize.py",
-        f"{checkpoint}",
-        f"{model}",
-    ]
-    cmd = cmd + flatten_cmd(convert["checkpoint2nnue"])
-    execute("Convert to pt", cmd, nnue_pytorch_dir, False)
+def convert_to_nnue(environment, checkpoint, convert, nnue_pytorch_dir):
+    """
+    Convert the checkpoint into a .nnue, optimized if the recipe asks for it
+    """
 
     # run the conversion to nnue, no optimization here
     if "optimize" in convert:
@@ -279,58 +418,92 @@ def run_conversion(environment, current_sha, convert, nnue_pytorch_dir):
     else:
         destination = checkpoint.with_suffix(".nnue")
 
-    cmd = [
-        "python",
-        "-u",
-        "serialize.py",
-        f"{checkpoint}",
-        f"{destination}",
-    ]
-    cmd = cmd + flatten_cmd(convert["checkpoint2nnue"])
-    execute("Convert to nnue", cmd, nnue_pytorch_dir, False)
+    serialize(
+        "Convert to nnue",
+        checkpoint,
+        destination,
+        flatten_cmd(convert["checkpoint2nnue"]),
+        nnue_pytorch_dir,
+    )
 
     # optimize as a second step (see https://github.com/official-stockfish/nnue-pytorch/issues/322)
-    if "optimize" in convert:
-        assert "binpack" in convert, "optimize on conversion, requires binpack entry"
-        binpack = Path.cwd() / "data" / convert["binpack"]
-        source = destination
-        nnue = checkpoint.with_suffix(".nnue")
-        if "train" in environment and "devices" in environment["train"]:
-            device = [
-                int(x) for x in environment["train"]["devices"].rstrip(",").split(",")
-            ][0]
-        else:
-            device = "0"
-        cmd = [
-            "python",
-            "-u",
-            "serialize.py",
-            f"{source}",
-            f"{nnue}",
-            f"--ft_optimize_data={binpack}",
-            f"--device={device}",
-        ]
-        cmd = cmd + flatten_cmd(convert["optimize"])
-        execute("Optimize nnue", cmd, nnue_pytorch_dir, False)
+    if "optimize" not in convert:
+        return destination
+
+    assert "binpack" in convert, "optimize on conversion, requires binpack entry"
+    nnue = checkpoint.with_suffix(".nnue")
+    if "train" in environment and "devices" in environment["train"]:
+        device = [
+            int(x) for x in environment["train"]["devices"].rstrip(",").split(",")
+        ][0]
     else:
-        nnue = destination
+        device = "0"
+    with binpacks_in_use(environment, [convert["binpack"]]) as (binpack,):
+        options = [f"--ft_optimize_data={binpack}", f"--device={device}"]
+        options += flatten_cmd(convert["optimize"])
+        serialize("Optimize nnue", destination, nnue, options, nnue_pytorch_dir)
+    return nnue
+
 
-    # get sha
-    sha = sha256sum(nnue)
+def run_conversion(environment, current_sha, convert, nnue_pytorch_dir):
+    """
+    Convert the final checkpoint into a .nnue and a .pt
+    """
+
+    start = time.monotonic()
+    root_dir = Path.cwd() / "scratch" / current_sha / "run"
+
+    checkpoint, _ = latest_checkpoint(root_dir)
+    assert checkpoint is not None, "No checkpoint found in the run directory"
+
+    # outputs of an earlier attempt may be links into the artifact store, never write through them
+    for suffix in (".pt", ".nnue"):
+        checkpoint.with_suffix(suffix).unlink(missing_ok=True)
+    (checkpoint.parent / "nonopt.nnue").unlink(missing_ok=True)
+
+    # run the conversion to model, concurrently with the conversion to nnue,
+    # both only read the checkpoint.
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        model = checkpoint.with_suffix(".pt")
+        model_future = pool.submit(
+            serialize,
+            "Convert to pt",
+            checkpoint,
+            model,
+            flatten_cmd(convert["checkpoint2nnue"]),
+            nnue_pytorch_dir,
+        )
+        nnue = convert_to_nnue(environment, checkpoint, convert, nnue_pytorch_dir)
+        model_future.result()
+
+    # store the net and model, and publish the net under its standard name
+    sha = add_artifact(nnue)
     sha_short = sha[:12]
     short_nnue = f"nn-{sha_short}.nnue"
     std_nnue = nnue.parent / short_nnue
-    shutil.copy(nnue, std_nnue)
+    publish(nnue, std_nnue)
     print(f"Last nnue for step {current_sha} is {short_nnue}")
     print(f"nnue available as {std_nnue}")
+    model_sha = add_artifact(model)
 
     # store as an artifact for this run
     artifact_dir = Path.cwd() / "cidir" / f"step_{current_sha}"
-    artifact_dir.mkdir(parents=True, exist_ok=True)
     artifact_nnue = artifact_dir / short_nnue
-    shutil.copy(nnue, artifact_nnue)
+    publish(nnue, artifact_nnue)
     print(f"nnue available as artifact step_{current_sha}")
 
+    record_step(
+        current_sha,
+        {
+            "short_nnue": short_nnue,
+            "std_nnue": f"{std_nnue}",
+            "nnue_sha256": sha,
+            "model": f"{model}",
+            "model_sha256": model_sha,
+            "checkpoint": f"{checkpoint}",
+        },
+    )
+
     final_file = Path.cwd() / "scratch" / current_sha / "final.yaml"
     final = {
         "short_nnue": f"{short_nnue}",
@@ -341,12 +514,16 @@ def run_conversion(environment, current_sha, convert, nnue_pytorch_dir):
     with Path(final_file).open(mode="w", encoding="utf-8") as f:
         yaml.dump(final, f, Dumper=MyDumper, default_flow_style=False, width=300)
 
+    record_timing("conversion", time.monotonic() - start)
+
     return
 
 
-def run_step(environment, current_sha, previous_sha):
+def run_step(environment, current_sha, previous_sha, test_config_sha=None):
     """
-    Driver to run the step
+    Driver to run the step.
+    With a test_config_sha, intermediate nets can be evaluated during training
+    (see monitor.py).
     """
 
     if (Path.cwd() / "scratch" / current_sha / "final.yaml").exists():
@@ -355,15 +532,48 @@ def run_step(environment, current_sha, previous_sha):
         )
         return
 
+    if failed_file(current_sha).exists():
+        print(f"⚠️  Step {current_sha} has failed, remove {failed_file(current_sha)} to retry")
+        return
+
+    if previous_sha.lower() != "none" and failed_file(previous_sha).exists():
+        mark_failed(current_sha, {"reason": f"previous step {previous_sha} failed"})
+        return
+
     with open(Path.cwd() / "scratch" / current_sha / "step.yaml") as f:
         step = yaml.safe_load(f)
 
     assert step["sha"] == current_sha
 
     nnue_pytorch_dir = ensure_trainer(step["trainer"])
-    reached_end = run_trainer(
-        environment, current_sha, previous_sha, step["run"], nnue_pytorch_dir
-    )
+
+    # compare the validation loss with earlier runs of the same lineage, if asked for
+    abort_config = environment.get("train", {}).get("early_abort")
+    if abort_config is True:
+        abort_config = {}
+    lineage = lineage_key(step, (abort_config or {}).get("tuned", TUNED_OPTIONS))
+    early_abort = None
+    if abort_config not in (None, False):
+        early_abort = EarlyAbort(load_envelope(lineage), abort_config, current_sha)
+
+    # imported here, as the monitor uses the test module, which imports this one
+    from .monitor import start_monitor, stop_monitor, print_monitor_results
+
+    monitor = start_monitor(environment, current_sha, test_config_sha, nnue_pytorch_dir)
+    try:
+        reached_end = run_trainer(
+            environment,
+            current_sha,
+            previous_sha,
+            step["run"],
+            nnue_pytorch_dir,
+            early_abort,
+        )
+    finally:
+        stop_monitor(monitor)
+    metrics_file = Path.cwd() / "scratch" / current_sha / "run" / "metrics"
+    summarize_metrics(metrics_file)
+    print_monitor_results(current_sha)
 
     if reached_end:
         run_conversion(
@@ -372,10 +582,55 @@ def run_step(environment, current_sha, previous_sha):
             step["convert"],
             nnue_pytorch_dir,
         )
+        record_run(lineage, current_sha, val_loss_curve(load_metrics(metrics_file)))
+
+        policy = retention_policy(environment)
+        if policy is not None:
+            prune_step(current_sha, policy)
 
     return
 
 
+def remaining_seconds():
+    """
+    Seconds left in the SLURM allocation, None if unknown
+    """
+    end = os.environ.get("SLURM_JOB_END_TIME")
+    if end is None:
+        return None
+    return int(end) - int(time.time())
+
+
+def run_chain(environment, entries):
+    """
+    Run consecutive training schedule entries (run_step kwargs) in one allocation,
+    as long as the remaining walltime allows, and return the entries not run.
+    The first entry is always run. A step that does not complete ends the chain,
+    e.g. when it runs out of time or is preempted.
+    """
+    config = environment.get("train", {}).get("chain") or {}
+    if config is True:
+        config = {}
+    min_seconds = int(config.get("min_seconds", 3600)) + time_margin(environment)
+
+    for index, kwargs in enumerate(entries):
+        remaining = remaining_seconds()
+        if index > 0 and remaining is not None and remaining < min_seconds:
+            print(f"⏱️  {remaining}s left in the allocation, handing off the remaining steps")
+            return entries[index:]
+
+        run_step(environment, **kwargs)
+
+        current_sha = kwargs["current_sha"]
+        if not (Path.cwd() / "scratch" / current_sha / "final.yaml").exists():
+            if failed_file(current_sha).exists():
+                continue
+            print(f"⏱️  Step {current_sha} did not complete, handing off the remaining steps")
+            return entries[index + 1 :]
+
+    return []
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -385,6 +640,11 @@ if __name__ == "__main__":
     parser.add_argument(
         "--environment", required=False, help="Definition of the environment file"
     )
+    parser.add_argument(
+        "--test-config",
+        required=False,
+        help="Test config SHA, to evaluate intermediate nets during training",
+    )
     parser.add_argument("current_sha", help="Current SHA")
     parser.add_argument("previous_sha", help="Previous SHA")
     args = parser.parse_args()
@@ -396,4 +656,4 @@ if __name__ == "__main__":
     else:
         environment = get_default_environment()
 
-    run_step(environment, args.current_sha, args.previous_sha)
+    run_step(environment, args.current_sha, args.previous_sha, args.test_config)
@@ -0,0 +1,169 @@
+"""
+Training throughput telemetry, parsed from the output of the trainer
+
+The progress lines of the trainer, e.g.
+
+   Epoch 12:  40%|████      | 2441/6104 [02:04<03:06, 19.66it/s, v_num=0, train_loss=0.0123]
+
+are parsed as they are produced, and appended as fixed size records to
+scratch / sha / "run" / "metrics", readable with
+
+   numpy.fromfile(path, dtype=METRICS_DTYPE)
+
+GPU memory in use is sampled with nvidia-smi, as the trainer does not print it.
+"""
+
+import math
+import re
+import shutil
+import struct
+import subprocess
+import time
+import numpy as np
+
+METRICS_DTYPE = np.dtype(
+    [
+        ("time", "<f8"),
+        ("epoch", "<u4"),
+        ("it_per_s", "<f8"),
+        ("positions_per_s", "<f8"),
+        ("loss", "<f8"),
+        ("val_loss", "<f8"),
+        ("gpu_memory_mb", "<f8"),
+    ]
+)
+RECORD = struct.Struct("<dIddddd")
+assert RECORD.size == METRICS_DTYPE.itemsize
+
+EPOCH_RE = re.compile(r"Epoch (\d+):")
+RATE_RE = re.compile(r"([0-9.]+)(it/s|s/it)")
+LOSS_RE = re.compile(r"\b(?:train_)?loss=([0-9.eE+-]+|nan)")
+VAL_LOSS_RE = re.compile(r"\bval_loss=([0-9.eE+-]+|nan)")
+
+
+def parse_progress(line):
+    """
+    epoch, iterations per second, loss and val_loss of a progress line, or None
+    """
+    epoch = EPOCH_RE.search(line)
+    rate = RATE_RE.search(line)
+    if epoch is None or rate is None:
+        return None
+    it_per_s = float(rate.group(1))
+    if rate.group(2) == "s/it":
+        it_per_s = 1 / it_per_s if it_per_s > 0 else 0.0
+    loss = LOSS_RE.search(line)
+    val_loss = VAL_LOSS_RE.search(line)
+    return (
+        int(epoch.group(1)),
+        it_per_s,
+        float(loss.group(1)) if loss else math.nan,
+        float(val_loss.group(1)) if val_loss else math.nan,
+    )
+
+
+def gpu_memory_used(devices):
+    """
+    Total memory in use on the devices (e.g. "0,1,") in MB, nan if unknown
+    """
+    if not shutil.which("nvidia-smi"):
+        return math.nan
+    cmd = ["nvidia-smi", "--query-gpu=memory.used", "--format=csv,noheader,nounits"]
+    indices = [d.strip() for d in devices.split(",") if d.strip()]
+    if indices:
+        cmd.append(f"--id={','.join(indices)}")
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        return float(sum(float(x) for x in result.stdout.split()))
+    except Exception:
+        return math.nan
+
+
+class MetricsRecorder:
+    """
+    Callback for execute(..., on_line=...), appending a record per progress update,
+    at most one per interval seconds
+    """
+
+    def __init__(self, path, batch_size, devices, interval=1.0, gpu_interval=60.0):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, "ab")
+        self.batch_size = batch_size
+        self.devices = devices
+        self.interval = interval
+        self.gpu_interval = gpu_interval
+        self.last_record = -math.inf
+        self.last_gpu_sample = -math.inf
+        self.gpu_memory = math.nan
+
+    def __call__(self, line):
+        progress = parse_progress(line)
+        if progress is None:
+            return
+        now = time.monotonic()
+        if now - self.last_record < self.interval:
+            return
+        self.last_record = now
+        if now - self.last_gpu_sample >= self.gpu_interval:
+            self.last_gpu_sample = now
+            self.gpu_memory = gpu_memory_used(self.devices)
+
+        epoch, it_per_s, loss, val_loss = progress
+        self.file.write(
+            RECORD.pack(
+                time.time(),
+                epoch,
+                it_per_s,
+                it_per_s * self.batch_size,
+                loss,
+                val_loss,
+                self.gpu_memory,
+            )
+        )
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def load_metrics(path):
+    if not path.exists():
+        return np.zeros(0, dtype=METRICS_DTYPE)
+    return np.fromfile(path, dtype=METRICS_DTYPE)
+
+
+def last_valid(values):
+    valid = values[~np.isnan(values)]
+    return valid[-1] if len(valid) else math.nan
+
+
+def summarize_metrics(path, last=20):
+    """
+    Print the throughput per epoch, for the last epochs, and the overall picture
+    """
+    metrics = load_metrics(path)
+    if len(metrics) == 0:
+        return
+
+    epochs = np.unique(metrics["epoch"])
+    print(f"\nTraining throughput ({len(epochs)} epochs, {path}):")
+    print(
+        f"{'epoch':>6} {'median pos/s':>14} {'min pos/s':>12} {'loss':>10} {'val_loss':>10} {'GPU MB':>8}"
+    )
+    medians = []
+    for epoch in epochs:
+        rows = metrics[metrics["epoch"] == epoch]
+        median = float(np.median(rows["positions_per_s"]))
+        medians.append(median)
+        if epoch in epochs[-last:]:
+            print(
+                f"{epoch:6d} {median:14.0f} {rows['positions_per_s'].min():12.0f}"
+                f" {rows['loss'][-1]:10.5f} {last_valid(rows['val_loss']):10.5f}"
+                f" {last_valid(rows['gpu_memory_mb']):8.0f}"
+            )
+
+    slowest = int(np.argmin(medians))
+    print(
+        f"median over epochs: {np.median(medians):.0f} pos/s,"
+        f" slowest epoch {epochs[slowest]}: {medians[slowest]:.0f} pos/s"
+    )
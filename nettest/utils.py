@@ -4,6 +4,8 @@ import re
 import hashlib
 import time
 import shutil
+import signal
+import threading
 from functools import lru_cache
 
 
@@ -20,7 +22,7 @@ def find_most_recent(root, file):
 def sha256sum(filename):
     hash_sha256 = hashlib.sha256()
     with open(filename, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
+        for chunk in iter(lambda: f.read(1 << 20), b""):
             hash_sha256.update(chunk)
     return hash_sha256.hexdigest()
 
@@ -104,9 +106,43 @@ def flatten_cmd(cmd):
         raise ValueError(f"Unsupported command format: {cmd}")
     return flattened_cmd
 
-def execute(name, cmd, cwd, fail_is_ok, filter_re=None, env=None, stdin_lines=None):
+def options_dict(cmd):
     """
-    wrapper to execute a shell command
+    The options of a command in dict form, e.g. {"lr": 0.001, "ft-optimize": True}
+    """
+    options = {}
+    for item in flatten_cmd(cmd):
+        if not item.startswith("--"):
+            continue
+        key, sep, value = item[2:].partition("=")
+        if sep:
+            options[key] = yaml.safe_load(value)
+        elif key.startswith("no-"):
+            options[key[3:]] = False
+        else:
+            options[key] = True
+    return options
+
+def execute(
+    name,
+    cmd,
+    cwd,
+    fail_is_ok,
+    filter_re=None,
+    env=None,
+    stdin_lines=None,
+    forward_signals=(),
+    on_line=None,
+    prefix=None,
+):
+    """
+    wrapper to execute a shell command.
+    The forward_signals received while the command runs are passed on to it
+    (only possible in the main thread), e.g. to let it checkpoint and stop.
+    forward_signals may also map the received signals to those sent.
+    on_line, if given, is called with each line of output as it is produced,
+    and may return True to stop the command early, which is then not a failure.
+    Output lines are printed with the prefix, if given, to tell concurrent commands apart.
     """
 
     output = []
@@ -142,19 +178,50 @@ def execute(name, cmd, cwd, fail_is_ok, filter_re=None, env=None, stdin_lines=No
 
     assert process.stdout is not None, f"Process {cmd} has no stdout"
 
-    while True:
-        stdout_line = process.stdout.readline()
+    if not isinstance(forward_signals, dict):
+        forward_signals = {signum: signum for signum in forward_signals}
+
+    def forward(signum, frame):
+        sent = forward_signals[signum]
+        print(
+            f"\n⚠️  [{name}] forwarding {signal.Signals(signum).name}"
+            f" as {signal.Signals(sent).name}",
+            flush=True,
+        )
+        process.send_signal(sent)
 
-        if stdout_line:
-            if not filter_re or not filter_re.search(stdout_line):
-                print(stdout_line, end="", flush=True)
-                output.append(stdout_line)
+    stopped = False
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signum in forward_signals:
+            previous_handlers[signum] = signal.signal(signum, forward)
 
-        if not stdout_line and process.poll() is not None:
-            break
+    try:
+        while True:
+            stdout_line = process.stdout.readline()
+
+            if stdout_line:
+                if on_line is not None and on_line(stdout_line) and not stopped:
+                    print(f"\n⚠️  [{name}] stopping early", flush=True)
+                    process.terminate()
+                    stopped = True
+                if not filter_re or not filter_re.search(stdout_line):
+                    if prefix:
+                        print(f"[{prefix}] {stdout_line}", end="", flush=True)
+                    else:
+                        print(stdout_line, end="", flush=True)
+                    output.append(stdout_line)
+
+            if not stdout_line and process.poll() is not None:
+                break
+    finally:
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
 
     gmtime = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-    if process.returncode:
+    if stopped:
+        print(f"⚠️  [{gmtime}][{name}] was stopped early.")
+    elif process.returncode:
         fail_symbol = "⚠️" if fail_is_ok else "❌"
         print(
             f"{fail_symbol} [{gmtime}][{name}] failed with exit code {process.returncode}"
@@ -0,0 +1,78 @@
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import yaml
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import artifacts
+from nettest.artifacts import (
+    add_artifact,
+    find_artifact,
+    publish,
+    record_step,
+    step_artifacts,
+)
+
+
+class TestArtifacts(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.cwd = os.getcwd()
+        os.chdir(self.root)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_publish_without_copies(self):
+        net = self.root / "last.nnue"
+        net.write_bytes(b"net content")
+        digest = add_artifact(net)
+        published = self.root / "cidir" / "step_abc" / f"nn-{digest[:12]}.nnue"
+        publish(net, published)
+
+        self.assertTrue(os.path.samefile(net, published))
+        self.assertTrue(os.path.samefile(find_artifact(f"nn-{digest[:12]}.nnue"), net))
+        self.assertIsNone(find_artifact("0" * 12 if digest[0] != "0" else "f" * 12))
+
+    def test_publish_across_filesystems(self):
+        net = self.root / "last.nnue"
+        net.write_bytes(b"net content")
+        with mock.patch.object(artifacts, "replace_with_link", side_effect=OSError):
+            publish(net, self.root / "copy.nnue")
+        self.assertEqual((self.root / "copy.nnue").read_bytes(), b"net content")
+
+    def test_step_lookup(self):
+        net = self.root / "last.nnue"
+        net.write_bytes(b"net content")
+        digest = add_artifact(net)
+        short_nnue = f"nn-{digest[:12]}.nnue"
+        std_nnue = self.root / short_nnue
+        publish(net, std_nnue)
+        record_step(
+            "abc",
+            {"short_nnue": short_nnue, "std_nnue": str(std_nnue), "checkpoint": "x.ckpt"},
+        )
+        self.assertEqual(step_artifacts("abc")["std_nnue"], str(std_nnue))
+
+        # found in the store once the published net is gone
+        std_nnue.unlink()
+        net.unlink()
+        self.assertEqual(
+            Path(step_artifacts("abc")["std_nnue"]).read_bytes(), b"net content"
+        )
+
+        # steps from before the store
+        final = self.root / "scratch" / "old" / "final.yaml"
+        final.parent.mkdir(parents=True)
+        final.write_text(yaml.dump({"short_nnue": "nn-x.nnue", "std_nnue": "x"}))
+        self.assertEqual(step_artifacts("old")["short_nnue"], "nn-x.nnue")
+
+
+if __name__ == "__main__":
+    unittest.main()
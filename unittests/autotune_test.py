@@ -0,0 +1,82 @@
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import autotune
+from nettest.autotune import loader_settings
+
+
+def fake_throughput(nnue_pytorch_dir, binpacks, run, workers, threads, seconds):
+    if workers == 3:
+        raise RuntimeError("probe failed")
+    return workers * 1000 - abs(threads - 4) * 100
+
+
+class TestAutotune(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.run = {"other_options": [{"features": "HalfKAv2_hm^"}, {"lr": 0.001}]}
+        self.environment = {
+            "train": {"autotune": {"workers": [1, 2, 3], "threads": [2, 4], "seconds": 1}}
+        }
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def tune(self, run=None):
+        return loader_settings(
+            self.environment, Path("trainer"), "abc", ["a.binpack"], run or self.run
+        )
+
+    def test_disabled(self):
+        self.assertIsNone(loader_settings({"train": {}}, Path("trainer"), "abc", [], self.run))
+
+    def test_best_setting_cached(self):
+        with mock.patch.object(
+            autotune, "measure_loader_throughput", side_effect=fake_throughput
+        ) as measure:
+            self.assertEqual(self.tune(), (2, 4))
+            self.assertEqual(measure.call_count, 6)
+
+            # cached for the same options
+            self.assertEqual(self.tune(), (2, 4))
+            self.assertEqual(measure.call_count, 6)
+
+            # other options are tuned again
+            run = {"other_options": [{"features": "HalfKAv2_hm^"}, {"lr": 0.002}]}
+            self.tune(run)
+            self.assertEqual(measure.call_count, 12)
+
+    def test_failing_probe_skipped(self):
+        # the probe exits non-zero without a result, e.g. out of memory
+        def execute(name, cmd, cwd, fail_is_ok, *args, **kwargs):
+            self.assertTrue(fail_is_ok)
+            self.assertFalse(any(c.startswith("--features") for c in cmd))
+            return ["Killed\n"]
+
+        with mock.patch.object(autotune, "execute", side_effect=execute):
+            with self.assertRaises(RuntimeError):
+                autotune.measure_loader_throughput(
+                    Path("trainer"), ["a.binpack"], {"other_options": [{"lr": 0.1}]}, 4, 2
+                )
+
+    def test_all_probes_failing(self):
+        # e.g. a trainer sha the probe does not support, training goes on untuned
+        with mock.patch.object(
+            autotune, "measure_loader_throughput", side_effect=RuntimeError("probe failed")
+        ) as measure:
+            self.assertIsNone(self.tune())
+            self.assertIsNone(self.tune())
+            # nothing is cached, a later run tries again
+            self.assertEqual(measure.call_count, 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
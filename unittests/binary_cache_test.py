@@ -0,0 +1,110 @@
+import unittest
+import sys
+import os
+import tarfile
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import binary_cache
+from nettest.binary_cache import (
+    choose_arch,
+    export_bundle,
+    host_archs,
+    import_bundle,
+    stockfish_binary,
+)
+from nettest.git_mirror import fetch_to_mirror
+from unittests.git_helpers import make_upstream
+
+MAKEFILE = """
+ifeq ($(ARCH), $(filter $(ARCH), \\
+                 x86-64-avx512 x86-64-bmi2 x86-64-avx2 x86-64-sse41-popcnt \\
+                 x86-64 armv8 armv8-dotprod))
+   SUPPORTED_ARCH=true
+"""
+
+AVX512 = {"sse4_1", "popcnt", "ssse3", "pni", "avx2", "bmi2", "avx512f", "avx512bw"}
+
+
+class TestBinaryCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+        upstream, (self.sha,) = make_upstream(
+            self.tmp.name, [({"src/Makefile": MAKEFILE}, "make")]
+        )
+        fetch_to_mirror("owner", "Stockfish", self.sha, url=str(upstream))
+        self.builds = [("owner", self.sha, "profile-build")]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def add_binary(self, arch, content="binary"):
+        binary = stockfish_binary(self.sha, "profile-build", arch)
+        binary.parent.mkdir(parents=True)
+        binary.write_text(content)
+        binary.chmod(0o755)
+        return binary
+
+    def test_host_archs(self):
+        self.assertEqual(host_archs(set(), "x86_64"), ["x86-64"])
+        archs = host_archs(AVX512, "x86_64")
+        self.assertEqual(archs[:3], ["x86-64-avx512", "x86-64-bmi2", "x86-64-avx2"])
+        self.assertNotIn("x86-64-vnni512", archs)
+        self.assertEqual(host_archs({"asimd", "asimddp"}, "aarch64")[0], "armv8-dotprod")
+
+    def test_choose_arch(self):
+        # the best supported by both host and Makefile (no avxvnni in this one)
+        flags = AVX512 | {"avx_vnni"}
+        self.assertEqual(choose_arch(self.builds, flags, "x86_64"), "x86-64-avx512")
+
+        # an available compatible binary is preferred over building
+        self.add_binary("x86-64-avx2")
+        self.assertEqual(choose_arch(self.builds, flags, "x86_64"), "x86-64-avx2")
+        # but never one the host cannot run
+        self.assertEqual(
+            choose_arch(self.builds, {"sse4_1", "popcnt"}, "x86_64"), "x86-64-sse41-popcnt"
+        )
+
+    def test_existing_binary_needs_no_sources(self):
+        # e.g. imported from a bundle, on a cluster without access to github
+        self.add_binary("x86-64-avx2")
+        with mock.patch.object(binary_cache, "makefile_archs", side_effect=AssertionError):
+            self.assertEqual(choose_arch(self.builds, AVX512, "x86_64"), "x86-64-avx2")
+
+    def test_export_import(self):
+        self.add_binary("x86-64-avx2", "avx2")
+        self.add_binary("x86-64-bmi2", "bmi2")
+        bundle = Path(self.tmp.name) / "bundle.tar.gz"
+        self.assertEqual(export_bundle(bundle, [self.sha]), 2)
+        self.assertEqual(export_bundle(Path(self.tmp.name) / "none.tar.gz", ["0" * 40]), 0)
+
+        # another cluster
+        other = Path(self.tmp.name) / "other"
+        other.mkdir()
+        os.chdir(other)
+        self.assertEqual(import_bundle(bundle), 2)
+        binary = stockfish_binary(self.sha, "profile-build", "x86-64-bmi2")
+        self.assertEqual(binary.read_text(), "bmi2")
+        self.assertTrue(os.access(binary, os.X_OK))
+        # already available binaries are kept
+        self.assertEqual(import_bundle(bundle), 0)
+
+    def test_import_rejects_other_names(self):
+        bundle = Path(self.tmp.name) / "bad.tar.gz"
+        payload = Path(self.tmp.name) / "payload"
+        payload.write_text("bad")
+        with tarfile.open(bundle, "w:gz") as tar:
+            for name in ["..", ".", "x", f"{self.sha}-profile-build-native", f"{self.sha}/../.."]:
+                tar.add(payload, arcname=f"stockfish/{name}/stockfish")
+        self.assertEqual(import_bundle(bundle), 0)
+        self.assertFalse((Path.cwd() / "scratch" / "packages" / "Stockfish").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import zstandard as zstd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest.binpack_cache import parse_size, cache_files, binpack_paths, binpacks_in_use
+from nettest.utils import options_dict
+
+
+def copy_into(source, destination):
+    destination.write_bytes(source.read_bytes())
+
+
+def file_size(source):
+    return source.stat().st_size
+
+
+class TestBinpackCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size(1234), 1234)
+        self.assertEqual(parse_size("2K"), 2048)
+        self.assertEqual(parse_size("1.5G"), 3 << 29)
+        self.assertEqual(parse_size("1TB"), 1 << 40)
+
+    def test_lru_eviction(self):
+        sources = []
+        for i in range(3):
+            source = self.root / f"{i}.binpack"
+            source.write_bytes(bytes(100))
+            sources.append(source)
+        cache_dir = self.root / "cache"
+
+        first = cache_files(cache_dir, 250, sources[:2], copy_into, file_size)
+        self.assertTrue(all(p.exists() for p in first))
+
+        # make the first entry the most recently used one
+        time.sleep(0.01)
+        cache_files(cache_dir, 250, sources[:1], copy_into, file_size)
+
+        third = cache_files(cache_dir, 250, sources[2:], copy_into, file_size)
+        self.assertTrue(first[0].exists())
+        self.assertFalse(first[1].exists())
+        self.assertEqual(third[0].read_bytes(), bytes(100))
+
+    def test_needed_files_are_not_evicted(self):
+        sources = []
+        for i in range(2):
+            source = self.root / f"{i}.binpack"
+            source.write_bytes(bytes(100))
+            sources.append(source)
+        paths = cache_files(self.root / "cache", 150, sources, copy_into, file_size)
+        self.assertTrue(all(p.exists() for p in paths))
+
+    def test_files_in_use_are_not_evicted(self):
+        sources = []
+        for i in range(3):
+            source = self.root / f"{i}.binpack"
+            source.write_bytes(bytes(100))
+            sources.append(source)
+        cache_dir = self.root / "cache"
+
+        in_use = []
+        held = cache_files(cache_dir, 250, sources[:1], copy_into, file_size, in_use)
+        time.sleep(0.01)
+        cache_files(cache_dir, 250, sources[1:2], copy_into, file_size)
+        time.sleep(0.01)
+        # the held entry is the least recently used, but may not be evicted
+        cache_files(cache_dir, 250, sources[2:], copy_into, file_size)
+        self.assertTrue(held[0].exists())
+
+        for marker in in_use:
+            marker.close()
+        time.sleep(0.01)
+        cache_files(cache_dir, 250, sources[1:], copy_into, file_size)
+        self.assertFalse(held[0].exists())
+
+    def test_binpacks_in_use(self):
+        payload = os.urandom(1000)
+        repo_dir = self.root / "data" / "owner" / "repo"
+        repo_dir.mkdir(parents=True)
+        (repo_dir / "x.binpack.zst").write_bytes(zstd.ZstdCompressor().compress(payload))
+        (repo_dir / "y.binpack.zst").write_bytes(zstd.ZstdCompressor().compress(payload))
+
+        environment = {"train": {"binpack_cache": {"size": 1500, "path": str(self.root / "cache")}}}
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            with binpacks_in_use(environment, ["owner/repo/x.binpack"]) as (x,):
+                binpack_paths(environment, ["owner/repo/y.binpack"])
+                self.assertEqual(x.read_bytes(), payload)
+            binpack_paths(environment, ["owner/repo/y.binpack"])
+        finally:
+            os.chdir(cwd)
+        self.assertFalse(x.exists())
+
+    def test_binpack_paths_compressed_at_rest(self):
+        payload = os.urandom(1000)
+        repo_dir = self.root / "data" / "owner" / "repo"
+        repo_dir.mkdir(parents=True)
+        (repo_dir / "x.binpack.zst").write_bytes(zstd.ZstdCompressor().compress(payload))
+        (repo_dir / "y.binpack").write_bytes(payload)
+
+        environment = {"train": {"binpack_cache": {"size": "1M", "path": str(self.root / "cache")}}}
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            paths = binpack_paths(environment, ["owner/repo/x.binpack", "owner/repo/y.binpack"])
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(paths[0].parent, self.root / "cache")
+        self.assertEqual(paths[0].read_bytes(), payload)
+        self.assertEqual(paths[1], repo_dir / "y.binpack")
+        self.assertFalse((repo_dir / "x.binpack").exists())
+
+    def test_binpack_paths_staging(self):
+        payload = os.urandom(1000)
+        repo_dir = self.root / "data" / "owner" / "repo"
+        repo_dir.mkdir(parents=True)
+        (repo_dir / "x.binpack.zst").write_bytes(zstd.ZstdCompressor().compress(payload))
+        (repo_dir / "y.binpack").write_bytes(payload)
+
+        staging_dir = self.root / "local"
+        environment = {"train": {"staging": {"size": "1M", "path": str(staging_dir)}}}
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            paths = binpack_paths(environment, ["owner/repo/x.binpack", "owner/repo/y.binpack"])
+            again = binpack_paths(environment, ["owner/repo/x.binpack", "owner/repo/y.binpack"])
+        finally:
+            os.chdir(cwd)
+
+        self.assertEqual(paths, again)
+        for path in paths:
+            self.assertEqual(path.parent, staging_dir)
+            self.assertEqual(path.read_bytes(), payload)
+
+
+class TestOptionsDict(unittest.TestCase):
+    def test_options_dict(self):
+        options = options_dict({"lr": 0.001, "features": "HalfKAv2_hm^", "ft-optimize": True, "x": False})
+        self.assertEqual(options, {"lr": 0.001, "features": "HalfKAv2_hm^", "ft-optimize": True, "x": False})
+        self.assertEqual(options_dict(["--lr=0.5", "--flag"]), {"lr": 0.5, "flag": True})
+
+
+if __name__ == '__main__':
+    unittest.main()
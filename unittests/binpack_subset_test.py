@@ -0,0 +1,67 @@
+import unittest
+import sys
+import os
+import struct
+import tempfile
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest.binpack_subset import read_chunk_index, select_chunks, subset_binpack
+
+
+def write_binpack(path, sizes):
+    with open(path, "wb") as f:
+        for i, size in enumerate(sizes):
+            f.write(b"BINP" + struct.pack("<I", size) + bytes([i % 256]) * size)
+
+
+class TestBinpackSubset(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.cwd = os.getcwd()
+        os.chdir(self.root)
+        self.binpack = self.root / "data" / "owner" / "repo" / "x.binpack"
+        self.binpack.parent.mkdir(parents=True)
+        write_binpack(self.binpack, [100] * 50 + [1000] * 50)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_chunk_index(self):
+        index = read_chunk_index(self.binpack)
+        self.assertEqual(len(index), 100)
+        self.assertEqual(index[1], (108, 108))
+        self.assertEqual(sum(size for _, size in index), self.binpack.stat().st_size)
+
+    def test_invalid_binpack(self):
+        bad = self.root / "bad.binpack"
+        bad.write_bytes(b"not a binpack")
+        with self.assertRaises(ValueError):
+            read_chunk_index(bad)
+
+    def test_select(self):
+        index = read_chunk_index(self.binpack)
+        self.assertEqual(select_chunks(index, 0.0001), index[:1])
+        prefix = select_chunks(index, 0.5)
+        self.assertEqual(prefix, index[: len(prefix)])
+        self.assertGreaterEqual(sum(s for _, s in prefix), 0.5 * sum(s for _, s in index))
+        sample = select_chunks(index, 0.1, "sample", seed=3)
+        self.assertEqual(len(sample), 10)
+        self.assertEqual(sample, select_chunks(index, 0.1, "sample", seed=3))
+        self.assertNotEqual(sample, select_chunks(index, 0.1, "sample", seed=4))
+
+    def test_subset_is_valid_and_cached(self):
+        config = {"fraction": 0.1, "mode": "sample", "seed": 1}
+        subset = subset_binpack("owner/repo/x.binpack", self.binpack, config)
+        self.assertEqual(len(read_chunk_index(subset)), 10)
+        mtime = subset.stat().st_mtime_ns
+        self.assertEqual(subset_binpack("owner/repo/x.binpack", self.binpack, config), subset)
+        self.assertEqual(subset.stat().st_mtime_ns, mtime)
+        other = subset_binpack("owner/repo/x.binpack", self.binpack, {"fraction": 0.1})
+        self.assertNotEqual(other, subset)
+
+
+if __name__ == '__main__':
+    unittest.main()
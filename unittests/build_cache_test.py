@@ -0,0 +1,165 @@
+import unittest
+import sys
+import os
+import subprocess
+import socket
+import tempfile
+import threading
+import time
+import yaml
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import build_cache, test as nettest_test
+from nettest.build_cache import (
+    build_lock,
+    remove_lock,
+    compiler_args,
+    compiler_signature,
+    record_build,
+    reuse_key,
+    reuse_path,
+)
+from nettest.git_mirror import fetch_to_mirror
+from unittests.git_helpers import make_upstream
+
+
+class TestBuildCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+        # upstream Stockfish, the second commit does not change the sources
+        upstream, self.shas = make_upstream(
+            self.tmp.name,
+            [
+                ({"src/main.cpp": "int main() {}"}, "src/main.cpp"),
+                ({"README.md": "doc"}, "README.md"),
+            ],
+        )
+        for sha in self.shas:
+            fetch_to_mirror("owner", "Stockfish", sha, url=str(upstream))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_same_sources_same_key(self):
+        first, second = self.shas
+        self.assertEqual(
+            reuse_key("owner", "Stockfish", first, "src", "profile-build"),
+            reuse_key("owner", "Stockfish", second, "src", "profile-build"),
+        )
+        self.assertNotEqual(
+            reuse_key("owner", "Stockfish", first, "src", "profile-build"),
+            reuse_key("owner", "Stockfish", first, "src", "build"),
+        )
+
+    def test_reuse_binary(self):
+        first, second = self.shas
+        key = reuse_key(
+            "owner", "Stockfish", first, "src", "profile-build", "x86-64", compiler_signature()
+        )
+        reusable = reuse_path("stockfish", key, "stockfish")
+        reusable.parent.mkdir(parents=True)
+        reusable.write_text("binary")
+        reusable.chmod(0o755)
+
+        test = {"testing": {"code": {"owner": "owner", "sha": second}}}
+        with mock.patch.object(nettest_test, "execute", side_effect=AssertionError):
+            binary = nettest_test.ensure_stockfish("testing", test, arch="x86-64")
+        self.assertEqual(binary.read_text(), "binary")
+        self.assertTrue(os.access(binary, os.X_OK))
+
+        with open(Path.cwd() / "scratch" / "packages" / "build_times.yaml") as f:
+            builds = yaml.safe_load(f)
+        self.assertEqual(builds[-1]["how"], "reused")
+        self.assertEqual(builds[-1]["sha"], second)
+
+    def test_record_build(self):
+        record_build("fastchess", "abc", 12.34, "built")
+        record_build("trainer", "def", 5, "built")
+        # a sha that would be read as a number, and a value that needs quoting
+        record_build("stockfish", "1234567", 1, "built: reused")
+        with open(Path.cwd() / "scratch" / "packages" / "build_times.yaml") as f:
+            builds = yaml.safe_load(f)
+        self.assertEqual([b["package"] for b in builds], ["fastchess", "trainer", "stockfish"])
+        self.assertEqual(builds[0]["seconds"], 12.3)
+        self.assertEqual(builds[2]["sha"], "1234567")
+        self.assertEqual(builds[2]["how"], "built: reused")
+
+    def test_compiler_args(self):
+        with mock.patch.object(build_cache.shutil, "which", return_value=None):
+            self.assertEqual(compiler_args("CXX"), [])
+        with mock.patch.object(build_cache.shutil, "which", return_value="/usr/bin/ccache"):
+            self.assertEqual(compiler_args("COMPCXX"), ["COMPCXX=ccache g++"])
+            self.assertEqual(build_cache.build_env()["CMAKE_CXX_COMPILER_LAUNCHER"], "ccache")
+
+    def test_build_lock_waits(self):
+        target = Path.cwd() / "scratch" / "packages" / "fastchess" / "abc"
+        lock_file = target.with_name("abc.lock")
+        order = []
+        acquired = threading.Event()
+
+        def other():
+            with build_lock(target, poll=0.01):
+                acquired.set()
+                time.sleep(0.1)
+                order.append("other")
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        acquired.wait()
+        self.assertTrue(lock_file.exists())
+        with build_lock(target, poll=0.01):
+            order.append("this")
+        thread.join()
+        self.assertEqual(order, ["other", "this"])
+        self.assertFalse(lock_file.exists())
+
+    def test_stale_locks(self):
+        target = Path.cwd() / "scratch" / "packages" / "fastchess" / "abc"
+        lock_file = target.with_name("abc.lock")
+        target.parent.mkdir(parents=True)
+
+        # a dead process on this host
+        process = subprocess.Popen(["true"])
+        process.wait()
+        lock_file.write_text(yaml.dump({"host": socket.gethostname(), "pid": process.pid}))
+        with build_lock(target, poll=0.01):
+            self.assertIn(f"pid: {os.getpid()}", lock_file.read_text())
+
+        # no heartbeat from another host
+        lock_file.write_text(yaml.dump({"host": "elsewhere", "pid": 1}))
+        os.utime(lock_file, (time.time() - 1000, time.time() - 1000))
+        with build_lock(target, poll=0.01, stale_after=600):
+            pass
+        self.assertFalse(lock_file.exists())
+
+
+    def test_only_the_own_lock_is_removed(self):
+        target = Path.cwd() / "scratch" / "packages" / "fastchess" / "abc"
+        lock_file = target.with_name("abc.lock")
+        target.parent.mkdir(parents=True)
+
+        # judged stale, but replaced by a fresh lock of another process meanwhile
+        lock_file.write_text(yaml.dump({"host": "elsewhere", "pid": 1}))
+        stale_inode = lock_file.stat().st_ino
+        # (kept elsewhere, so the inode is not reused)
+        lock_file.rename(target.parent / "removed_by_another_waiter")
+        lock_file.write_text(yaml.dump({"host": "elsewhere", "pid": 2}))
+        self.assertFalse(remove_lock(lock_file, stale_inode))
+        self.assertIn("pid: 2", lock_file.read_text())
+        self.assertEqual(list(target.parent.glob("*.removed")), [])
+
+        # a lock taken over by another process is not removed on release
+        lock_file.unlink()
+        with build_lock(target, poll=0.01):
+            lock_file.unlink()
+            lock_file.write_text(yaml.dump({"host": "elsewhere", "pid": 3}))
+        self.assertIn("pid: 3", lock_file.read_text())
+
+if __name__ == "__main__":
+    unittest.main()
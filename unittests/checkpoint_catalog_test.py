@@ -0,0 +1,84 @@
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import checkpoint_catalog
+from nettest.checkpoint_catalog import (
+    latest_checkpoint,
+    load_catalog,
+    mark_stale,
+    refresh_catalog,
+)
+
+
+class TestCheckpointCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.run_dir = Path(self.tmp.name) / "run"
+        self.ckpt_dir = self.run_dir / "lightning_logs" / "version_0" / "checkpoints"
+        self.ckpt_dir.mkdir(parents=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def save(self, name, epoch):
+        path = self.ckpt_dir / name
+        torch.save({"epoch": epoch, "state_dict": {"w": torch.zeros(4)}}, path)
+        return path
+
+    def test_epochs_recorded(self):
+        last = self.save("last.ckpt", 7)
+        periodic = self.save("epoch=19-step=100.ckpt", 0)
+
+        catalog = refresh_catalog(self.run_dir)
+        self.assertEqual(catalog[str(last)]["epoch"], 7)
+        # the epoch is taken from the name when possible
+        self.assertEqual(catalog[str(periodic)]["epoch"], 19)
+        self.assertEqual(load_catalog(self.run_dir), catalog)
+
+        self.assertEqual(latest_checkpoint(self.run_dir), (last, 7))
+
+    def test_catalog_avoids_loading(self):
+        last = self.save("last.ckpt", 3)
+        refresh_catalog(self.run_dir)
+
+        with mock.patch.object(checkpoint_catalog.torch, "load", side_effect=AssertionError):
+            self.assertEqual(latest_checkpoint(self.run_dir), (last, 3))
+            # unchanged checkpoints are not loaded again on refresh
+            refresh_catalog(self.run_dir)
+
+    def test_outdated_catalog_rebuilt(self):
+        self.assertEqual(latest_checkpoint(self.run_dir), (None, None))
+
+        last = self.save("last.ckpt", 3)
+        refresh_catalog(self.run_dir)
+        self.save("last.ckpt", 5)
+        os.utime(last, ns=(0, 12345))
+
+        self.assertEqual(latest_checkpoint(self.run_dir), (last, 5))
+
+    def test_stale_catalog_rescanned(self):
+        first = self.save("last.ckpt", 3)
+        refresh_catalog(self.run_dir)
+
+        # a run that is killed before it refreshes the catalog
+        mark_stale(self.run_dir)
+        self.assertIsNone(load_catalog(self.run_dir))
+        resumed_dir = self.run_dir / "lightning_logs" / "version_1" / "checkpoints"
+        resumed_dir.mkdir(parents=True)
+        second = resumed_dir / "last.ckpt"
+        torch.save({"epoch": 9}, second)
+        os.utime(first, ns=(0, 1000))
+
+        self.assertEqual(latest_checkpoint(self.run_dir), (second, 9))
+        self.assertIsNotNone(load_catalog(self.run_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest.early_abort import (
+    EarlyAbort,
+    lineage_key,
+    load_envelope,
+    record_run,
+    val_loss_curve,
+)
+from nettest.train_metrics import METRICS_DTYPE
+
+
+def progress(epoch, val_loss):
+    return f"Epoch {epoch}: 100%|█| 10/10 [00:01<00:00, 9.00it/s, v_num=0, train_loss=0.1, val_loss={val_loss}]\n"
+
+
+class TestEarlyAbort(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_lineage_ignores_option_values(self):
+        step = {
+            "trainer": {"owner": "o", "sha": "s"},
+            "run": {"max_epochs": 10, "repetitions": 2, "other_options": ["--lr=0.1", "--gamma=0.99"]},
+        }
+        tuned = {
+            "trainer": {"owner": "o", "sha": "s"},
+            "run": {"max_epochs": 10, "repetitions": 3, "other_options": ["--lr=0.2", "--gamma=0.9"]},
+        }
+        other = {
+            "trainer": {"owner": "o", "sha": "s"},
+            "run": {"max_epochs": 20, "other_options": ["--lr=0.1", "--gamma=0.99"]},
+        }
+        self.assertEqual(lineage_key(step), lineage_key(tuned))
+        self.assertNotEqual(lineage_key(step), lineage_key(other))
+
+        # the values of options that are not tuned matter
+        features = {
+            "trainer": {"owner": "o", "sha": "s"},
+            "run": {"max_epochs": 10, "other_options": ["--features=Full_Threats^", "--lr=0.1"]},
+        }
+        other_features = {
+            "trainer": {"owner": "o", "sha": "s"},
+            "run": {"max_epochs": 10, "other_options": ["--features=Full_Threats", "--lr=0.2"]},
+        }
+        self.assertNotEqual(lineage_key(features), lineage_key(other_features))
+        self.assertEqual(
+            lineage_key(features, ["lr", "features"]), lineage_key(other_features, ["lr", "features"])
+        )
+
+    def test_envelope(self):
+        metrics = np.zeros(4, dtype=METRICS_DTYPE)
+        metrics["epoch"] = [0, 0, 1, 1]
+        metrics["val_loss"] = [np.nan, 0.5, 0.5, 0.4]
+        self.assertEqual(val_loss_curve(metrics), {0: 0.5, 1: 0.4})
+        # equal values of different epochs are both kept
+        metrics["val_loss"] = [np.nan, 0.5, 0.4, 0.5]
+        self.assertEqual(val_loss_curve(metrics), {0: 0.5, 1: 0.5})
+
+        record_run("key", "a", {0: 0.5, 1: 0.4, 2: 0.3})
+        record_run("key", "b", {0: 0.52, 1: 0.41, 2: 0.31})
+        envelope = load_envelope("key")
+        self.assertEqual(len(envelope), 2)
+
+        within = EarlyAbort(envelope, {"tolerance": 0.1, "patience": 2}, "c")
+        for epoch, val_loss in enumerate([0.55, 0.44, 0.33, 0.33]):
+            self.assertFalse(within(progress(epoch, val_loss)))
+
+        diverging = EarlyAbort(envelope, {"tolerance": 0.1, "patience": 2}, "c")
+        self.assertFalse(diverging(progress(0, 0.5)))
+        # the last value of an epoch counts, once the next epoch starts
+        self.assertFalse(diverging(progress(0, 0.6)))
+        self.assertFalse(diverging(progress(1, 0.6)))
+        # an equal value in the next epoch counts again
+        self.assertFalse(diverging(progress(1, 0.6)))
+        self.assertTrue(diverging(progress(2, 0.6)))
+        self.assertEqual(diverging.reason["epoch"], 1)
+
+        # no judgement without enough earlier runs
+        unknown = EarlyAbort(envelope, {"patience": 1, "min_runs": 3}, "c")
+        self.assertFalse(unknown(progress(0, 10.0)))
+        self.assertTrue(unknown(progress(1, "nan")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,225 @@
+import unittest
+import sys
+import os
+import gzip
+import tempfile
+import threading
+import functools
+import json
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import time
+from pathlib import Path
+from unittest import mock
+
+import zstandard as zstd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import ensure_data
+from nettest.ensure_data import (
+    HubLimiter,
+    download_files,
+    load_manifest,
+    run_data_update,
+    stage_data,
+    stream_files,
+    decompress_files,
+    decompress_pool,
+    decompress_file_zstd,
+    decompress_file_gz,
+)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+REVISION = "0123456789abcdef0123456789abcdef01234567"
+
+
+class TestStreamingDownload(unittest.TestCase):
+    def setUp(self):
+        # a local http server standing in for the hub, serving the repo info and resolve urls
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.hub_dir = self.root / "hub"
+        self.repo_files = self.hub_dir / "datasets" / "owner" / "repo" / "resolve" / REVISION
+        self.repo_files.mkdir(parents=True)
+        api_dir = self.hub_dir / "api" / "datasets" / "owner"
+        api_dir.mkdir(parents=True)
+        (api_dir / "repo").write_text(json.dumps({"id": "owner/repo", "sha": REVISION}))
+        (api_dir / "other").write_text(json.dumps({"id": "owner/other", "sha": REVISION}))
+        self.other_files = self.hub_dir / "datasets" / "owner" / "other" / "resolve" / REVISION
+        self.other_files.mkdir(parents=True)
+
+        self.payload = os.urandom(1 << 16) * 8
+        (self.repo_files / "a.binpack.zst").write_bytes(zstd.ZstdCompressor().compress(self.payload))
+        (self.repo_files / "b.binpack.gz").write_bytes(gzip.compress(self.payload))
+        (self.repo_files / "c.binpack").write_bytes(self.payload)
+        (self.other_files / "d.binpack.zst").write_bytes(zstd.ZstdCompressor().compress(self.payload))
+
+        handler = functools.partial(QuietHandler, directory=str(self.hub_dir))
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.endpoint = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_stream_files(self):
+        repo_dir = self.root / "data" / "owner" / "repo"
+        names = ["a.binpack", "b.binpack", "c.binpack"]
+        stream_files("owner", "repo", names, repo_dir, revision=REVISION, endpoint=self.endpoint)
+        for name in names:
+            self.assertEqual((repo_dir / name).read_bytes(), self.payload)
+        # no compressed or partial copies are left behind
+        self.assertEqual(sorted(p.name for p in repo_dir.iterdir()), names)
+
+    def test_stream_missing_file(self):
+        repo_dir = self.root / "data" / "owner" / "repo"
+        with self.assertRaises(FileNotFoundError):
+            stream_files(
+                "owner", "repo", ["missing.binpack"], repo_dir, revision=REVISION, endpoint=self.endpoint
+            )
+
+    def test_run_data_update_stream(self):
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            run_data_update(
+                "owner", "repo", ["a.binpack", "b.binpack"], stream=True, endpoint=self.endpoint
+            )
+            manifest = load_manifest("owner", "repo")
+
+            # with all files in the manifest, neither the hub nor the store are needed anymore
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            with mock.patch("nettest.ensure_data.store_files", side_effect=AssertionError):
+                run_data_update("owner", "repo", ["a.binpack", "b.binpack"], endpoint=self.endpoint)
+        finally:
+            os.chdir(cwd)
+        repo_dir = self.root / "data" / "owner" / "repo"
+        self.assertEqual((repo_dir / "a.binpack").read_bytes(), self.payload)
+        self.assertEqual((repo_dir / "b.binpack").read_bytes(), self.payload)
+        self.assertEqual(manifest["a.binpack"]["revision"], REVISION)
+        self.assertEqual(manifest["a.binpack"]["size"], len(self.payload))
+
+    def test_stage_data(self):
+        items = [
+            {"owner": "owner", "repo": "repo", "filenames": ["a.binpack", "c.binpack"], "endpoint": self.endpoint},
+            {"owner": "owner", "repo": "other", "filenames": ["d.binpack"], "endpoint": self.endpoint},
+        ]
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            stage_data(items, {"data": {"parallel": 2, "stream": True, "transfers": 2}})
+        finally:
+            os.chdir(cwd)
+        for path in ["owner/repo/a.binpack", "owner/repo/c.binpack", "owner/other/d.binpack"]:
+            self.assertEqual((self.root / "data" / path).read_bytes(), self.payload)
+
+
+class TestHubLimiter(unittest.TestCase):
+    def test_rate(self):
+        limiter = HubLimiter(requests_per_second=100, burst=1, transfers=1)
+        start = time.monotonic()
+        for _ in range(11):
+            limiter.request()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_pause(self):
+        limiter = HubLimiter(requests_per_second=1000, burst=10, transfers=1)
+        limiter.pause(0.1)
+        start = time.monotonic()
+        limiter.request()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+class TestDownloadFiles(unittest.TestCase):
+    def test_one_transfer_per_file(self):
+        downloaded = []
+        active = []
+
+        def hf_hub_download(repo_id, filename, local_dir, **kwargs):
+            active.append(filename)
+            self.assertEqual(len(active), 1, "more transfers than allowed")
+            time.sleep(0.05)
+            (Path(local_dir) / filename).write_text(filename)
+            downloaded.append(filename)
+            active.remove(filename)
+
+        api = mock.Mock()
+        api.list_repo_files.return_value = ["a.binpack.zst", "b.binpack", "c.binpack", "x"]
+        with tempfile.TemporaryDirectory() as tmp:
+            repo_dir = Path(tmp)
+            (repo_dir / "c.binpack").write_text("c.binpack")
+            candidates = ["a.binpack", "a.binpack.zst", "b.binpack", "c.binpack", "d.binpack"]
+            with mock.patch.object(ensure_data, "HfApi", return_value=api), mock.patch.object(
+                ensure_data, "hf_hub_download", side_effect=hf_hub_download
+            ), mock.patch.object(ensure_data, "hub_limiter", HubLimiter(transfers=1)):
+                download_files("owner", "repo", candidates, repo_dir, revision=REVISION)
+        self.assertEqual(sorted(downloaded), ["a.binpack.zst", "b.binpack"])
+
+
+class TestDecompressFiles(unittest.TestCase):
+    def test_bounded_pool(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            payloads = {f"f{i}.binpack": os.urandom(1024 * (i + 1)) for i in range(5)}
+            for name, payload in payloads.items():
+                (Path(tmp) / f"{name}.zst").write_bytes(zstd.ZstdCompressor().compress(payload))
+                (Path(tmp) / f"{name}.gz").write_bytes(gzip.compress(payload))
+
+            zst_files = [str(Path(tmp) / f"{name}.zst") for name in payloads]
+            decompress_files(zst_files, decompress_file_zstd, max_workers=2)
+            for name, payload in payloads.items():
+                self.assertEqual((Path(tmp) / name).read_bytes(), payload)
+                self.assertFalse((Path(tmp) / f"{name}.zst").exists())
+                (Path(tmp) / name).unlink()
+
+            gz_files = [str(Path(tmp) / f"{name}.gz") for name in payloads]
+            decompress_files(gz_files, decompress_file_gz, max_workers=1)
+            for name, payload in payloads.items():
+                self.assertEqual((Path(tmp) / name).read_bytes(), payload)
+
+    def test_shared_pool(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            payloads = {f"f{i}.binpack": os.urandom(1024 * (i + 1)) for i in range(4)}
+            files = []
+            for name, payload in payloads.items():
+                (Path(tmp) / f"{name}.zst").write_bytes(zstd.ZstdCompressor().compress(payload))
+                files.append(str(Path(tmp) / f"{name}.zst"))
+
+            # two repos decompressing concurrently through the same bounded pool
+            with decompress_pool(1) as pool:
+                threads = [
+                    threading.Thread(target=decompress_files, args=(part, decompress_file_zstd, None, pool))
+                    for part in (files[:2], files[2:])
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            for name, payload in payloads.items():
+                self.assertEqual((Path(tmp) / name).read_bytes(), payload)
+
+    def test_stage_data_shares_the_pool(self):
+        pools = []
+
+        def run_data_update(owner, repo, decompressor, **kwargs):
+            pools.append(decompressor)
+
+        items = [{"owner": "owner", "repo": f"repo{i}", "filenames": []} for i in range(3)]
+        with mock.patch.object(ensure_data, "run_data_update", side_effect=run_data_update):
+            stage_data(items, {"data": {"parallel": 3, "decompress_workers": 2}})
+        self.assertEqual(len(pools), 3)
+        self.assertTrue(all(pool is pools[0] for pool in pools))
+        self.assertEqual(pools[0]._max_workers, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import sys
+import os
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import test as nettest_test
+from nettest.test import ensure_engines
+
+
+def code(sha):
+    return {"code": {"owner": "owner", "sha": sha}}
+
+
+class TestEnsureEngines(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.test = {
+            "fastchess": code("f1"),
+            "reference": code("s1"),
+            "testing": code("s2"),
+        }
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_concurrent_builds(self):
+        # all three builds must be running at the same time to pass the barrier
+        barrier = threading.Barrier(3, timeout=10)
+        calls = {}
+
+        def fastchess(config, jobs, prefix):
+            barrier.wait()
+            calls[prefix] = jobs
+            return "fastchess"
+
+        def stockfish(target, test, jobs, prefix, arch):
+            barrier.wait()
+            calls[prefix] = jobs
+            return f"stockfish-{target}-{arch}"
+
+        with mock.patch.multiple(
+            nettest_test,
+            choose_arch=lambda builds: "x86-64-avx2",
+            ensure_fastchess=fastchess,
+            ensure_stockfish=stockfish,
+            ensure_book=lambda: "book",
+        ):
+            engines = ensure_engines({"test": {"build_jobs": 12}}, self.test)
+
+        self.assertEqual(
+            engines,
+            (
+                "fastchess",
+                "stockfish-reference-x86-64-avx2",
+                "stockfish-testing-x86-64-avx2",
+                "book",
+            ),
+        )
+        self.assertEqual(calls, {"fastchess": 4, "reference": 4, "testing": 4})
+
+    def test_budget_for_missing_builds(self):
+        # only the testing Stockfish remains to be built, it gets all jobs
+        for path in (
+            nettest_test.fastchess_path(self.test["fastchess"]),
+            nettest_test.stockfish_path("reference", self.test, "x86-64-avx2"),
+        ):
+            path.parent.mkdir(parents=True)
+            path.write_text("binary")
+        calls = {}
+
+        def stockfish(target, test, jobs, prefix, arch):
+            calls[target] = jobs
+
+        with mock.patch.multiple(
+            nettest_test,
+            choose_arch=lambda builds: "x86-64-avx2",
+            ensure_fastchess=mock.Mock(),
+            ensure_stockfish=stockfish,
+            ensure_book=mock.Mock(),
+        ):
+            ensure_engines({"test": {"build_jobs": 12}}, self.test)
+        self.assertEqual(calls["testing"], 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
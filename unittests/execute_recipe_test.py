@@ -0,0 +1,48 @@
+import unittest
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import execute_recipe
+from nettest.execute_recipe import submit_data
+
+
+class TestSubmitData(unittest.TestCase):
+    def test_staging_jobs_one_at_a_time(self):
+        running = []
+        order = []
+        lock = threading.Lock()
+
+        def stage_data(items, environment):
+            with lock:
+                running.append(1)
+                overlapping = len(running)
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+            order.append((items[0]["filenames"], overlapping))
+
+        stager = ThreadPoolExecutor(max_workers=1)
+        data_executor = ThreadPoolExecutor(max_workers=4)
+        data_futures = {}
+        with mock.patch.object(execute_recipe, "stage_data", side_effect=stage_data):
+            first = submit_data(stager, data_executor, {}, ["o/r/a.binpack"], data_futures)
+            second = submit_data(
+                stager, data_executor, {}, ["o/r/a.binpack", "o/r/b.binpack"], data_futures
+            )
+            for future in first | second:
+                future.result()
+        stager.shutdown()
+        data_executor.shutdown()
+
+        # b is staged after a, never at the same time, a only once
+        self.assertEqual(order, [(["a.binpack"], 1), (["b.binpack"], 1)])
+        self.assertEqual(len(second), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
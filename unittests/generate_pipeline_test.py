@@ -0,0 +1,55 @@
+import unittest
+import sys
+import os
+import tempfile
+import yaml
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest.generate_pipeline import parse_recipe, group_binpacks
+
+RECIPES = Path(__file__).resolve().parents[1]
+
+
+class TestScheduleData(unittest.TestCase):
+    def test_group_binpacks(self):
+        items = group_binpacks(["a/x/2.binpack", "b/y/1.binpack", "a/x/1.binpack"])
+        self.assertEqual(
+            items,
+            [
+                {"owner": "a", "repo": "x", "filenames": ["1.binpack", "2.binpack"]},
+                {"owner": "b", "repo": "y", "filenames": ["1.binpack"]},
+            ],
+        )
+
+    def test_step_inputs(self):
+        with open(RECIPES / "threats.yaml") as f:
+            recipe = yaml.safe_load(f)
+
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                _, schedule, final_recipe = parse_recipe(recipe, None)
+            finally:
+                os.chdir(cwd)
+
+        steps = final_recipe["training"]["steps"]
+        first = schedule["inputs"][steps[0]["sha"]]
+        self.assertIn(steps[0]["convert"]["binpack"], first)
+        self.assertEqual(set(first), set(steps[0]["run"]["binpacks"]) | {steps[0]["convert"]["binpack"]})
+
+        # every scheduled training step knows its inputs, and these are all staged
+        staged = {
+            f"{item['owner']}/{item['repo']}/{filename}"
+            for item in schedule["data"]
+            for filename in item["filenames"]
+        }
+        for kwargs in schedule["train"]:
+            self.assertTrue(set(schedule["inputs"][kwargs["current_sha"]]) <= staged)
+            # the test config is known during training, to evaluate intermediate nets
+            self.assertEqual(kwargs["test_config_sha"], final_recipe["testing"]["sha"])
+
+
+if __name__ == '__main__':
+    unittest.main()
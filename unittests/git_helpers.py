@@ -0,0 +1,33 @@
+"""
+Shared by the tests that need a git repository, a local bare one stands in for github
+"""
+
+import subprocess
+from pathlib import Path
+
+
+def git(cwd, *args):
+    return subprocess.run(
+        ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+def make_upstream(root, commits):
+    """
+    The bare repository root / "upstream.git", with a commit for each (files, message)
+    of commits, files mapping paths to their content. Returns it and the commit shas.
+    """
+    upstream = Path(root) / "upstream.git"
+    work = Path(root) / "work"
+    git(root, "init", "--quiet", "--bare", str(upstream))
+    git(root, "init", "--quiet", str(work))
+    shas = []
+    for files, message in commits:
+        for name, content in files.items():
+            (work / name).parent.mkdir(parents=True, exist_ok=True)
+            (work / name).write_text(content)
+            git(work, "add", name)
+        git(work, "-c", "user.name=t", "-c", "user.email=t@t", "commit", "-qm", message)
+        shas.append(git(work, "rev-parse", "HEAD"))
+    git(work, "push", "--quiet", str(upstream), "HEAD:refs/heads/master")
+    return upstream, shas
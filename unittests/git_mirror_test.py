@@ -0,0 +1,62 @@
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import git_mirror
+from nettest.git_mirror import checkout_sha, has_commit, mirror_dir
+from unittests.git_helpers import git, make_upstream
+
+
+class TestGitMirror(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+        # a local bare repository stands in for github
+        self.upstream, self.shas = make_upstream(
+            self.tmp.name, [({"file.txt": content}, content) for content in ("one", "two")]
+        )
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_checkout(self):
+        first, second = self.shas
+        destination = Path.cwd() / "build" / "repo"
+        checkout_sha("owner", "repo", first, destination, url=str(self.upstream))
+        self.assertEqual((destination / "file.txt").read_text(), "one")
+        self.assertEqual(git(destination, "rev-parse", "HEAD"), first)
+
+        mirror = mirror_dir("owner", "repo")
+        self.assertTrue(has_commit(mirror, first))
+        self.assertEqual(git(mirror, "rev-parse", f"refs/nettest/{first}"), first)
+
+        # another sha is fetched incrementally into the same mirror
+        other = Path.cwd() / "build" / "other"
+        checkout_sha("owner", "repo", second, other, url=str(self.upstream))
+        self.assertEqual((other / "file.txt").read_text(), "two")
+
+    def test_known_sha_is_local(self):
+        first = self.shas[0]
+        checkout_sha("owner", "repo", first, Path.cwd() / "a", url=str(self.upstream))
+
+        # no network (upstream) access for a sha already in the mirror
+        real_execute = git_mirror.execute
+
+        def execute(name, cmd, *args, **kwargs):
+            assert "fetch" not in cmd, "unexpected fetch"
+            return real_execute(name, cmd, *args, **kwargs)
+
+        with mock.patch.object(git_mirror, "execute", side_effect=execute):
+            checkout_sha("owner", "repo", first, Path.cwd() / "b", url="/nonexistent")
+        self.assertEqual((Path.cwd() / "b" / "file.txt").read_text(), "one")
+
+
+if __name__ == "__main__":
+    unittest.main()
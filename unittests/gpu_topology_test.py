@@ -0,0 +1,94 @@
+import unittest
+import sys
+import json
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import gpu_topology
+from nettest.gpu_topology import (
+    exclude_cpus,
+    format_cpulist,
+    gpu_placement,
+    normalize_bus_id,
+    numactl_args,
+    placement_env,
+)
+from nettest.bind_rank import bound_cmd, parse_cpulist
+
+
+class TestGpuTopology(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pci = Path(self.tmp.name)
+        for bus_id, node, cpus in [
+            ("0009:01:00.0", "0", "0-71"),
+            ("0019:01:00.0", "1", "72-143"),
+            ("0029:01:00.0", "-1", ""),
+        ]:
+            device = self.pci / bus_id
+            device.mkdir()
+            (device / "numa_node").write_text(node + "\n")
+            (device / "local_cpulist").write_text(cpus + "\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def placement(self, devices):
+        bus_ids = {
+            0: "0009:01:00.0",
+            1: "0019:01:00.0",
+            2: "0029:01:00.0",
+        }
+        with mock.patch.object(gpu_topology, "gpu_bus_ids", return_value=bus_ids):
+            return gpu_placement(devices, self.pci)
+
+    def test_normalize_bus_id(self):
+        self.assertEqual(normalize_bus_id(" 00000009:01:00.0"), "0009:01:00.0")
+        self.assertEqual(normalize_bus_id("00000000:AB:00.0"), "0000:ab:00.0")
+
+    def test_placement(self):
+        placement = self.placement("1,0,")
+        self.assertEqual(
+            placement, [{"node": 1, "cpus": "72-143"}, {"node": 0, "cpus": "0-71"}]
+        )
+        self.assertEqual(numactl_args(placement[0]), ["--cpunodebind=1", "--membind=1"])
+        self.assertIsNone(self.placement("2,"))
+        self.assertIsNone(self.placement("3,"))
+
+    def test_bind_rank(self):
+        self.assertEqual(parse_cpulist("0-3,8,10-11"), {0, 1, 2, 3, 8, 10, 11})
+        config = json.loads(placement_env(self.placement("0,1"), True)["NETTEST_PLACEMENT"])
+        cmd = bound_cmd(config["placement"][1], ["python", "train.py"], config["numactl"])
+        self.assertEqual(
+            cmd, ["numactl", "--cpunodebind=1", "--membind=1", "python", "train.py"]
+        )
+        self.assertEqual(bound_cmd(None, ["python"], True), ["python"])
+
+    def test_exclude_cpus(self):
+        self.assertEqual(format_cpulist({0, 1, 2, 3, 8, 10, 11}), "0-3,8,10-11")
+        nodes = Path(self.tmp.name) / "nodes"
+        (nodes / "node1").mkdir(parents=True)
+        (nodes / "node1" / "cpulist").write_text("72-143\n")
+
+        available = set(range(144))
+        reserved = parse_cpulist("64-71,140-143")
+        placement = [{"node": 0, "cpus": "0-71"}, {"node": 1, "cpus": None}]
+        restricted = exclude_cpus(placement, reserved, available, nodes)
+        self.assertEqual([p["cpus"] for p in restricted], ["0-63", "72-139"])
+        self.assertEqual(
+            numactl_args(restricted[0]), ["--physcpubind=0-63", "--membind=0"]
+        )
+        self.assertEqual(
+            bound_cmd(restricted[1], ["python"], True),
+            ["numactl", "--physcpubind=72-139", "--membind=1", "python"],
+        )
+
+        # no topology: all available cores except the reserved ones
+        restricted = exclude_cpus([{"node": None, "cpus": None}], {3}, {0, 1, 2, 3})
+        self.assertEqual(numactl_args(restricted[0]), ["--physcpubind=0-2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
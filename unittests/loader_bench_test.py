@@ -0,0 +1,68 @@
+import unittest
+import sys
+import os
+import tempfile
+import yaml
+from pathlib import Path
+from unittest import mock
+
+import zstandard as zstd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import loader_bench
+from nettest.loader_bench import benchmark_binpack_modes
+
+
+class TestLoaderBench(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.cwd = os.getcwd()
+        os.chdir(self.root)
+
+        self.payload = os.urandom(1000)
+        self.repo_dir = self.root / "data" / "owner" / "repo"
+        self.repo_dir.mkdir(parents=True)
+        compressed = zstd.ZstdCompressor().compress(self.payload)
+        (self.repo_dir / "x.binpack.zst").write_bytes(compressed)
+        step_dir = self.root / "scratch" / "abc"
+        step_dir.mkdir(parents=True)
+        step = {"trainer": {}, "run": {"binpacks": ["owner/repo/x.binpack"]}}
+        (step_dir / "step.yaml").write_text(yaml.dump(step))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def benchmark(self):
+        read = []
+
+        def measure(nnue_pytorch_dir, binpacks, run, workers, threads, seconds):
+            read.append(binpacks[0])
+            self.assertEqual(binpacks[0].read_bytes(), self.payload)
+            return 1.0
+
+        environment = {"train": {"binpack_cache": {"size": "1M", "path": str(self.root / "cache")}}}
+        with mock.patch.object(loader_bench, "ensure_trainer", return_value=self.root), mock.patch.object(
+            loader_bench, "measure_loader_throughput", side_effect=measure
+        ):
+            benchmark_binpack_modes(environment, "abc", "1M", 1)
+        return read
+
+    def test_modes_read_different_paths(self):
+        uncompressed, cached = self.benchmark()
+        self.assertNotEqual(uncompressed, cached)
+        self.assertEqual(cached.parent, self.root / "cache")
+        # the uncompressed copy is temporary, nothing is left next to the compressed file
+        self.assertFalse(uncompressed.exists())
+        self.assertEqual([p.name for p in self.repo_dir.iterdir()], ["x.binpack.zst"])
+
+    def test_existing_uncompressed_copy_is_not_used(self):
+        (self.repo_dir / "x.binpack").write_bytes(self.payload)
+        uncompressed, cached = self.benchmark()
+        self.assertNotEqual(uncompressed, self.repo_dir / "x.binpack")
+        self.assertEqual(cached.parent, self.root / "cache")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import monitor
+from nettest.monitor import evaluate_checkpoint, new_checkpoints, play_match, start_monitor
+
+
+class TestMonitor(unittest.TestCase):
+    def test_new_checkpoints(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            run_dir = Path(tmp)
+            checkpoints = run_dir / "lightning_logs" / "version_0" / "checkpoints"
+            checkpoints.mkdir(parents=True)
+            old = time.time() - 3600
+            for name in ["epoch=19-step=20.ckpt", "epoch=39-step=40.ckpt", "last.ckpt"]:
+                (checkpoints / name).write_bytes(b"")
+                os.utime(checkpoints / name, (old, old))
+            # possibly still being written
+            (checkpoints / "epoch=59-step=60.ckpt").write_bytes(b"")
+
+            found = new_checkpoints(run_dir, {19})
+            self.assertEqual(found, [(39, checkpoints / "epoch=39-step=40.ckpt")])
+            self.assertEqual(len(new_checkpoints(run_dir, {19}, min_age=0)), 2)
+
+    def test_play_match(self):
+        output = [
+            "Results of epoch_19 vs reference (nodes=20000, 16MB, 1000 games):\n",
+            "Elo: -12.30 +/- 10.50, nElo: -20.10 +/- 17.20\n",
+        ]
+        test = {"testing": {}, "reference": {"options": ["Threads=1"]}}
+        config = {"cores": "8-11", "nodes": 5000}
+        engines = (Path("fastchess"), Path("ref"), Path("test"), Path("book.epd"))
+        with mock.patch.object(monitor, "execute", return_value=output) as execute:
+            result = play_match(engines, Path("epoch_19.nnue"), test, config, Path("."))
+
+        self.assertEqual(result, (-12.3, -20.1))
+        cmd = execute.call_args[0][1]
+        # two engines per game, so half as many games as cores
+        self.assertEqual(cmd[1:5], ["-concurrency", "2", "-use-affinity", "8-11"])
+        self.assertIn("nodes=5000", cmd)
+        self.assertIn("option.EvalFile=epoch_19.nnue", cmd)
+
+    def test_failed_evaluation_is_recorded(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+            monitor, "execute", side_effect=AssertionError("serialize failed")
+        ):
+            step = {"convert": {"checkpoint2nnue": []}}
+            checkpoint = Path(tmp) / "gone.ckpt"
+            result = evaluate_checkpoint(19, checkpoint, Path(tmp), None, step, {}, {}, Path(tmp))
+        self.assertIsNone(result["Elo"])
+        self.assertIn("serialize failed", result["error"])
+
+    def test_disabled(self):
+        self.assertIsNone(start_monitor({}, "abc", "def", Path(".")))
+        self.assertIsNone(start_monitor({"monitor": {}}, "abc", None, Path(".")))
+
+
+if __name__ == "__main__":
+    unittest.main()
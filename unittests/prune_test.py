@@ -0,0 +1,91 @@
+import unittest
+import sys
+import os
+import tempfile
+import yaml
+from pathlib import Path
+
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest.checkpoint_catalog import load_catalog
+from nettest.prune import prune_step, retention_policy
+
+
+class TestPrune(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.step_dir = Path.cwd() / "scratch" / "abc"
+        self.version_dir = self.step_dir / "run" / "lightning_logs" / "version_0"
+        self.ckpt_dir = self.version_dir / "checkpoints"
+        self.ckpt_dir.mkdir(parents=True)
+
+        self.final = self.ckpt_dir / "last.ckpt"
+        torch.save({"epoch": 399}, self.final)
+        for epoch in (99, 199, 299, 349):
+            (self.ckpt_dir / f"epoch={epoch}-step={epoch * 10}.ckpt").write_bytes(b"x" * 10)
+        (self.ckpt_dir / "hpc_ckpt_1.ckpt").write_bytes(b"x" * 10)
+        self.events = self.version_dir / "events.out.tfevents.1.host"
+        self.events.write_bytes(b"x" * 10)
+        self.kept = [
+            self.final.with_suffix(".pt"),
+            self.final.with_suffix(".nnue"),
+            self.step_dir / "run" / "metrics",
+        ]
+        for path in self.kept:
+            path.write_bytes(b"x")
+
+        with open(self.step_dir / "final.yaml", "w") as f:
+            yaml.dump({"checkpoint": str(self.final)}, f)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def remaining(self):
+        return sorted(p.name for p in self.ckpt_dir.glob("*.ckpt"))
+
+    def test_policy(self):
+        self.assertIsNone(retention_policy({"train": {}}))
+        self.assertEqual(
+            retention_policy({"train": {"retention": True}}),
+            {"keep_every": 0, "keep_logs": False},
+        )
+        self.assertEqual(
+            retention_policy({"train": {"retention": {"keep_every": 5}}})["keep_every"], 5
+        )
+
+    def test_keep_final_only(self):
+        freed = prune_step("abc", retention_policy({"train": {"retention": True}}))
+        self.assertEqual(freed, 60)
+        self.assertEqual(self.remaining(), ["last.ckpt"])
+        self.assertFalse(self.events.exists())
+        for path in self.kept:
+            self.assertTrue(path.exists())
+        # the catalog no longer lists the removed checkpoints
+        self.assertEqual(list(load_catalog(self.step_dir / "run")), [str(self.final)])
+
+    def test_keep_every(self):
+        policy = {"keep_every": 100, "keep_logs": True}
+        prune_step("abc", policy)
+        self.assertEqual(
+            self.remaining(),
+            ["epoch=199-step=1990.ckpt", "epoch=299-step=2990.ckpt",
+             "epoch=99-step=990.ckpt", "last.ckpt"],
+        )
+        self.assertTrue(self.events.exists())
+
+    def test_dry_run_and_not_final(self):
+        policy = retention_policy({"train": {"retention": True}})
+        self.assertEqual(prune_step("abc", policy, dry_run=True), 60)
+        self.assertEqual(len(self.remaining()), 6)
+
+        (self.step_dir / "final.yaml").unlink()
+        self.assertEqual(prune_step("abc", policy), 0)
+        self.assertEqual(len(self.remaining()), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
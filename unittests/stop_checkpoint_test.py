@@ -0,0 +1,58 @@
+import unittest
+import sys
+import os
+import signal
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest.stop_checkpoint import STOP_SIGNALS, patch_trainer, stop_callback_class
+
+
+class FakeTrainer:
+    def __init__(self, callbacks=None):
+        self.callbacks = callbacks
+        self.checkpoint_callback = SimpleNamespace(dirpath="/run/checkpoints")
+        self.default_root_dir = "/run"
+        self.strategy = SimpleNamespace(reduce_boolean_decision=lambda decision, all: decision)
+        self.should_stop = False
+        self.saved = []
+
+    def save_checkpoint(self, path):
+        self.saved.append(path)
+
+
+class TestStopCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.handlers = {signum: signal.getsignal(signum) for signum in STOP_SIGNALS}
+
+    def tearDown(self):
+        for signum, handler in self.handlers.items():
+            signal.signal(signum, handler)
+
+    def test_checkpoint_on_signal(self):
+        callback = stop_callback_class(object)()
+        trainer = FakeTrainer()
+        callback.on_train_start(trainer, None)
+
+        callback.on_train_batch_end(trainer, None, None, None, 0)
+        self.assertEqual(trainer.saved, [])
+        self.assertFalse(trainer.should_stop)
+
+        os.kill(os.getpid(), signal.SIGUSR1)
+        callback.on_train_batch_end(trainer, None, None, None, 1)
+        self.assertEqual(trainer.saved, ["/run/checkpoints/last.ckpt"])
+        self.assertTrue(trainer.should_stop)
+
+    def test_patch_trainer(self):
+        module = SimpleNamespace(Trainer=type("Trainer", (FakeTrainer,), {}), Callback=object)
+        patch_trainer(module)
+        own = object()
+        trainer = module.Trainer(callbacks=own)
+        self.assertIs(trainer.callbacks[0], own)
+        self.assertTrue(hasattr(trainer.callbacks[1], "on_train_batch_end"))
+        self.assertEqual(len(module.Trainer().callbacks), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import sys
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest.store import add_file, is_stored, object_path
+from nettest import ensure_data
+from nettest.ensure_data import store_files, load_manifest
+from nettest.utils import sha256sum
+
+
+class TestContentStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.cwd = os.getcwd()
+        os.chdir(self.root)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_add_file_deduplicates(self):
+        store_dir = self.root / "store"
+        a = self.root / "a.binpack"
+        b = self.root / "b.binpack"
+        a.write_bytes(b"same content")
+        b.write_bytes(b"same content")
+
+        digest_a = add_file(store_dir, a)
+        digest_b = add_file(store_dir, b)
+        self.assertEqual(digest_a, digest_b)
+        self.assertEqual(digest_a, sha256sum(a))
+        self.assertTrue(os.path.samefile(a, b))
+        self.assertTrue(is_stored(store_dir, a, digest_a))
+        self.assertEqual(object_path(store_dir, digest_a).read_bytes(), b"same content")
+
+    def test_is_stored_detects_replaced_file(self):
+        store_dir = self.root / "store"
+        a = self.root / "a.binpack"
+        a.write_bytes(b"content")
+        digest = add_file(store_dir, a)
+        a.unlink()
+        a.write_bytes(b"content")
+        self.assertFalse(is_stored(store_dir, a, digest))
+
+    def test_store_files_across_repos(self):
+        for owner, repo in [("one", "data"), ("two", "copy")]:
+            repo_dir = self.root / "data" / owner / repo
+            repo_dir.mkdir(parents=True)
+            (repo_dir / "x.binpack").write_bytes(b"binpack bytes")
+            store_files(owner, repo, ["x.binpack"], repo_dir)
+
+        one = load_manifest("one", "data")["x.binpack"]
+        two = load_manifest("two", "copy")["x.binpack"]
+        self.assertEqual(one, two)
+        self.assertEqual(one["size"], len(b"binpack bytes"))
+        self.assertTrue(
+            os.path.samefile(
+                self.root / "data/one/data/x.binpack", self.root / "data/two/copy/x.binpack"
+            )
+        )
+
+
+    def test_store_files_merges_concurrent_updates(self):
+        repo_dir = self.root / "data" / "owner" / "repo"
+        repo_dir.mkdir(parents=True)
+        (repo_dir / "a.binpack").write_bytes(b"a")
+        (repo_dir / "b.binpack").write_bytes(b"b")
+
+        # another process records b while a is being hashed
+        def add_file_racing(store_dir, path, digest=None):
+            if path.name == "a.binpack":
+                store_files("owner", "repo", ["b.binpack"], repo_dir)
+            return add_file(store_dir, path, digest)
+
+        with mock.patch.object(ensure_data, "add_file", side_effect=add_file_racing):
+            store_files("owner", "repo", ["a.binpack"], repo_dir)
+
+        self.assertEqual(
+            sorted(load_manifest("owner", "repo")), ["a.binpack", "b.binpack"]
+        )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import sys
+import io
+import math
+import tempfile
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import train_metrics
+from nettest.train_metrics import (
+    MetricsRecorder,
+    load_metrics,
+    parse_progress,
+    summarize_metrics,
+)
+
+LINES = [
+    "Epoch 0:  10%|█         | 610/6104 [00:31<04:40, 19.60it/s, v_num=0, train_loss=0.0250]\n",
+    "Epoch 0: 100%|██████████| 6104/6104 [05:10<00:00, 19.66it/s, v_num=0, train_loss=0.0200, val_loss=0.0210]\n",
+    "some other output\n",
+    "Epoch 1:  50%|█████     | 3052/6104 [10:00<10:00,  2.50s/it, v_num=0, train_loss=0.0190]\n",
+]
+
+
+class TestTrainMetrics(unittest.TestCase):
+    def test_parse_progress(self):
+        self.assertEqual(parse_progress(LINES[1]), (0, 19.66, 0.02, 0.021))
+        self.assertIsNone(parse_progress(LINES[2]))
+        epoch, it_per_s, loss, val_loss = parse_progress(LINES[3])
+        self.assertEqual(epoch, 1)
+        self.assertAlmostEqual(it_per_s, 0.4)
+        self.assertTrue(math.isnan(val_loss))
+
+    def test_record_and_summarize(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "run" / "metrics"
+            with mock.patch.object(train_metrics, "gpu_memory_used", return_value=1234.0):
+                recorder = MetricsRecorder(path, 1000, "0,", interval=0)
+                for line in LINES:
+                    recorder(line)
+                recorder.close()
+
+            metrics = load_metrics(path)
+            self.assertEqual(len(metrics), 3)
+            self.assertEqual(list(metrics["epoch"]), [0, 0, 1])
+            self.assertAlmostEqual(metrics["positions_per_s"][1], 19660)
+            self.assertEqual(metrics["gpu_memory_mb"][0], 1234.0)
+
+            output = io.StringIO()
+            with redirect_stdout(output):
+                summarize_metrics(path)
+            self.assertIn("slowest epoch 1: 400 pos/s", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+import unittest
+import sys
+import os
+import signal
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from nettest import train
+from nettest.train import (
+    expected_timing,
+    record_timing,
+    run_chain,
+    run_conversion,
+    time_margin,
+)
+from nettest.utils import execute
+
+CHILD = """
+import signal, sys, time
+def stop(signum, frame):
+    print("checkpoint on", signal.Signals(signum).name, flush=True)
+    sys.exit(0)
+signal.signal(signal.SIGTERM, stop)
+print("ready", flush=True)
+time.sleep(30)
+"""
+
+
+class TestPreemption(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_time_margin(self):
+        self.assertEqual(time_margin({}), 30 * 60)
+        self.assertEqual(time_margin({"train": {"time_margin": 600}}), 600)
+
+        record_timing("shutdown", 100)
+        record_timing("conversion", 300)
+        record_timing("conversion", 200)
+        self.assertEqual(expected_timing("conversion"), 300)
+        self.assertEqual(time_margin({}), 600)
+
+        for _ in range(5):
+            record_timing("conversion", 10)
+        self.assertEqual(expected_timing("conversion"), 10)
+        self.assertEqual(time_margin({}), 5 * 60)
+
+    def test_execute_forwards_signals(self):
+        def terminate():
+            time.sleep(1)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        previous = signal.getsignal(signal.SIGTERM)
+        threading.Thread(target=terminate).start()
+        output = execute(
+            "child",
+            [sys.executable, "-c", CHILD],
+            Path.cwd(),
+            False,
+            forward_signals=[signal.SIGTERM],
+        )
+        self.assertIn("checkpoint on SIGTERM\n", output)
+        self.assertEqual(signal.getsignal(signal.SIGTERM), previous)
+
+
+class TestTrainerCommand(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_multi_gpu_trainer_checkpoints_on_stop(self):
+        calls = []
+
+        def fake_execute(name, cmd, cwd, fail_is_ok, **kwargs):
+            calls.append((cmd, kwargs))
+            return []
+
+        environment = {"train": {"devices": "0,1,2,3", "workers": 4, "threads": 2}}
+        run = {"binpacks": ["x.binpack"], "other_options": [], "max_epochs": 10, "resume": "none"}
+        with mock.patch.object(train, "execute", side_effect=fake_execute), mock.patch.object(
+            train, "gpu_placement", return_value=None
+        ), mock.patch.object(train, "supports_numactl", return_value=False):
+            train.train_on_binpacks(
+                environment, "abc", "None", run, Path.cwd(), [Path("x.binpack")], None
+            )
+
+        cmd, kwargs = calls[0]
+        self.assertEqual(cmd[:2], ["torchrun", "--nproc-per-node=4"])
+        self.assertTrue(cmd[2].endswith("stop_checkpoint.py"))
+        self.assertEqual(cmd[3:5], ["ddp_launcher.py", "train.py"])
+        # torchrun passes on SIGTERM only, the ranks checkpoint on it
+        self.assertEqual(
+            kwargs["forward_signals"],
+            {signal.SIGTERM: signal.SIGTERM, signal.SIGUSR1: signal.SIGTERM},
+        )
+
+
+class TestConversion(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_conversions_overlap(self):
+        checkpoints = Path.cwd() / "scratch" / "abc" / "run" / "checkpoints"
+        checkpoints.mkdir(parents=True)
+        torch.save({"epoch": 3}, checkpoints / "last.ckpt")
+
+        intervals = {}
+
+        def fake_execute(name, cmd, cwd, fail_is_ok, **kwargs):
+            start = time.monotonic()
+            time.sleep(0.5)
+            Path(cmd[4]).write_bytes(name.encode())
+            intervals[name] = (start, time.monotonic())
+            return []
+
+        convert = {"checkpoint2nnue": ["--features=HalfKAv2_hm"]}
+        with mock.patch.object(train, "execute", side_effect=fake_execute):
+            run_conversion({}, "abc", convert, Path.cwd())
+
+        pt = intervals["Convert to pt"]
+        nnue = intervals["Convert to nnue"]
+        self.assertLess(max(pt[0], nnue[0]), min(pt[1], nnue[1]))
+        self.assertTrue((Path.cwd() / "scratch" / "abc" / "final.yaml").exists())
+        self.assertTrue((checkpoints / "last.pt").exists())
+
+
+class TestChain(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.entries = [
+            {"current_sha": sha, "previous_sha": previous}
+            for sha, previous in [("a", "None"), ("a", "None"), ("b", "a"), ("c", "b")]
+        ]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def complete(self, environment, current_sha, previous_sha):
+        final = Path.cwd() / "scratch" / current_sha / "final.yaml"
+        final.parent.mkdir(parents=True, exist_ok=True)
+        final.write_text("final")
+
+    def test_chain_runs_until_budget(self):
+        ran = []
+
+        def run_step(environment, current_sha, previous_sha):
+            ran.append(current_sha)
+            self.complete(environment, current_sha, previous_sha)
+            # the first step uses most of the allocation
+            os.environ["SLURM_JOB_END_TIME"] = str(int(time.time()) + 600)
+
+        with mock.patch.object(train, "run_step", side_effect=run_step), mock.patch.dict(
+            os.environ, {"SLURM_JOB_END_TIME": str(int(time.time()) + 86400)}
+        ):
+            remaining = run_chain({"train": {"chain": True, "time_margin": 60}}, self.entries)
+
+        self.assertEqual(ran, ["a"])
+        self.assertEqual(remaining, self.entries[1:])
+
+    def test_incomplete_step_hands_off(self):
+        ran = []
+
+        def run_step(environment, current_sha, previous_sha):
+            ran.append(current_sha)
+            if current_sha != "b":
+                self.complete(environment, current_sha, previous_sha)
+
+        with mock.patch.object(train, "run_step", side_effect=run_step):
+            remaining = run_chain({"train": {"chain": True}}, self.entries)
+
+        self.assertEqual(ran, ["a", "a", "b"])
+        self.assertEqual(remaining, self.entries[3:])
+
+
+if __name__ == "__main__":
+    unittest.main()